@@ -0,0 +1,596 @@
+"""Benchmarks for the guild war bot.
+
+Runs against a throw-away SQLite file filled with synthetic data, never the
+live database:
+
+    python bench.py micro --members 300 --events 200 --out before.json
+    python bench.py micro --compare before.json
+    python bench.py export --registrations 100000
+    python bench.py archive --registrations 100000
+    python bench.py backup --registrations 100000
+    python bench.py member_cache --guild-members 20000
+    python bench.py chart --season-wars 500
+    python bench.py season --season-wars 500
+    python bench.py balance --members 300
+    python bench.py boards --board-members 2000
+    python bench.py search --registrations 100000
+    python bench.py lineup --members 300
+
+With no benchmark named, all of them run. Several names can be given at once
+(``python bench.py archive backup``).
+
+Every run prints a JSON report (``meta`` + ``results``) so numbers can be
+diffed between versions.
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import tempfile
+import time
+import tracemalloc
+
+import discord
+
+import main
+
+
+def generate_dataset(path, members=300, events=200, regs_per_event=120, leaves=40, active_events=5, seed=1234, closed_within_days=None):
+    """Fill all five tables of a fresh DB at ``path`` with seeded synthetic data.
+
+    ``events`` closed wars plus ``active_events`` open ones, each with
+    ``regs_per_event`` registrations drawn from ``members`` guild members.
+    Closed wars are stamped 2000-01-01 unless ``closed_within_days`` spreads
+    them evenly over that many days up to now. Returns the ids of the
+    active events.
+    """
+    rnd = random.Random(seed)
+    main.DB_NAME = path
+    main.ARCHIVE_DB_NAME = path + ".archive"
+    main.TRACE_FILE = path + ".trace.jsonl"
+    main.init_db()
+    conn = sqlite3.connect(path)
+    c = conn.cursor()
+    roles = ["DPS", "Tank", "Heal"]
+    weapons = ["Nameless Sword", "Nameless Spear", "Strategic Sword", "Vernal Umbrella", "Panacea Fan", "Inkwell Fan", "Hengdao", "Mortal Rope Dart"]
+    statuses = ["Full Time", "Round 1, Round 2, Round 3", "Round 5, Round 6, Round 7, Round 8", "Late Join", "Standby"]
+    teams = ["Team ATK", "Team Flex", "Team DEF"]
+    roster = [(uid, f"player_{uid}", rnd.choice(roles), " + ".join(rnd.sample(weapons, 2))) for uid in range(1, members + 1)]
+    c.executemany("INSERT INTO guild_members (user_id, username, role, weapons, joined_at) VALUES (?, ?, ?, ?, datetime('now', ?))",
+                  [(uid, name, role, wp, f"-{members - uid} minutes") for uid, name, role, wp in roster])
+    total = events + active_events
+    c.executemany("INSERT INTO events (event_id, title, date_str, time_str, teams, color, channel_id, message_id, active, team_limit, closed_at) VALUES (?, ?, ?, '19:30', ?, 3447003, ?, ?, ?, 0, ?)",
+                  [(i, f"Guild War {i}", f"{(i % 28) + 1:02}/{(i % 12) + 1:02}", "Team ATK|20,Team Flex|20,Team DEF|0", 900000 + i, 800000 + i,
+                    1 if i > events else 0, None if i > events else _closed_at(i, events, closed_within_days)) for i in range(1, total + 1)])
+    rows = []
+    for ev in range(1, total + 1):
+        for uid, name, role, wp in rnd.sample(roster, min(regs_per_event, members)):
+            team = "Absence" if rnd.random() < 0.05 else rnd.choice(teams)
+            status = rnd.choice(statuses)
+            rows.append((ev, uid, name, team, role, status, wp, f"-{rnd.randrange(100000)} seconds", main.round_mask(status)))
+    c.executemany("INSERT INTO registrations (event_id, user_id, username, team, role, time_text, weapons, joined_at, round_mask) VALUES (?, ?, ?, ?, ?, ?, ?, datetime('now', ?), ?)", rows)
+    leave_rows = []
+    for uid, name, _, _ in rnd.sample(roster, min(leaves, members)):
+        ltype = rnd.choice(["late", "1_day", "3_days", "7_days", "hiatus"])
+        expiry = None if ltype == "hiatus" else "2099-01-01 23:59:59"
+        leave_rows.append((uid, name, ltype, "3 วัน", expiry, "ติดงานช่วงค่ำ"))
+    c.executemany("INSERT INTO leave_records (user_id, username, leave_type, date_text, expiry_date, reason) VALUES (?, ?, ?, ?, ?, ?)", leave_rows)
+    c.executemany("INSERT INTO bot_config (config_name, guild_id, channel_id, message_id) VALUES (?, 1, ?, ?)", [("leave_board", 700001, 600001), ("member_board", 700002, 600002)])
+    main.rebuild_weapon_tables(c)
+    conn.commit()
+    conn.close()
+    main.invalidate_event_index()
+    return list(range(events + 1, total + 1))
+
+
+def _closed_at(i, events, within_days):
+    if not within_days: return "2000-01-01 00:00:00"
+    seconds = int(within_days * 86400 * (events - i) / max(events, 1))
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(time.time() - seconds))
+
+
+def seed_history(path, events=500, per_event=200, seed=1234):
+    # ประวัติวอที่ปิดแล้วล้วน ๆ: events * per_event แถว
+    generate_dataset(path, members=per_event, events=events, regs_per_event=per_event, leaves=0, active_events=0, seed=seed)
+
+
+def bench_export(args):
+    results = []
+    with _bench_dir() as tmp:
+        db = os.path.join(tmp, "bench.db")
+        per_event = 200
+        seed_history(db, events=max(1, args.registrations // per_event), per_event=per_event)
+        for fmt in ("csv", "jsonl"):
+            out_path = os.path.join(tmp, f"out.{fmt}.gz")
+            tracemalloc.start()
+            t0 = time.perf_counter()
+            with open(out_path, "wb") as fh:
+                count = main.write_history_export(fh, fmt)
+            elapsed = time.perf_counter() - t0
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            results.append({"bench": f"export_{fmt}", "rows": count, "seconds": round(elapsed, 4),
+                            "rows_per_sec": round(count / elapsed), "peak_kb": peak // 1024,
+                            "output_kb": os.path.getsize(out_path) // 1024})
+    return results
+
+
+@contextlib.contextmanager
+def _bench_dir():
+    # โฟลเดอร์ชั่วคราวของ bench หนึ่งตัว: ปิดไฟล์ trace (ที่ generate_dataset ชี้มาไว้ในนี้) ก่อนลบโฟลเดอร์
+    with tempfile.TemporaryDirectory() as tmp:
+        try: yield tmp
+        finally: main.stop_tracing()
+
+
+def _median_ms(fn, repeat=50):
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - t0)
+    samples.sort()
+    return round(samples[len(samples) // 2] * 1000, 3)
+
+
+def bench_archive(args):
+    # latency ของ query ฝั่ง hot path ก่อน/หลังย้ายประวัติเก่าไป archive
+    results = []
+    with _bench_dir() as tmp:
+        db = os.path.join(tmp, "bench.db")
+        per_event = 200
+        history = max(1, args.registrations // per_event)
+        seed_history(db, events=history, per_event=per_event)
+        live = []
+        for _ in range(3):
+            ev_id = main.create_event("Live War", "Today", "19:30", [{"name": "Team ATK", "limit": 20}, {"name": "Team Flex", "limit": 0}], 3447003)
+            for uid in range(1, 121):
+                main.reg_upsert(ev_id, uid, f"player_{uid}", "Team ATK" if uid % 2 else "Team Flex", "DPS", "Full Time", "-")
+            live.append(ev_id)
+
+        def quota_check():
+            conn = sqlite3.connect(main.DB_NAME)
+            conn.execute("SELECT user_id, time_text FROM registrations WHERE event_id=? AND team=?", (live[0], "Team ATK")).fetchall()
+            conn.close()
+
+        def active_events():
+            conn = sqlite3.connect(main.DB_NAME)
+            conn.execute("SELECT event_id, channel_id, message_id FROM events WHERE active=1").fetchall()
+            conn.close()
+
+        def roster_count():
+            conn = sqlite3.connect(main.DB_NAME)
+            conn.execute("SELECT COUNT(*) FROM registrations WHERE team != 'Absence'").fetchone()
+            conn.close()
+
+        queries = {"get_roster": lambda: main.get_roster(live[0]), "quota_check": quota_check,
+                   "active_events": active_events, "roster_scan": roster_count,
+                   "leaderboard": main.db_get_leaderboard}
+        # เก็บสำเนาก่อนย้ายไว้วัดสลับกับหลังย้าย: query ระดับ sub-ms ส่วนใหญ่คือค่าเปิด connection ซึ่งแกว่งตามสภาพเครื่อง
+        # วัดก่อนทั้งหมดแล้วค่อยวัดหลังจะได้ความต่างของเครื่อง ไม่ใช่ของข้อมูล
+        snapshot = (os.path.join(tmp, "before.db"), os.path.join(tmp, "before.db.archive"))
+        shutil.copy(db, snapshot[0])
+        shutil.copy(main.ARCHIVE_DB_NAME, snapshot[1])
+        hot_size_before = os.path.getsize(db)
+        t0 = time.perf_counter()
+        moved = 0
+        while True:
+            n = main.archive_closed_events(retention_days=30)
+            moved += n
+            if n < main.ARCHIVE_BATCH_EVENTS: break
+        archive_seconds = time.perf_counter() - t0
+        conn = sqlite3.connect(db)
+        conn.execute("VACUUM")
+        conn.close()
+        hot_size_after = os.path.getsize(db)
+        archived = (main.DB_NAME, main.ARCHIVE_DB_NAME)
+        before, after = {}, {}
+        for _ in range(5):
+            for paths, out in ((snapshot, before), (archived, after)):
+                main.DB_NAME, main.ARCHIVE_DB_NAME = paths
+                for name, fn in queries.items():
+                    ms = _median_ms(fn, repeat=20)
+                    out[name] = min(out.get(name, ms), ms)
+        main.DB_NAME, main.ARCHIVE_DB_NAME = archived
+        # ย้ายประวัติออกแล้ว VACUUM ไฟล์ hot ต้องเล็กลงจริง (ถ้า index ค้นหายังเก็บ tombstone ไว้ ไฟล์จะไม่ลด)
+        assert hot_size_after < hot_size_before, f"archive: hot DB did not shrink ({hot_size_before} -> {hot_size_after} bytes)"
+        for name in queries:
+            results.append({"bench": f"archive_{name}", "median_ms_before": before[name], "median_ms_after": after[name]})
+        results.append({"bench": "archive_job", "events_moved": moved, "seconds": round(archive_seconds, 3),
+                        "hot_kb_before": hot_size_before // 1024, "hot_kb_after": hot_size_after // 1024})
+    return results
+
+
+def _percentile(samples, pct):
+    samples = sorted(samples)
+    return round(samples[min(len(samples) - 1, int(len(samples) * pct / 100))] * 1000, 3)
+
+
+async def _interaction_latency(event_id, seconds):
+    # จำลองการกดปุ่มรีเฟรชซ้ำ ๆ: อ่าน DB + สร้าง embed บน event loop
+    samples = []
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        t0 = time.perf_counter()
+        main.create_dashboard_embed(event_id)
+        await asyncio.sleep(0)
+        samples.append(time.perf_counter() - t0)
+        await asyncio.sleep(0.005)
+    return samples
+
+
+def bench_backup(args):
+    # latency ของ interaction ระหว่างที่ backup รันใน worker thread เทียบกับตอนไม่มี backup
+    results = []
+    with _bench_dir() as tmp:
+        db = os.path.join(tmp, "bench.db")
+        per_event = 200
+        seed_history(db, events=max(1, args.registrations // per_event), per_event=per_event)
+        ev_id = main.create_event("Live War", "Today", "19:30", [{"name": "Team ATK", "limit": 30}, {"name": "Team Flex", "limit": 0}], 3447003)
+        for uid in range(1, 61):
+            main.reg_upsert(ev_id, uid, f"player_{uid}", "Team ATK" if uid % 2 else "Team Flex", "DPS", "Full Time", "-")
+
+        async def scenario():
+            idle = await _interaction_latency(ev_id, 1.0)
+            t0 = time.perf_counter()
+            task = asyncio.create_task(asyncio.to_thread(main.run_backups, os.path.join(tmp, "backups")))
+            busy = []
+            while not task.done():
+                busy += await _interaction_latency(ev_id, 0.2)
+            paths = await task
+            return idle, busy, paths, time.perf_counter() - t0
+
+        idle, busy, paths, seconds = asyncio.run(scenario())
+        raw = main.verify_backup(paths[0])
+        os.remove(raw)
+        results.append({"bench": "backup_interaction_idle", "p50_ms": _percentile(idle, 50), "p99_ms": _percentile(idle, 99), "samples": len(idle)})
+        results.append({"bench": "backup_interaction_during", "p50_ms": _percentile(busy, 50), "p99_ms": _percentile(busy, 99), "samples": len(busy)})
+        results.append({"bench": "backup_run", "seconds": round(seconds, 3), "db_kb": os.path.getsize(db) // 1024,
+                        "snapshot_kb": os.path.getsize(paths[0]) // 1024, "verified": True})
+    return results
+
+
+class FakeGateway:
+    # แทน DiscordWebSocket: request_chunks ตอบด้วย GUILD_MEMBERS_CHUNK (JSON ละ 1000 คน) ป้อนเข้า ConnectionState ทีละเฟรม
+    open = False  # Client.close() จะได้ไม่พยายามปิด socket จริง
+
+    def __init__(self, state, frames):
+        self.state = state
+        self.frames = frames
+        self.requests = 0
+
+    async def request_chunks(self, guild_id, query=None, *, limit, user_ids=None, presences=False, nonce=None):
+        self.requests += 1
+        asyncio.get_running_loop().create_task(self._feed(guild_id, nonce))
+
+    async def _feed(self, guild_id, nonce):
+        for i, raw in enumerate(self.frames):
+            await asyncio.sleep(0)  # แต่ละเฟรมมาจาก socket แยกกัน event loop ได้ทำงานอื่นคั่น
+            data = json.loads(raw)
+            data.update(guild_id=str(guild_id), chunk_index=i, chunk_count=len(self.frames), nonce=nonce)
+            self.state.parse_guild_members_chunk(data)
+
+
+def _rss_kb():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"): return int(line.split()[1])
+    except OSError:
+        pass
+    import resource  # ไม่มี /proc (macOS): ใช้ค่าสูงสุดแทน
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // (1024 if platform.system() == "Darwin" else 1)
+
+
+async def _member_cache_startup(mode, members):
+    # login จำลองหนึ่งครั้ง: READY -> GUILD_CREATE (กิลด์ใหญ่) -> (full) chunk ทั้งกิลด์ -> on_ready
+    # แล้ว (lazy) ขอรายชื่อแบบ /check_missing หนึ่งครั้ง วัดเวลาและ RSS ของ process นี้
+    import gc
+    from discord.ext import commands
+    role_ids = [str(10 + i) for i in range(8)]
+    frames = [json.dumps({"members": [{"user": {"id": str(100000 + i), "username": f"player_{i}", "discriminator": "0", "global_name": f"Player {i}", "avatar": None},
+                                       "roles": role_ids[: i % 4], "joined_at": "2024-01-01T00:00:00+00:00", "deaf": False, "mute": False, "flags": 0}
+                                      for i in range(start, min(start + 1000, members))]})
+              for start in range(0, members, 1000)]
+    bot = commands.Bot(command_prefix="!", **main.gateway_options(mode))
+    state = bot._connection
+    await bot._async_setup_hook()  # ที่ login() ทำก่อนต่อ gateway: ผูก loop และ event ready ของ client
+    state.guild_ready_timeout = 0.001  # ค่าจริง 2 วินาทีคือการรอ GUILD_CREATE ตัวถัดไป (เท่ากันทั้งสองโหมด) ตัดออก
+    bot.ws = gateway = FakeGateway(state, frames)
+    gc.collect()
+    rss_base = _rss_kb()
+    ready = asyncio.Event()
+    async def on_ready(): ready.set()
+    bot.add_listener(on_ready)
+    t0 = time.perf_counter()
+    state.parse_ready({"user": {"id": "1", "username": "bot", "discriminator": "0", "avatar": None, "bot": True},
+                       "guilds": [{"id": "42", "unavailable": True}], "application": {"id": "1", "flags": 0}})
+    state.parse_guild_create({"id": "42", "name": "bench", "member_count": members, "large": True, "roles": [], "emojis": [], "channels": [], "members": []})
+    await ready.wait()
+    ready_s = time.perf_counter() - t0
+    guild = bot.get_guild(42)
+    gc.collect()
+    row = {"bench": f"member_cache_{mode}", "members": members, "ready_seconds": round(ready_s, 3),
+           "cached_members": len(guild.members), "chunk_requests": gateway.requests, "rss_kb_at_ready": _rss_kb() - rss_base}
+    if mode == "lazy":
+        t0 = time.perf_counter()
+        fetched = await main.get_guild_members(guild)
+        row["on_demand_chunk_seconds"] = round(time.perf_counter() - t0, 3)
+        row["on_demand_members"] = len(fetched)
+        row["rss_kb_peak_on_demand"] = _rss_kb() - rss_base
+        del fetched
+        state._users.clear()
+        gc.collect()
+        row["rss_kb_after_on_demand"] = _rss_kb() - rss_base
+        row["cached_members_after"] = len(guild.members)
+    await bot.close()
+    return row
+
+
+def bench_member_cache(args):
+    """Startup time and RSS of a simulated login with ``--guild-members`` members, per MEMBER_CACHE_MODE.
+
+    Each mode runs in a fresh process. A fake gateway answers the chunk
+    request with JSON GUILD_MEMBERS_CHUNK frames of 1000 members, and the
+    frames go through discord.py's own ConnectionState. ``ready_seconds``
+    runs from READY to on_ready. It is CPU time only: network time for the
+    frames and the 2 s guild_ready_timeout, which both modes pay, are not
+    included. ``rss_kb_*`` is the RSS growth since just before login.
+
+    Measured on Linux x86_64, Python 3.11, discord.py 2.6.4, 20k members
+    (2 runs):
+
+        full:  ready 0.20-0.26 s, 20 chunks at login, 20000 cached, RSS +16.0 MB
+        lazy:  ready 0.002 s,     no chunks at login,     0 cached, RSS +0
+               first /check_missing chunks on demand in 0.17-0.20 s.
+               RSS +12.3 MB afterwards, with 0 Members kept. The rest is
+               freed memory that the allocator keeps for reuse; it does
+               not grow on later calls.
+    """
+    import subprocess
+    import sys
+    results = []
+    for mode in ("full", "lazy"):
+        code = f"import asyncio, json, bench; print(json.dumps(asyncio.run(bench._member_cache_startup({mode!r}, {int(args.guild_members)}))))"
+        out = subprocess.run([sys.executable, "-c", code], cwd=os.path.dirname(os.path.abspath(__file__)),
+                             capture_output=True, text=True, check=True).stdout
+        results.append(json.loads(out.strip().splitlines()[-1]))
+    return results
+
+
+def _timeit_us(fn, repeat):
+    fn()
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - t0)
+    samples.sort()
+    return {"median_us": round(samples[len(samples) // 2] * 1e6, 1), "min_us": round(samples[0] * 1e6, 1), "calls": repeat}
+
+
+def bench_micro(args):
+    # renderer และ DB helper แต่ละตัวบนชุดข้อมูลสังเคราะห์ขนาดตาม args
+    results = []
+    with _bench_dir() as tmp:
+        db = os.path.join(tmp, "bench.db")
+        active = generate_dataset(db, members=args.members, events=args.events, regs_per_event=args.regs_per_event,
+                                  leaves=args.leaves, active_events=args.active_events, seed=args.seed)
+        ev_id = active[0] if active else 1
+        loop = asyncio.new_event_loop()
+        cases = {
+            "create_dashboard_embed": lambda: main.create_dashboard_embed(ev_id),
+            "create_leave_board_embed": main.create_leave_board_embed,
+            "create_member_board_embed": main.create_member_board_embed,
+            "make_visual_bar": lambda: main.make_visual_bar(13, 4, 3),
+            "get_roster": lambda: main.get_roster(ev_id),
+            "db_get_leaderboard": main.db_get_leaderboard,
+            "event_autocomplete": lambda: loop.run_until_complete(main.event_autocomplete(None, "war")),
+            "weapon_index_event_view": lambda: main.weapon_index.event_view(ev_id),
+            "weapon_index_guild_lookup": lambda: (lambda members: [members[uid] for name in main.weapon_index.resolve("fan") for uid in main.weapon_index.guild.get(name, ())])(main.weapon_index.guild_view()),
+        }
+
+        all_active = list(active)
+        cases["dashboards_one_by_one"] = lambda: [main.create_dashboard_embed(e) for e in all_active]
+        cases["dashboards_batch"] = lambda: main.render_dashboards(all_active)
+
+        # ต้นทุนของ @instrumented เทียบกับ coroutine เปล่า (ปิด profiling): ปิด trace / สุ่มตาม TRACE_SAMPLE_RATE (ค่าเริ่มต้น) / เก็บทุก trace
+        async def noop(): pass
+        wrapped = main.instrumented("bench.noop")(noop)
+
+        async def drive(fn, n=1000, trace=None, sample=None):
+            saved = main.TRACE_ENABLED, main.TRACE_SAMPLE_RATE
+            if trace is not None: main.TRACE_ENABLED = trace
+            if sample is not None: main.TRACE_SAMPLE_RATE = sample
+            try:
+                for _ in range(n): await fn()
+            finally:
+                main.TRACE_ENABLED, main.TRACE_SAMPLE_RATE = saved
+        cases["noop_x1000_plain"] = lambda: loop.run_until_complete(drive(noop))
+        cases["noop_x1000_instrumented_off"] = lambda: loop.run_until_complete(drive(wrapped, trace=False))
+        cases["noop_x1000_instrumented_sampled"] = lambda: loop.run_until_complete(drive(wrapped, trace=True))
+        cases["noop_x1000_instrumented_unsampled"] = lambda: loop.run_until_complete(drive(wrapped, trace=True, sample=0.0))
+        cases["noop_x1000_instrumented_traced"] = lambda: loop.run_until_complete(drive(wrapped, trace=True, sample=1.0))
+        try:
+            for name, fn in cases.items():
+                repeat = args.repeat * 20 if name == "make_visual_bar" else args.repeat
+                results.append({"bench": name, **_timeit_us(fn, repeat)})
+        finally:
+            loop.close()
+    return results
+
+
+def bench_chart(args):
+    # /attendance_chart: รวมข้อมูลด้วย NumPy (ใน process หลัก) + render PNG (ใน worker) + cache hit
+    results = []
+    with _bench_dir() as tmp:
+        db = os.path.join(tmp, "bench.db")
+        generate_dataset(db, members=args.members, events=args.season_wars, regs_per_event=args.members,
+                         leaves=args.leaves, active_events=0, seed=args.seed, closed_within_days=365)
+        anchor = main.week_anchor()
+        for kind, weeks in (("weekly", 52), ("roles", 52)):
+            spec = main.attendance_chart_spec(kind, weeks, anchor=anchor)
+            results.append({"bench": f"chart_spec_{kind}", "median_ms": _median_ms(lambda: main.attendance_chart_spec(kind, weeks, anchor=anchor), repeat=10)})
+            t0 = time.perf_counter()
+            png = main.render_chart_png(spec)
+            results.append({"bench": f"chart_render_{kind}", "ms": round((time.perf_counter() - t0) * 1000, 1), "png_kb": len(png) // 1024})
+
+        async def cached():
+            await main.get_attendance_chart("weekly", 52)
+            t0 = time.perf_counter()
+            await main.get_attendance_chart("weekly", 52)
+            return (time.perf_counter() - t0) * 1000
+        try: results.append({"bench": "chart_cache_hit", "ms": round(asyncio.run(cached()), 2), "stats": dict(main.chart_stats)})
+        finally: main.close_chart_pool()
+    return results
+
+
+def bench_season(args):
+    # /season_report: โหลดคอลัมน์ + คำนวณตัวชี้วัดทั้งหมด + embed/CSV (เป้าหมาย < 1 วินาทีที่ 500 วอ x 300 คน)
+    # season_job (งานของ worker) ปิด trace ของ process ที่รันมัน: คืนค่าเดิมตอนจบ
+    results, tracing = [], main.TRACE_ENABLED
+    with _bench_dir() as tmp:
+        db = os.path.join(tmp, "bench.db")
+        generate_dataset(db, members=args.members, events=args.season_wars, regs_per_event=args.members,
+                         leaves=args.leaves, active_events=0, seed=args.seed, closed_within_days=365)
+        since = int(time.time()) - 400 * 86400
+        report = main.season_job(db, main.ARCHIVE_DB_NAME, since)[0]
+        results.append({"bench": "season_load_arrays", "median_ms": _median_ms(lambda: main.load_attendance_arrays(since), repeat=5)})
+        results.append({"bench": "season_metrics", "median_ms": _median_ms(lambda: main.season_metrics(since), repeat=5)})
+        results.append({"bench": "season_job", "median_ms": _median_ms(lambda: main.season_job(db, main.ARCHIVE_DB_NAME, since), repeat=5),
+                        "wars": len(report["events"]["event_id"]), "members": len(report["members"]["user_id"])})
+        results.append({"bench": "season_embeds_and_csv", "median_ms": _median_ms(lambda: (main.season_report_embeds(report, 400), main.write_season_csv(report)), repeat=5)})
+    main.TRACE_ENABLED = tracing
+    return results
+
+
+def bench_balance(args):
+    # /auto_balance: วางแผนจัดทีม (greedy + local search) สำหรับ Event ที่มีคนลงชื่อ --members คน แล้วเขียนในทรานแซกชันเดียว
+    results = []
+    with _bench_dir() as tmp:
+        db = os.path.join(tmp, "bench.db")
+        event_id = generate_dataset(db, members=args.members, events=0, regs_per_event=args.members, leaves=0, active_events=1, seed=args.seed)[0]
+        plan = main.plan_auto_balance(event_id)
+        results.append({"bench": "balance_plan", "median_ms": _median_ms(lambda: main.plan_auto_balance(event_id), repeat=10),
+                        "solve_ms": round(plan["solve_ms"], 2), "iterations": plan["iterations"], "moves": len(plan["moves"]),
+                        "cost_before": round(plan["cost_before"], 1), "cost_after": round(plan["cost_after"], 1)})
+        t0 = time.perf_counter()
+        applied = main.apply_auto_balance(plan, actor_id=0)
+        results.append({"bench": "balance_apply", "ms": round((time.perf_counter() - t0) * 1000, 2), "applied": applied})
+        results.append({"bench": "balance_replan", "moves": len(main.plan_auto_balance(event_id)["moves"])})
+    return results
+
+
+def bench_boards(args):
+    # บอร์ดทำเนียบ/แจ้งลาแบบแบ่งหน้า: โหลดครั้งแรก, เปิดหน้าที่ cache ไว้, แก้หนึ่งคนแล้ว render เฉพาะหน้าที่โดน
+    results = []
+    with _bench_dir() as tmp:
+        db = os.path.join(tmp, "bench.db")
+        generate_dataset(db, members=args.board_members, events=0, regs_per_event=0, leaves=args.board_members // 4, active_events=0, seed=args.seed)
+        for name, board, touch in (("member_board", main.member_board, lambda uid: main.member_upsert(uid, f"player_{uid}", "Heal", "Panacea Fan")),
+                                   ("leave_board", main.leave_board, lambda uid: main.leave_upsert(uid, f"player_{uid}", "late", "สาย 30 นาที", None, "รถติด"))):
+            board.changed()
+            t0 = time.perf_counter()
+            pages = len(board.pages())
+            for page in range(pages): board.page_embed(page)
+            cold_ms = (time.perf_counter() - t0) * 1000
+            results.append({"bench": f"{name}_cold_all_pages", "ms": round(cold_ms, 2), "pages": pages, "rows": len(board.rows)})
+            results.append({"bench": f"{name}_page_hit", **_timeit_us(lambda: board.page_embed(pages // 2), args.repeat)})
+            renders = board.stats["page_renders"]
+            t0 = time.perf_counter()
+            touch(args.board_members + 1)
+            for page in range(len(board.pages())): board.page_embed(page)
+            results.append({"bench": f"{name}_one_change_all_pages", "ms": round((time.perf_counter() - t0) * 1000, 2),
+                            "pages_rerendered": board.stats["page_renders"] - renders})
+    return results
+
+
+def bench_search(args):
+    # /search ผ่าน FTS5 trigram บนประวัติ --registrations แถว (ยังไม่ archive) + ทำเนียบ + ใบลา
+    results = []
+    with _bench_dir() as tmp:
+        db = os.path.join(tmp, "bench.db")
+        per_event = min(args.members, 200)
+        t0 = time.perf_counter()
+        generate_dataset(db, members=args.members, events=max(1, args.registrations // per_event), regs_per_event=per_event,
+                         leaves=args.leaves, active_events=args.active_events, seed=args.seed)
+        results.append({"bench": "search_dataset_with_triggers", "seconds": round(time.perf_counter() - t0, 2)})
+        for query in ("player_42", "Panacea", "ติดงาน", "Team Flex"):
+            hits = len(main.search_all(query))
+            results.append({"bench": f"search_{query}", "median_ms": _median_ms(lambda: main.search_all(query), repeat=20), "hits": hits})
+    return results
+
+
+def bench_lineup(args):
+    # /round_lineup: โหลดตารางรอบ x ทีม x ตำแหน่งครั้งแรก, เปิดซ้ำ, แล้วไล่ตาม log หลังมีคนเปลี่ยนหนึ่งคน
+    results = []
+    with _bench_dir() as tmp:
+        db = os.path.join(tmp, "bench.db")
+        event_id = generate_dataset(db, members=args.members, events=0, regs_per_event=args.members, leaves=0, active_events=1, seed=args.seed)[0]
+        ev = main.get_event(event_id)
+        main.lineup_index.drop_event(event_id)
+        t0 = time.perf_counter()
+        view = main.lineup_index.event_view(event_id)
+        results.append({"bench": "lineup_cold_load", "ms": round((time.perf_counter() - t0) * 1000, 2), "mains": len(view["regs"])})
+        results.append({"bench": "lineup_summary_hit", **_timeit_us(lambda: main.round_lineup_embed(ev, main.lineup_index.event_view(event_id)), args.repeat)})
+        results.append({"bench": "lineup_round_hit", **_timeit_us(lambda: main.round_lineup_embed(ev, main.lineup_index.event_view(event_id), 3), args.repeat)})
+        main.reg_upsert(event_id, args.members + 1, "late_comer", "Team ATK", "Tank", "Round 1, Round 2", "-")
+        t0 = time.perf_counter()
+        main.lineup_index.event_view(event_id)
+        results.append({"bench": "lineup_one_change", "ms": round((time.perf_counter() - t0) * 1000, 2), "loads": main.lineup_index.stats["event_loads"]})
+    return results
+
+
+BENCHES = {"micro": bench_micro, "export": bench_export, "archive": bench_archive, "backup": bench_backup, "member_cache": bench_member_cache, "chart": bench_chart, "season": bench_season, "balance": bench_balance, "boards": bench_boards, "search": bench_search, "lineup": bench_lineup}
+
+
+def _compare(results, baseline_path):
+    # เทียบกับไฟล์ JSON จากเวอร์ชันก่อน: ratio > 1 แปลว่าช้าลง
+    with open(baseline_path) as f: baseline = {r["bench"]: r for r in json.load(f)["results"]}
+    for r in results:
+        old = baseline.get(r["bench"])
+        if not old: continue
+        ratios = {k: round(v / old[k], 3) for k, v in r.items()
+                  if k.endswith(("_us", "_ms", "_ms_after", "seconds")) and isinstance(v, (int, float)) and isinstance(old.get(k), (int, float)) and old[k]}
+        if ratios: r["vs_baseline"] = ratios
+
+
+def run():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("bench", nargs="*", help=f"benchmarks to run: {', '.join(BENCHES)} (default: all)")
+    parser.add_argument("--registrations", type=int, default=100000, help="history size for export/archive/backup")
+    parser.add_argument("--members", type=int, default=300)
+    parser.add_argument("--events", type=int, default=200, help="closed events for micro")
+    parser.add_argument("--active-events", type=int, default=5)
+    parser.add_argument("--regs-per-event", type=int, default=120)
+    parser.add_argument("--leaves", type=int, default=40)
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--season-wars", type=int, default=500, help="closed wars spread over the last year for chart/season")
+    parser.add_argument("--guild-members", type=int, default=20000, help="guild size for member_cache")
+    parser.add_argument("--board-members", type=int, default=2000, help="registered members for boards (leaves = a quarter of them)")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--out", help="also write the JSON report to this file")
+    parser.add_argument("--compare", help="JSON report from a previous run to compare against")
+    args = parser.parse_args()
+    unknown = set(args.bench) - set(BENCHES)
+    if unknown: parser.error(f"unknown benchmark: {', '.join(sorted(unknown))}")
+    results = []
+    for name in args.bench or list(BENCHES):
+        results += BENCHES[name](args)
+    if args.compare: _compare(results, args.compare)
+    scales = {k: getattr(args, k) for k in ("registrations", "members", "events", "active_events", "regs_per_event", "leaves", "repeat", "season_wars", "guild_members", "board_members", "seed")}
+    report = {"meta": {"python": platform.python_version(), "sqlite": sqlite3.sqlite_version, "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "scales": scales},
+              "results": results}
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.out:
+        with open(args.out, "w") as f: f.write(text)
+    print(text)
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,620 @@
+"""End-to-end load tests for the guild war bot without a real Discord guild.
+
+Fake Interaction / Message / Channel / Guild / Member objects stand in for
+discord.py. They record every send and edit, simulate REST latency, and
+simulate per-route 429 rate limits. On a 429 they wait retry_after and
+retry, the same way discord.py does. Each scenario runs against a
+throw-away SQLite file:
+
+    python loadtest.py signup_rush --players 300
+    python loadtest.py leave_expiry close_war --time-scale 0.05
+    python loadtest.py quota_rush --quota-players 60 --quota-limit 10
+
+--time-scale multiplies every simulated wait (latency and retry_after) so
+long scenarios finish quickly. Reported latencies are wall-clock times.
+"""
+import argparse
+import asyncio
+import collections
+import itertools
+import json
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from datetime import timedelta
+
+import main
+
+_ids = itertools.count(10_000_000)
+
+
+# ==========================================
+# 🌐 SIMULATED REST LAYER
+# ==========================================
+class FakeRest:
+    def __init__(self, latency_ms=80.0, jitter_ms=40.0, edit_limit=5, edit_window=5.0, send_limit=5, send_window=5.0, time_scale=1.0, seed=7):
+        self.latency = latency_ms / 1000
+        self.jitter = jitter_ms / 1000
+        self.limits = {"message_edit": (edit_limit, edit_window), "message_send": (send_limit, send_window), "message_delete": (edit_limit, edit_window)}
+        self.time_scale = time_scale
+        self.rnd = random.Random(seed)
+        self.calls = collections.Counter()
+        self.rate_limited = collections.Counter()
+        self._windows = collections.defaultdict(collections.deque)
+
+    async def _sleep(self, seconds):
+        if seconds > 0: await asyncio.sleep(seconds * self.time_scale)
+
+    def _retry_after(self, kind, bucket):
+        if kind not in self.limits: return 0.0
+        limit, window = self.limits[kind]
+        now = time.perf_counter() / self.time_scale if self.time_scale else 0.0
+        hits = self._windows[(kind, bucket)]
+        while hits and now - hits[0] >= window: hits.popleft()
+        if len(hits) < limit:
+            hits.append(now)
+            return 0.0
+        return window - (now - hits[0])
+
+    async def request(self, kind, bucket=None):
+        while True:
+            retry_after = self._retry_after(kind, bucket)
+            if retry_after <= 0: break
+            self.rate_limited[kind] += 1
+            await self._sleep(retry_after)
+        self.calls[kind] += 1
+        await self._sleep(max(0.0, self.latency + self.rnd.uniform(-self.jitter, self.jitter)))
+
+    def reset(self):
+        self.calls.clear()
+        self.rate_limited.clear()
+        self._windows.clear()
+
+
+# ==========================================
+# 🎭 FAKE DISCORD OBJECTS
+# ==========================================
+class FakeAsset:
+    url = "https://cdn.discordapp.com/embed/avatars/0.png"
+
+
+class FakePermissions:
+    def __init__(self, administrator=False):
+        self.administrator = administrator
+
+
+class FakeMember:
+    def __init__(self, user_id, name, administrator=False, bot=False):
+        self.id = user_id
+        self.name = name
+        self.display_name = name
+        self.bot = bot
+        self.mention = f"<@{user_id}>"
+        self.guild_permissions = FakePermissions(administrator)
+        self.display_avatar = FakeAsset()
+        self.role_ids = set()
+
+    def get_role(self, role_id):
+        return role_id if role_id in self.role_ids else None
+
+
+class FakeMessage:
+    def __init__(self, rest, channel, content=None, embed=None, view=None):
+        self.id = next(_ids)
+        self.rest = rest
+        self.channel = channel
+        self.content = content
+        self.embed = embed
+        self.view = view
+        self.edits = 0
+        self.deleted = False
+
+    async def edit(self, **kwargs):
+        await self.rest.request("message_edit", self.channel.id)
+        self.edits += 1
+        if "content" in kwargs: self.content = kwargs["content"]
+        if "embed" in kwargs: self.embed = kwargs["embed"]
+        if "view" in kwargs: self.view = kwargs["view"]
+        return self
+
+    async def delete(self, **kwargs):
+        await self.rest.request("message_delete", self.channel.id)
+        self.deleted = True
+        self.channel.messages.pop(self.id, None)
+
+
+class FakeChannel:
+    def __init__(self, rest, channel_id=None, name="channel"):
+        self.id = channel_id or next(_ids)
+        self.name = name
+        self.rest = rest
+        self.messages = {}
+        self.sent = []
+
+    def _store(self, content=None, embed=None, view=None):
+        msg = FakeMessage(self.rest, self, content, embed, view)
+        self.messages[msg.id] = msg
+        return msg
+
+    async def send(self, content=None, *, embed=None, view=None, file=None, **kwargs):
+        await self.rest.request("message_send", self.id)
+        msg = self._store(content, embed, view)
+        self.sent.append(msg)
+        return msg
+
+    async def fetch_message(self, message_id):
+        await self.rest.request("message_fetch", self.id)
+        if message_id not in self.messages: raise LookupError(f"Unknown message {message_id}")
+        return self.messages[message_id]
+
+    def get_partial_message(self, message_id):
+        return self.messages.get(message_id) or FakeMessage(self.rest, self)
+
+
+class FakeRole:
+    def __init__(self, members):
+        self.id = next(_ids)
+        self.members = members
+        for m in members: m.role_ids.add(self.id)
+
+
+class FakeGuild:
+    def __init__(self, rest, members):
+        self.id = next(_ids)
+        self.rest = rest
+        self.members = members
+        # โหมด lazy ของบอท: ยังไม่ได้ chunk จนกว่าจะมีคำสั่งที่ต้องใช้รายชื่อทั้งกิลด์
+        self.chunked = main.MEMBER_CACHE_MODE == "full"
+        self.filesize_limit = 25 * 1024 * 1024
+
+    async def chunk(self, *, cache=True):
+        await self.rest.request("guild_chunk", self.id)
+        if cache: self.chunked = True
+        return self.members
+
+
+class FakeClient:
+    def __init__(self, rest):
+        self.rest = rest
+        self.channels = {}
+        for ch_id, name in ((main.LOG_CHANNEL_ID, "log"), (main.HISTORY_CHANNEL_ID, "history"), (main.ALERT_CHANNEL_ID_FIXED, "alert")):
+            self.channels[ch_id] = FakeChannel(rest, ch_id, name)
+
+    def add_channel(self, name):
+        ch = FakeChannel(self.rest, name=name)
+        self.channels[ch.id] = ch
+        return ch
+
+    def get_channel(self, channel_id):
+        return self.channels.get(channel_id)
+
+
+class FakeResponse:
+    def __init__(self, interaction):
+        self.interaction = interaction
+        self._done = False
+        self.sent = []
+
+    def is_done(self):
+        return self._done
+
+    async def _callback(self, **record):
+        if self._done: raise RuntimeError("This interaction has already been responded to before")
+        await self.interaction.rest.request("interaction_response")
+        self._done = True
+        self.sent.append(record)
+
+    async def send_message(self, content=None, **kwargs):
+        await self._callback(type="send_message", content=content, **kwargs)
+
+    async def edit_message(self, **kwargs):
+        await self._callback(type="edit_message", **kwargs)
+        if self.interaction.message is not None and "embed" in kwargs: self.interaction.message.embed = kwargs["embed"]
+
+    async def defer(self, **kwargs):
+        await self._callback(type="defer", **kwargs)
+
+    async def send_modal(self, modal):
+        await self._callback(type="modal", modal=modal)
+
+
+class FakeFollowup:
+    def __init__(self, interaction):
+        self.interaction = interaction
+        self.sent = []
+
+    async def send(self, content=None, **kwargs):
+        await self.interaction.rest.request("followup")
+        self.sent.append(dict(content=content, **kwargs))
+
+
+class FakeInteraction:
+    def __init__(self, client, user, guild=None, channel=None, message=None):
+        self.id = next(_ids)
+        self.client = client
+        self.rest = client.rest
+        self.user = user
+        self.guild = guild
+        self.channel = channel
+        self.message = message
+        self.response = FakeResponse(self)
+        self.followup = FakeFollowup(self)
+
+    async def edit_original_response(self, **kwargs):
+        await self.rest.request("followup")
+
+    async def delete_original_response(self):
+        await self.rest.request("followup")
+
+    def last_view(self):
+        for record in reversed(self.response.sent):
+            if record.get("view") is not None: return record["view"]
+        return None
+
+
+# ==========================================
+# 🏁 SCENARIOS
+# ==========================================
+def _percentile(samples, pct):
+    if not samples: return None
+    samples = sorted(samples)
+    return round(samples[min(len(samples) - 1, int(len(samples) * pct / 100))] * 1000, 2)
+
+
+def _report(name, rest, latencies, elapsed, **extra):
+    return {"scenario": name, "operations": len(latencies), "seconds": round(elapsed, 3),
+            "throughput_per_sec": round(len(latencies) / elapsed, 1) if elapsed else None,
+            "p50_ms": _percentile(latencies, 50), "p99_ms": _percentile(latencies, 99),
+            "api_calls": sum(rest.calls.values()), "api_calls_by_kind": dict(rest.calls),
+            "rate_limited": dict(rest.rate_limited), **extra}
+
+
+def _fresh_db(tmp):
+    main.DB_NAME = os.path.join(tmp, "loadtest.db")
+    main.ARCHIVE_DB_NAME = os.path.join(tmp, "loadtest_archive.db")
+    main.TRACE_FILE = os.path.join(tmp, "trace.jsonl")
+    main.WARM_STATE_FILE = os.path.join(tmp, "warm_state.json")
+    for path in (main.DB_NAME, main.ARCHIVE_DB_NAME, main.WARM_STATE_FILE):
+        if os.path.exists(path): os.remove(path)
+    main.warm_state.update(rendered={}, reminders={}, event_index=None, command_hash=None)
+    main.init_db()
+
+
+def _install(client):
+    # คำสั่ง close_war / auto_reminder ใช้ตัวแปร bot ระดับโมดูล จึงชี้ get_channel ไปที่ FakeClient
+    main.bot.get_channel = client.get_channel
+
+
+async def _post_dashboard(client, channel, title, teams):
+    ev_id = main.create_event(title, "Today", "19:30", teams, 0x3498db)
+    msg = channel._store(embed=main.create_dashboard_embed(ev_id), view=main.PersistentWarView(ev_id))
+    main.update_event_msg(ev_id, channel.id, msg.id)
+    return ev_id, msg
+
+
+async def _drain_background():
+    pending = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+    if pending: await asyncio.gather(*pending, return_exceptions=True)
+
+
+async def scenario_signup_rush(args, rest):
+    # ผู้เล่นทุกคนกด "ลงชื่อ" แล้วกด "บันทึก" พร้อมกัน
+    client = FakeClient(rest)
+    _install(client)
+    channel = client.add_channel("war-signup")
+    ev_id, dashboard = await _post_dashboard(client, channel, "Signup Rush", [{"name": "Team ATK", "limit": args.players // 3}, {"name": "Team Flex", "limit": 0}, {"name": "Team DEF", "limit": 0}])
+    players = [FakeMember(1000 + i, f"player_{i}") for i in range(args.players)]
+    guild = FakeGuild(rest, players)
+    rnd = random.Random(args.seed)
+    rest.reset()
+
+    async def player(member):
+        t0 = time.perf_counter()
+        inter = FakeInteraction(client, member, guild, channel, dashboard)
+        await main.PersistentWarView(ev_id).register(inter)
+        view = inter.last_view()
+        view.sel_team._values = [rnd.choice(["Team ATK", "Team Flex", "Team DEF"])]
+        view.sel_role._values = [rnd.choice(["DPS", "Tank", "Heal"])]
+        view.sel_status._values = [rnd.choice(["Full Time", "Round 1", "Late Join", "Standby"])]
+        view.sel_weapon._values = ["Nameless Sword", "Panacea Fan"]
+        await view.submit(FakeInteraction(client, member, guild, channel, dashboard))
+        return time.perf_counter() - t0
+
+    writes_before = dict(main.write_queue.stats)
+    t0 = time.perf_counter()
+    latencies = await asyncio.gather(*(player(m) for m in players))
+    await _drain_background()
+    elapsed = time.perf_counter() - t0
+    return _report("signup_rush", rest, latencies, elapsed, players=args.players, registered=len(main.get_roster(ev_id)), dashboard_edits=dashboard.edits,
+                   db_writes=_write_delta(writes_before, elapsed))
+
+
+async def scenario_quota_rush(args, rest):
+    # ทุกคนกดลงทีมเดียวกันแบบตัวจริงพร้อมกัน: ตัวจริงต้องไม่เกินโควต้า (ที่เหลือต้องถูกย้ายไป Standby)
+    client = FakeClient(rest)
+    _install(client)
+    channel = client.add_channel("war-signup")
+    limit = args.quota_limit
+    ev_id, dashboard = await _post_dashboard(client, channel, "Quota Rush", [{"name": "Team ATK", "limit": limit}])
+    players = [FakeMember(1000 + i, f"player_{i}") for i in range(args.quota_players)]
+    guild = FakeGuild(rest, players)
+    rest.reset()
+
+    async def player(member):
+        t0 = time.perf_counter()
+        inter = FakeInteraction(client, member, guild, channel, dashboard)
+        await main.PersistentWarView(ev_id).register(inter)
+        view = inter.last_view()
+        view.sel_team._values = ["Team ATK"]
+        view.sel_role._values = ["DPS"]
+        view.sel_status._values = ["Full Time"]
+        view.sel_weapon._values = ["Nameless Sword"]
+        await view.submit(FakeInteraction(client, member, guild, channel, dashboard))
+        return time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    latencies = await asyncio.gather(*(player(m) for m in players))
+    await _drain_background()
+    elapsed = time.perf_counter() - t0
+    roster = main.get_roster(ev_id)
+    mains = sum(1 for p in roster if main.attendance_status(p[2], p[4]) == "Main")
+    assert mains <= limit, f"quota_rush: {mains} Main players for a limit of {limit}"
+    return _report("quota_rush", rest, latencies, elapsed, players=len(players), limit=limit, mains=mains,
+                   standby=sum(1 for p in roster if main.attendance_status(p[2], p[4]) == "Standby"))
+
+
+def _write_delta(before, elapsed):
+    # นับ commit จาก write_queue.stats (ไม่ได้วัด fsync จริง)
+    after = main.write_queue.stats
+    writes = after["writes"] - before["writes"]
+    commits = after["commits"] - before["commits"]
+    return {"writes": writes, "commits": commits, "coalesced": after["coalesced"] - before["coalesced"],
+            "commits_per_sec": round(commits / elapsed, 1) if elapsed else None, "writes_per_commit": round(writes / commits, 1) if commits else None}
+
+
+async def scenario_write_burst(args, rest):
+    # เขียนพร้อมกัน args.players รายการ: แบบเดิม (commit ทีละรายการ) เทียบกับ group commit
+    ev_id = main.create_event("Write Burst", "Today", "19:30", [{"name": "Team ATK", "limit": 0}], 0x3498db)
+
+    async def direct(uid):
+        t0 = time.perf_counter()
+        main.reg_upsert(ev_id, uid, f"player_{uid}", "Team ATK", "DPS", "Full Time", "-")
+        await asyncio.sleep(0)
+        return time.perf_counter() - t0
+
+    async def batched(uid):
+        t0 = time.perf_counter()
+        await main.reg_upsert_async(ev_id, uid, f"player_{uid}", "Team ATK", "DPS", "Round 1", "-")
+        return time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    direct_lat = await asyncio.gather(*(direct(1000 + i) for i in range(args.players)))
+    direct_elapsed = time.perf_counter() - t0
+    before = dict(main.write_queue.stats)
+    t0 = time.perf_counter()
+    batched_lat = await asyncio.gather(*(batched(1000 + i) for i in range(args.players)))
+    batched_elapsed = time.perf_counter() - t0
+    return _report("write_burst", rest, batched_lat, batched_elapsed,
+                   db_writes=_write_delta(before, batched_elapsed),
+                   direct={"seconds": round(direct_elapsed, 3), "commits": args.players,
+                           "commits_per_sec": round(args.players / direct_elapsed, 1), "p99_ms": _percentile(direct_lat, 99)})
+
+
+async def scenario_leave_expiry(args, rest):
+    # ใบลาหมดอายุพร้อมกันจำนวนมาก -> auto_reminder เคลียร์และรีเฟรชทุกตารางวอ
+    client = FakeClient(rest)
+    _install(client)
+    channel = client.add_channel("war-signup")
+    events = []
+    for i in range(args.events):
+        ev_id, msg = await _post_dashboard(client, channel, f"War {i + 1}", [{"name": "Team ATK", "limit": 0}, {"name": "Team Flex", "limit": 0}])
+        for uid in range(args.players // 2):
+            main.reg_upsert(ev_id, 1000 + uid, f"player_{uid}", "Team ATK" if uid % 2 else "Team Flex", "DPS", "Full Time", "-")
+        events.append(msg)
+    expired = (main.bangkok_now() - timedelta(days=1)).strftime("%Y-%m-%d %H:%M:%S")
+    conn = sqlite3.connect(main.DB_NAME)
+    conn.executemany("INSERT OR REPLACE INTO leave_records (user_id, username, leave_type, date_text, expiry_date, reason) VALUES (?, ?, '1_day', '1 วัน', ?, 'ติดธุระ')",
+                     [(5000 + i, f"leaver_{i}", expired) for i in range(args.leaves)])
+    conn.commit()
+    conn.close()
+    rest.reset()
+    t0 = time.perf_counter()
+    await main.auto_reminder.coro()
+    await _drain_background()
+    elapsed = time.perf_counter() - t0
+    return _report("leave_expiry", rest, [elapsed], elapsed, events=args.events, leaves_expired=args.leaves,
+                   dashboard_edits=sum(m.edits for m in events))
+
+
+async def scenario_close_war(args, rest):
+    # แอดมินปิดวอหลายรายการติดกัน
+    client = FakeClient(rest)
+    _install(client)
+    channel = client.add_channel("war-signup")
+    admin = FakeMember(1, "admin", administrator=True)
+    guild = FakeGuild(rest, [admin])
+    ids = []
+    for i in range(args.events):
+        ev_id, _ = await _post_dashboard(client, channel, f"War {i + 1}", [{"name": "Team ATK", "limit": 0}, {"name": "Team Flex", "limit": 0}])
+        for uid in range(args.players // 2):
+            main.reg_upsert(ev_id, 1000 + uid, f"player_{uid}", "Team ATK" if uid % 2 else "Team Flex", "DPS", "Full Time", "-")
+        ids.append(ev_id)
+    rest.reset()
+    latencies = []
+    t0 = time.perf_counter()
+    for ev_id in ids:
+        t1 = time.perf_counter()
+        await main.close_war.callback(FakeInteraction(client, admin, guild, channel), ev_id)
+        latencies.append(time.perf_counter() - t1)
+    await _drain_background()
+    elapsed = time.perf_counter() - t0
+    return _report("close_war", rest, latencies, elapsed, events=args.events,
+                   history_posts=len(client.get_channel(main.HISTORY_CHANNEL_ID).sent))
+
+
+async def scenario_roll_call(args, rest):
+    # แอดมินเช็คคนขาด/คนยังไม่ลงทะเบียน: โหมด lazy ต้อง chunk จาก gateway ทุกครั้งที่เรียก
+    client = FakeClient(rest)
+    _install(client)
+    channel = client.add_channel("war-signup")
+    admin = FakeMember(1, "admin", administrator=True)
+    players = [FakeMember(1000 + uid, f"player_{uid}") for uid in range(args.players)]
+    guild = FakeGuild(rest, [admin] + players)
+    role = FakeRole(players[::2])
+    ev_id, _ = await _post_dashboard(client, channel, "War 1", [{"name": "Team ATK", "limit": 0}])
+    for m in players[: args.players // 2]:
+        main.reg_upsert(ev_id, m.id, m.name, "Team ATK", "DPS", "Full Time", "-")
+        main.member_upsert(m.id, m.name, "DPS", "-")
+    rest.reset()
+    latencies = []
+    t0 = time.perf_counter()
+    for i in range(args.events):
+        t1 = time.perf_counter()
+        await main.check_missing.callback(FakeInteraction(client, admin, guild, channel), ev_id, role if i % 2 else None)
+        await main.call_unregistered.callback(FakeInteraction(client, admin, guild, channel), role if i % 2 else None)
+        latencies.append(time.perf_counter() - t1)
+    elapsed = time.perf_counter() - t0
+    return _report("roll_call", rest, latencies, elapsed, member_cache=main.MEMBER_CACHE_MODE,
+                   guild_members=len(guild.members), chunk_requests=rest.calls["guild_chunk"])
+
+
+async def scenario_button_spam(args, rest):
+    # สมาชิกใจร้อนกด 🔄 / 🔍 / 📋 รัว ๆ ก่อนวอ: เทียบแบบมี token bucket กับแบบปิด throttle
+    client = FakeClient(rest)
+    _install(client)
+    channel = client.add_channel("war-signup")
+    ev_id, dashboard = await _post_dashboard(client, channel, "Spam", [{"name": "Team ATK", "limit": 0}, {"name": "Team Flex", "limit": 0}])
+    for uid in range(args.players):
+        main.reg_upsert(ev_id, 1000 + uid, f"player_{uid}", "Team ATK" if uid % 2 else "Team Flex", "DPS", "Full Time", "Sword")
+    spammers = [FakeMember(5000 + i, f"spammer_{i}") for i in range(20)]
+    guild = FakeGuild(rest, spammers)
+    view = main.PersistentWarView(ev_id)
+    runs = {}
+    limits = main.BUTTON_THROTTLE
+    for mode in ("throttled", "unthrottled"):
+        main.BUTTON_THROTTLE = limits if mode == "throttled" else {}
+        main.button_buckets.clear()
+        main.throttle_stats.clear()
+        latencies = []
+
+        async def spam(member):
+            for i in range(10):
+                t1 = time.perf_counter()
+                action = (view.refresh, view.check_weapons, view.copy)[i % 3]
+                await action(FakeInteraction(client, member, guild, channel, dashboard))
+                latencies.append(time.perf_counter() - t1)
+
+        t0 = time.perf_counter()
+        await asyncio.gather(*(spam(m) for m in spammers))
+        runs[mode] = {"seconds": round(time.perf_counter() - t0, 3), "p99_ms": _percentile(latencies, 99),
+                      "throttle": {k: dict(v) for k, v in main.throttle_stats.items()}}
+    main.BUTTON_THROTTLE = limits
+    return {"scenario": "button_spam", "clicks": len(spammers) * 10, **runs}
+
+
+def _seed_closed_wars(wars, players, seed):
+    # วอที่ปิดแล้วกระจายย้อนหลัง 1 ปี สำหรับ scenario ที่ต้องใช้ประวัติ
+    rnd = random.Random(seed)
+    conn = sqlite3.connect(main.DB_NAME)
+    now = time.time()
+    conn.executemany("INSERT INTO events (event_id, title, date_str, time_str, teams, color, active, team_limit, closed_at) VALUES (?, ?, '-', '19:30', 'Team ATK|0', 0, 0, 0, ?)",
+                     [(i, f"Old War {i}", time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(now - (wars - i) * 365 * 86400 / wars))) for i in range(1, wars + 1)])
+    conn.executemany("INSERT INTO registrations (event_id, user_id, username, team, role, time_text, weapons) VALUES (?, ?, ?, ?, ?, ?, '-')",
+                     [(i, 1000 + uid, f"player_{uid}", "Absence" if rnd.random() < 0.1 else "Team ATK", rnd.choice(["DPS", "Tank", "Heal"]), rnd.choice(["Full Time", "Late Join", "Standby"]))
+                      for i in range(1, wars + 1) for uid in range(players)])
+    conn.commit()
+    conn.close()
+
+
+async def scenario_chart_load(args, rest):
+    # แอดมินขอกราฟพร้อมกันระหว่างที่ผู้เล่นกดลงชื่อ: วัดความหน่วงของ event loop เทียบ render ใน loop ตรง ๆ กับ process pool
+    client = FakeClient(rest)
+    _install(client)
+    channel = client.add_channel("war-signup")
+    _seed_closed_wars(300, args.players, args.seed)
+    admin = FakeMember(1, "admin", administrator=True)
+    players = [FakeMember(1000 + i, f"player_{i}") for i in range(args.players)]
+    guild = FakeGuild(rest, [admin] + players)
+    requests = [("weekly", 52), ("roles", 52), ("weekly", 26), ("roles", 12)]
+    out = {"scenario": "chart_load", "wars": 300, "players": args.players}
+    for mode in ("no_charts", "inline", "pool"):
+        ev_id, dashboard = await _post_dashboard(client, channel, f"Live War ({mode})", [{"name": "Team ATK", "limit": 0}])
+        main.chart_cache.clear()
+        lags = []
+        stop = asyncio.Event()
+
+        async def ticker():
+            while not stop.is_set():
+                t0 = time.perf_counter()
+                await asyncio.sleep(0.01)
+                lags.append(time.perf_counter() - t0 - 0.01)
+
+        async def chart(kind, weeks):
+            if mode == "inline":
+                spec = main.attendance_chart_spec(kind, weeks)
+                main.render_chart_png(spec)
+            else:
+                await main.attendance_chart.callback(FakeInteraction(client, admin, guild, channel), kind, weeks, None)
+
+        async def signup(member):
+            await asyncio.sleep(random.random() * 0.5)
+            t0 = time.perf_counter()
+            await main.reg_upsert_async(ev_id, member.id, member.name, "Team ATK", "DPS", "Full Time", "-")
+            await main.refresh_war_dashboard(client, ev_id)
+            return time.perf_counter() - t0
+
+        if mode == "pool":
+            # worker ของ pool spawn ครั้งแรกช้า (import) — อุ่นทุกตัวก่อนจับเวลา
+            loop = asyncio.get_running_loop()
+            await asyncio.gather(*(loop.run_in_executor(main.get_chart_pool(), time.sleep, 0.2) for _ in range(main.CHART_WORKERS)))
+        tick = asyncio.create_task(ticker())
+        t0 = time.perf_counter()
+        charts = [] if mode == "no_charts" else [chart(k, w) for k, w in requests]
+        results = await asyncio.gather(*charts, *(signup(m) for m in players))
+        elapsed = time.perf_counter() - t0
+        stop.set()
+        await tick
+        signups = [r for r in results if r is not None]
+        out[mode] = {"seconds": round(elapsed, 3), "max_loop_lag_ms": round(max(lags) * 1000, 1), "p99_loop_lag_ms": _percentile(lags, 99),
+                     "signup_p99_ms": _percentile(signups, 99), "charts": len(charts)}
+    out["chart_stats"] = dict(main.chart_stats)
+    main.close_chart_pool()
+    return out
+
+
+SCENARIOS = {"signup_rush": scenario_signup_rush, "leave_expiry": scenario_leave_expiry, "close_war": scenario_close_war,
+             "write_burst": scenario_write_burst, "roll_call": scenario_roll_call, "button_spam": scenario_button_spam,
+             "chart_load": scenario_chart_load, "quota_rush": scenario_quota_rush}
+
+
+def run():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("scenario", nargs="*", help=f"scenarios to run: {', '.join(SCENARIOS)} (default: all)")
+    parser.add_argument("--players", type=int, default=300)
+    parser.add_argument("--events", type=int, default=5)
+    parser.add_argument("--leaves", type=int, default=100)
+    parser.add_argument("--quota-players", type=int, default=60, help="concurrent joins in quota_rush")
+    parser.add_argument("--quota-limit", type=int, default=10, help="Main quota of the team in quota_rush")
+    parser.add_argument("--latency-ms", type=float, default=80.0)
+    parser.add_argument("--jitter-ms", type=float, default=40.0)
+    parser.add_argument("--edit-limit", type=int, default=5, help="message edits per channel per window")
+    parser.add_argument("--edit-window", type=float, default=5.0)
+    parser.add_argument("--time-scale", type=float, default=0.05)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+    unknown = set(args.scenario) - set(SCENARIOS)
+    if unknown: parser.error(f"unknown scenario: {', '.join(sorted(unknown))}")
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for name in args.scenario or list(SCENARIOS):
+            _fresh_db(tmp)
+            rest = FakeRest(args.latency_ms, args.jitter_ms, args.edit_limit, args.edit_window, time_scale=args.time_scale, seed=args.seed)
+            try: results.append(asyncio.run(SCENARIOS[name](args, rest)))
+            finally: main.stop_tracing()
+    print(json.dumps(results, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    run()
@@ -6,7 +6,31 @@ from discord.ext import commands, tasks
 from discord.ui import Button, View, Select, Modal, TextInput
 import sqlite3
 import pytz
+import csv
+import gzip
+import io
+import json
+import tempfile
+import hashlib
+import shutil
+import cProfile
+import pstats
+import functools
+import contextvars
+import logging
+import logging.handlers
+import queue
+import time
+import random
+import atexit
+import collections
+import bisect
+import threading
+import multiprocessing
+import concurrent.futures
 from datetime import datetime, timedelta
+from typing import Literal
+import numpy as np
 
 # ==========================================
 # 🕒 TIMEZONE & CONFIG
@@ -16,13 +40,259 @@ def bangkok_now():
 
 # 🔥 ใช้ DB ตัวเดิมได้เลย
 DB_NAME = "guildwar_system_v11_ui.db"
+# 🧊 ตารางวอที่ปิดเกินกำหนดจะถูกย้ายไปเก็บไฟล์นี้ เพื่อให้ตารางหลักเล็กและเร็ว
+ARCHIVE_DB_NAME = "guildwar_archive.db"
+ARCHIVE_RETENTION_DAYS = 30
+ARCHIVE_BATCH_EVENTS = 50
+
+# 💾 สำรองข้อมูลแบบไม่หยุดบอท (SQLite backup API ทีละช่วงหน้า)
+BACKUP_DIR = "backups"
+BACKUP_KEEP = 14
+BACKUP_INTERVAL_HOURS = 6
+BACKUP_PAGES_PER_STEP = 64
+BACKUP_STEP_SLEEP = 0.005
+
+# 🔬 /profile เก็บผลไว้ที่โฟลเดอร์นี้
+PROFILE_DIR = "profiles"
+PROFILE_TOP_N = 25
+
+# 🧵 Trace ทุก interaction (span ของ DB / render / REST + error ที่ถูกกลืน) ลงไฟล์ JSONL แบบหมุนไฟล์
+# ปิดไว้เป็นค่าเริ่มต้น (ไม่เขียนไฟล์ลง traces/) เปิดเป็น True ตอนต้องการไล่ปัญหาแล้วรีสตาร์ทบอท: span ของ REST ติดตั้งตอน setup_hook เฉพาะตอนเปิด
+TRACE_ENABLED = False
+TRACE_FILE = os.path.join("traces", "trace.jsonl")
+TRACE_MAX_BYTES = 5 * 1024 * 1024
+TRACE_BACKUPS = 5
+# สัดส่วน trace ที่เก็บ (สุ่มที่ root span แล้ว span ลูกทั้งหมดตามแม่) root span ที่จบด้วย error และ error ที่ถูกกลืนเก็บเสมอ
+TRACE_SAMPLE_RATE = 0.1
+
+# ✍️ รวมการเขียนจากหลาย interaction เป็นทรานแซกชันเดียวทุก ๆ WRITE_BATCH_WINDOW_MS (group commit)
+WRITE_BATCH_WINDOW_MS = 5
+WRITE_BATCH_MAX = 500
+
+# 🛰️ Gateway cache
+# "full" = แบบเดิมของ discord.py: โหลดสมาชิกทั้งกิลด์ตอน login และเก็บทุกคนไว้ในหน่วยความจำ
+# "lazy" = ไม่ chunk ตอนเริ่ม ไม่ cache สมาชิก; /check_missing และ /call_unregistered ขอรายชื่อจาก gateway ตอนใช้งานแล้วทิ้ง
+#          (กิลด์ใหญ่ เช่น 20k คน: login ไม่ต้องรอ 20 chunk x 1000 คน และไม่ต้องถือ Member 20k ตัวตลอดเวลา
+#           `python bench.py member_cache --guild-members 20000`: full = on_ready หลัง parse ~0.2 วินาที RSS +16 MB,
+#           lazy = on_ready ทันที RSS +0 แล้วจ่าย ~0.2 วินาทีตอนเรียกคำสั่งครั้งแรก; ผลเต็มอยู่ใน docstring ของ bench_member_cache)
+MEMBER_CACHE_MODE = "lazy"
+# True = ไม่ขอ message_content intent และไม่มีคำสั่ง !sync (ใช้ slash command อย่างเดียว)
+SLASH_ONLY = False
+# บอทไม่ได้อ่านข้อความจาก cache (ใช้ fetch/partial message เสมอ) จึงปิด message cache ได้
+MESSAGE_CACHE_SIZE = None
 
 ALERT_CHANNEL_ID_FIXED = 1444345312188698738
 LOG_CHANNEL_ID = 1472149965299253457
 HISTORY_CHANNEL_ID = 1472149894096621639
 
+EXPORT_CHUNK_ROWS = 2000
+# 📋 ปุ่ม Copy: ขนาดที่ยังส่งเป็น code block ในข้อความได้ (เกินนี้ส่งเป็นไฟล์แนบ) และจำนวน roster ที่ cache ไว้
+ROSTER_COPY_INLINE_LIMIT = 2000
+ROSTER_COPY_CACHE_SIZE = 64
+
+# 🔥 Warm restart: เก็บสถานะที่อุ่นแล้ว (hash ของ embed ที่แสดงอยู่, ตารางแจ้งเตือน, ดัชนี autocomplete, hash ของคำสั่ง)
+# ลงไฟล์ตอน /shutdown และทุก WARM_STATE_INTERVAL_MINUTES แล้วโหลดกลับตอนเริ่มบอท (ตรวจกับ DB ก่อนใช้)
+WARM_STATE_FILE = "warm_state.json"
+WARM_STATE_VERSION = 1
+WARM_STATE_INTERVAL_MINUTES = 5
+# ข้ามการแก้ข้อความที่เนื้อหาไม่เปลี่ยน แต่ยังแก้ได้อย่างน้อยหนึ่งครั้งต่อช่วงนี้ ให้ "Last Updated" ท้าย embed ขยับตาม
+EMBED_FOOTER_REFRESH_MINUTES = 10
+
+# 📈 /attendance_chart: render PNG ใน process แยก (ไม่บล็อก event loop) + cache ผลลัพธ์แบบ LRU
+CHART_WORKERS = 2
+CHART_WORKER_NICE = 10  # ลดลำดับความสำคัญของ worker ให้ process บอทได้ CPU ก่อน (สำคัญบนเครื่อง 1 core)
+CHART_CACHE_SIZE = 32
+CHART_TOP_MEMBERS = 20
+CHART_MAX_WARS = 30
+CHART_FONTS = ["Noto Sans Thai", "Tahoma", "Leelawadee UI", "DejaVu Sans"]
+
+# 📊 /season_report: จำนวนสมาชิกต่อหน้า embed
+SEASON_PAGE_MEMBERS = 20
+# 🔎 /search: ผลลัพธ์สูงสุดต่อแหล่ง (ทำเนียบ / ลงชื่อวอ / ใบลา) และจำนวนบรรทัดต่อหน้า
+SEARCH_MAX_RESULTS = 100
+SEARCH_PAGE_SIZE = 10
+# 🧩 /round_lineup: ตำแหน่งที่ต้องมีอย่างน้อยกี่คนในแต่ละทีมแต่ละรอบ (ขาดแล้วขึ้นเตือน 🔴)
+LINEUP_MIN_ROLES = {"Tank": 1, "Heal": 1}
+
+# ⚖️ /auto_balance: น้ำหนักของแต่ละเป้าหมายใน cost (ขนาดทีม / สัดส่วนตำแหน่ง / คนพร้อมในแต่ละรอบ / ย้ายออกจากทีมที่เลือกเอง)
+AUTO_BALANCE_WEIGHTS = {"size": 2.0, "role": 4.0, "round": 1.0, "move": 1.5}
+# สัดส่วนตำแหน่งที่ต้องการต่อทีม (DPS, Tank, Heal, อื่น ๆ); None = ใช้สัดส่วนของคนที่ลงชื่อทั้งหมด
+AUTO_BALANCE_ROLE_RATIO = None
+AUTO_BALANCE_MAX_ITERS = 500
+
+# 🚦 Token bucket ของปุ่มที่ต้องอ่าน DB + render ใหม่ทุกครั้ง: action -> {"user": (จำนวนกดติดกันได้, วินาทีต่อ 1 token), "message": (...)}
+# "user" = ต่อคน ต่อข้อความ, "message" = รวมทุกคนบนข้อความเดียวกัน
+BUTTON_THROTTLE = {
+    "refresh": {"user": (2, 10.0), "message": (6, 2.0)},
+    "check_weapons": {"user": (3, 15.0), "message": (10, 2.0)},
+    "copy": {"user": (3, 15.0), "message": (10, 2.0)},
+    "page": {"user": (5, 2.0), "message": (10, 1.0)},
+}
+# เกินจำนวน bucket นี้ค่อยเก็บกวาด bucket ที่เต็มแล้ว และกวาดไม่บ่อยกว่าทุก BUTTON_BUCKET_PRUNE_SECONDS (ไม่สแกนทุกครั้งที่กด)
+BUTTON_BUCKET_LIMIT = 10000
+BUTTON_BUCKET_PRUNE_SECONDS = 60.0
+# 🔍 ปุ่มเช็คอาวุธ: จำนวน embed ที่ cache ไว้ (LRU)
+WEAPONS_EMBED_CACHE_SIZE = 64
+
+# 🧹 /close_wars, /delete_events: จำนวนคำขอแก้/ลบข้อความที่ยิงพร้อมกัน (รวม / ต่อห้อง)
+# Discord จำกัดการแก้/ลบข้อความเป็นรายห้อง (ราว 5 ครั้ง / 5 วินาที) ยิงในห้องเดียวกันพร้อมกันเยอะไปก็แค่โดน 429 รอคิว
+BULK_MESSAGE_CONCURRENCY = 8
+BULK_CHANNEL_CONCURRENCY = 2
+BULK_PREVIEW_LINES = 20
+
+# 📋 บอร์ดทำเนียบ/แจ้งลา: จำนวนตัวอักษรต่อหน้า (Discord จำกัด 6000 ต่อ embed และ 1024 ต่อ field)
+BOARD_PAGE_CHARS = 3500
+
 setup_sessions = {}
 
+# ==========================================
+# 🧵 TRACING (JSONL spans)
+# ==========================================
+_current_span = contextvars.ContextVar("current_span", default=None)
+_UNSAMPLED = object()  # ค่าใน _current_span ระหว่าง trace ที่สุ่มไม่ติด: span ลูกรู้ทันทีว่าไม่ต้องทำอะไร
+_trace_logger = logging.getLogger("guildwar.trace")
+_trace_logger.propagate = False
+_trace_listener = None
+_trace_queue_handler = None
+_trace_path = None  # ไฟล์ที่ listener ปัจจุบันเขียนอยู่
+
+class _TraceQueueHandler(logging.handlers.QueueHandler):
+    # ไม่ format ใน thread ของบอท ปล่อยให้ listener thread แปลงเป็น JSON เอง
+    def prepare(self, record): return record
+
+class _JsonLineFormatter(logging.Formatter):
+    def format(self, record): return json.dumps(record.msg, ensure_ascii=False, default=str)
+
+def _start_tracing():
+    global _trace_listener, _trace_queue_handler, _trace_path
+    os.makedirs(os.path.dirname(TRACE_FILE) or ".", exist_ok=True)
+    q = queue.SimpleQueue()
+    file_handler = logging.handlers.RotatingFileHandler(TRACE_FILE, maxBytes=TRACE_MAX_BYTES, backupCount=TRACE_BACKUPS, encoding="utf-8")
+    file_handler.setFormatter(_JsonLineFormatter())
+    _trace_queue_handler = _TraceQueueHandler(q)
+    _trace_logger.addHandler(_trace_queue_handler)
+    _trace_logger.setLevel(logging.INFO)
+    _trace_listener = logging.handlers.QueueListener(q, file_handler)
+    _trace_listener.start()
+    _trace_path = TRACE_FILE
+
+def stop_tracing():
+    # เขียน trace ที่ค้างในคิวลงไฟล์แล้วปิดไฟล์ (trace ถัดไปจะเปิดไฟล์ใหม่ตาม TRACE_FILE ตอนนั้น)
+    global _trace_listener, _trace_queue_handler, _trace_path
+    if _trace_listener is None: return
+    _trace_logger.removeHandler(_trace_queue_handler)
+    _trace_listener.stop()
+    for handler in _trace_listener.handlers: handler.close()
+    _trace_listener = _trace_queue_handler = _trace_path = None
+
+atexit.register(stop_tracing)
+
+def _emit_trace(payload):
+    if not TRACE_ENABLED: return
+    if _trace_path != TRACE_FILE:
+        # เปลี่ยน TRACE_FILE ระหว่างรัน (bench / loadtest สลับฐานข้อมูล) -> ปิดไฟล์เดิมแล้วเปิดไฟล์ใหม่
+        stop_tracing()
+        _start_tracing()
+    _trace_logger.info(payload)
+
+class span:
+    # with span("db.get_roster"): ...  ซ้อนกันได้ ใช้ trace id เดียวกับ span แม่ใน task เดียวกัน
+    __slots__ = ("name", "attrs", "trace_id", "span_id", "parent_id", "_token", "_t0", "_ts")
+
+    def __init__(self, name, **attrs):
+        self.name = name
+        self.attrs = attrs
+
+    def __enter__(self):
+        parent = _current_span.get()
+        self._token = None
+        if parent is _UNSAMPLED:
+            self.trace_id = None
+            return self
+        self._ts = time.time()
+        self._t0 = time.perf_counter()
+        if parent is None and random.random() >= TRACE_SAMPLE_RATE:
+            # root ที่สุ่มไม่ติด: จำเวลาไว้เผื่อจบด้วย error แต่ไม่สร้าง id / payload
+            self.trace_id = None
+            self._token = _current_span.set(_UNSAMPLED)
+            return self
+        self.trace_id = parent.trace_id if parent else f"{random.getrandbits(64):016x}"
+        self.parent_id = parent.span_id if parent else None
+        self.span_id = f"{random.getrandbits(32):08x}"
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.trace_id is None:
+            if self._token is None: return False
+            _current_span.reset(self._token)
+            if exc_type is None: return False
+            self.trace_id, self.span_id, self.parent_id = f"{random.getrandbits(64):016x}", f"{random.getrandbits(32):08x}", None
+        else: _current_span.reset(self._token)
+        ms = (time.perf_counter() - self._t0) * 1000
+        payload = {"type": "span", "trace": self.trace_id, "span": self.span_id, "parent": self.parent_id, "name": self.name, "ts": round(self._ts, 3), "ms": round(ms, 3)}
+        if self.attrs: payload["attrs"] = self.attrs
+        if exc_type is not None: payload["error"] = f"{exc_type.__name__}: {exc}"
+        _emit_trace(payload)
+        return False
+
+def traced(name):
+    # สำหรับฟังก์ชันธรรมดา (DB helper / renderer)
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not TRACE_ENABLED or _current_span.get() is _UNSAMPLED: return func(*args, **kwargs)
+            with span(name): return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def trace_swallowed(where, exc):
+    # จุดที่ตั้งใจกลืน error (Discord ลบข้อความ / ไม่มีสิทธิ์ ฯลฯ) ให้ยังมีร่องรอยใน trace
+    parent = _current_span.get()
+    if parent is _UNSAMPLED: parent = None
+    _emit_trace({"type": "error", "trace": parent.trace_id if parent else None, "span": parent.span_id if parent else None,
+                 "where": where, "exc_type": type(exc).__name__, "error": str(exc)[:300], "ts": round(time.time(), 3)})
+
+def install_rest_tracing(client):
+    # ห่อ HTTP ของ bot และ webhook adapter (ใช้ตอบ interaction) ให้ทุก REST call เป็น span
+    # webhook adapter เป็น API ภายในของ discord.py: ถ้าอัปเกรดแล้วหาไม่เจอ ข้ามไป (ยัง trace ฝั่ง bot ได้) ไม่ให้บอทล่ม
+    def wrap(request):
+        async def traced_request(route, *args, **kwargs):
+            if not TRACE_ENABLED: return await request(route, *args, **kwargs)
+            with span(f"rest {route.method} {route.path}"): return await request(route, *args, **kwargs)
+        return traced_request
+    client.http.request = wrap(client.http.request)
+    try:
+        from discord.webhook.async_ import async_context
+        adapter = async_context.get()
+        adapter.request = wrap(adapter.request)
+    except (ImportError, AttributeError, LookupError) as e:
+        print(f"⚠️ REST tracing: ข้าม webhook adapter ({e})")
+
+def summarize_traces(path=None, top=10):
+    # อ่านไฟล์ trace (รวมไฟล์ที่หมุนแล้ว) สรุป trace ที่ช้าที่สุดและ error ที่ถูกกลืนบ่อยที่สุด
+    path = path or TRACE_FILE
+    files = [f"{path}.{i}" for i in range(TRACE_BACKUPS, 0, -1)] + [path]
+    roots, children, errors = [], collections.defaultdict(list), collections.Counter()
+    for fname in files:
+        if not os.path.exists(fname): continue
+        with open(fname, encoding="utf-8") as f:
+            for line in f:
+                try: rec = json.loads(line)
+                except ValueError: continue
+                if rec.get("type") == "error": errors[(rec["where"], rec["exc_type"])] += 1
+                elif rec.get("parent") is None: roots.append(rec)
+                else: children[rec["trace"]].append(rec)
+    lines = [f"🐢 Slowest traces (top {top})"]
+    for rec in sorted(roots, key=lambda r: -r["ms"])[:top]:
+        lines.append(f"{rec['ms']:>10.1f} ms  {rec['name']}  trace={rec['trace']}" + (f"  ❌ {rec['error']}" if rec.get("error") else ""))
+        for child in sorted(children.get(rec["trace"], []), key=lambda r: -r["ms"])[:5]:
+            lines.append(f"{'':>14}{child['ms']:>9.1f} ms  {child['name']}")
+    lines.append(f"\n🙈 Most frequent swallowed errors (top {top})")
+    for (where, exc_type), n in errors.most_common(top):
+        lines.append(f"{n:>8}x  {where}  {exc_type}")
+    return "\n".join(lines)
+
 # ==========================================
 # 🗄️ DATABASE SYSTEM
 # ==========================================
@@ -43,6 +313,12 @@ def init_db():
     except: pass
     c.execute('''CREATE TABLE IF NOT EXISTS registrations
                 (event_id INTEGER, user_id INTEGER, username TEXT, team TEXT, role TEXT, time_text TEXT, weapons TEXT, joined_at DATETIME DEFAULT CURRENT_TIMESTAMP, PRIMARY KEY (event_id, user_id))''')
+    # รอบที่ลงไว้เป็น bit mask 8 บิต (bit 0 = Round 1) คำนวณจาก time_text ตอนเขียน
+    try: c.execute("ALTER TABLE registrations ADD COLUMN round_mask INTEGER")
+    except: pass
+    # เติมแถวที่ยังไม่มีค่า ทำทุกครั้งที่เริ่ม (แถวจากเวอร์ชันเก่า / การเติมรอบก่อนที่ไม่สำเร็จ) error ไม่กลืน
+    c.executemany("UPDATE registrations SET round_mask=? WHERE rowid=?",
+                  [(round_mask(tt), rid) for rid, tt in c.execute("SELECT rowid, time_text FROM registrations WHERE round_mask IS NULL").fetchall()])
     c.execute('''CREATE TABLE IF NOT EXISTS guild_members
                 (user_id INTEGER PRIMARY KEY, username TEXT, role TEXT, weapons TEXT, joined_at DATETIME DEFAULT CURRENT_TIMESTAMP)''')
     try: c.execute("ALTER TABLE guild_members ADD COLUMN weapons TEXT")
@@ -51,9 +327,49 @@ def init_db():
                 (config_name TEXT PRIMARY KEY, guild_id INTEGER, channel_id INTEGER, message_id INTEGER)''')
     c.execute('''CREATE TABLE IF NOT EXISTS leave_records
                 (user_id INTEGER PRIMARY KEY, username TEXT, leave_type TEXT, date_text TEXT, expiry_date DATETIME, reason TEXT, posted_at DATETIME DEFAULT CURRENT_TIMESTAMP)''')
+    try: c.execute("ALTER TABLE events ADD COLUMN closed_at DATETIME")
+    except: pass
+    # งานที่ปิดก่อนมีคอลัมน์ closed_at ให้เริ่มนับอายุจากตอนนี้
+    c.execute("UPDATE events SET closed_at=CURRENT_TIMESTAMP WHERE active=0 AND closed_at IS NULL")
+    c.execute('''CREATE TABLE IF NOT EXISTS event_summaries
+                (event_id INTEGER PRIMARY KEY, title TEXT, date_str TEXT, time_str TEXT, teams TEXT, total_players INTEGER, main_count INTEGER, late_count INTEGER, standby_count INTEGER, absence_count INTEGER, closed_at DATETIME, archived_at DATETIME DEFAULT CURRENT_TIMESTAMP)''')
+    # 📜 log การเปลี่ยนแปลงรายชื่อแบบเพิ่มอย่างเดียว (append-only) เลขลำดับแยกต่อ event
+    # แถวของ event ไม่ถูกแก้/ลบระหว่างที่ event ยังอยู่: ย้ายเข้าคลัง -> ย้ายไป arc.archived_registration_events ด้วย, /delete_events -> ลบทิ้งพร้อม event
+    c.execute('''CREATE TABLE IF NOT EXISTS registration_events
+                (seq INTEGER PRIMARY KEY AUTOINCREMENT, event_id INTEGER, event_seq INTEGER, user_id INTEGER, action TEXT, actor_id INTEGER, ref_seq INTEGER, before TEXT, after TEXT, created_at DATETIME DEFAULT CURRENT_TIMESTAMP)''')
+    c.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_registration_events_event_seq ON registration_events (event_id, event_seq)")
+    # 🗡️ อาวุธแบบ normalized: ชื่ออาวุธเก็บครั้งเดียว ส่วน registrations/guild_members ยังเก็บข้อความ "A + B" ไว้แสดงผลเหมือนเดิม
+    c.execute("CREATE TABLE IF NOT EXISTS weapons (weapon_id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT UNIQUE)")
+    c.execute('''CREATE TABLE IF NOT EXISTS registration_weapons
+                (event_id INTEGER, user_id INTEGER, slot INTEGER, weapon_id INTEGER, PRIMARY KEY (event_id, user_id, slot)) WITHOUT ROWID''')
+    c.execute('''CREATE TABLE IF NOT EXISTS member_weapons
+                (user_id INTEGER, slot INTEGER, weapon_id INTEGER, PRIMARY KEY (user_id, slot)) WITHOUT ROWID''')
+    if not c.execute("SELECT 1 FROM weapons LIMIT 1").fetchone(): rebuild_weapon_tables(c)
+    init_search_index(c)
+    conn.commit()
+    conn.close()
+    init_archive_db()
+
+def init_archive_db():
+    conn = sqlite3.connect(ARCHIVE_DB_NAME)
+    c = conn.cursor()
+    c.execute('''CREATE TABLE IF NOT EXISTS archived_events
+                (event_id INTEGER PRIMARY KEY, title TEXT, date_str TEXT, time_str TEXT, teams TEXT, color INTEGER, closed_at DATETIME)''')
+    c.execute('''CREATE TABLE IF NOT EXISTS archived_registrations
+                (event_id INTEGER, user_id INTEGER, username TEXT, team TEXT, role TEXT, time_text TEXT, weapons TEXT, joined_at DATETIME, PRIMARY KEY (event_id, user_id)) WITHOUT ROWID''')
+    c.execute('''CREATE TABLE IF NOT EXISTS archived_registration_events
+                (seq INTEGER PRIMARY KEY, event_id INTEGER, event_seq INTEGER, user_id INTEGER, action TEXT, actor_id INTEGER, ref_seq INTEGER, before TEXT, after TEXT, created_at DATETIME)''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_archived_registration_events_event ON archived_registration_events (event_id, event_seq)")
     conn.commit()
     conn.close()
 
+def connect_with_archive():
+    # เปิด DB หลักพร้อม ATTACH ไฟล์ archive เป็น schema "arc"
+    conn = sqlite3.connect(DB_NAME)
+    conn.execute("ATTACH DATABASE ? AS arc", (ARCHIVE_DB_NAME,))
+    return conn
+
+@traced("db.create_event")
 def create_event(title, date_str, time_str, teams_list, color):
     conn = sqlite3.connect(DB_NAME)
     c = conn.cursor()
@@ -62,8 +378,10 @@ def create_event(title, date_str, time_str, teams_list, color):
     eid = c.lastrowid
     conn.commit()
     conn.close()
+    invalidate_event_index()
     return eid
 
+@traced("db.update_event_msg")
 def update_event_msg(event_id, ch_id, msg_id):
     conn = sqlite3.connect(DB_NAME)
     c = conn.cursor()
@@ -71,6 +389,7 @@ def update_event_msg(event_id, ch_id, msg_id):
     conn.commit()
     conn.close()
 
+@traced("db.get_event")
 def get_event(event_id):
     conn = sqlite3.connect(DB_NAME)
     c = conn.cursor()
@@ -79,116 +398,2155 @@ def get_event(event_id):
     conn.close()
     return row
 
-def close_event_db(event_id):
+@traced("db.close_events_db")
+def close_events_db(event_ids):
+    # ปิดหลายงานในทรานแซกชันเดียว
+    event_ids = list(event_ids)
+    if not event_ids: return
     conn = sqlite3.connect(DB_NAME)
     c = conn.cursor()
-    c.execute("UPDATE events SET active=0 WHERE event_id=?", (event_id,))
+    c.execute(f"UPDATE events SET active=0, closed_at=CURRENT_TIMESTAMP WHERE event_id IN ({','.join('?' * len(event_ids))})", event_ids)
     conn.commit()
     conn.close()
+    invalidate_event_index()
+
+def close_event_db(event_id):
+    close_events_db([event_id])
+
+@traced("db.delete_events_db")
+def delete_events_db(event_ids):
+    # ลบหลายงานพร้อมข้อมูลที่เกี่ยวข้องในทรานแซกชันเดียว (รวม log การเปลี่ยนแปลงของงานนั้น: งานถูกลบทิ้ง ไม่ได้ย้ายเข้าคลัง)
+    event_ids = list(event_ids)
+    if not event_ids: return
+    marks = ",".join("?" * len(event_ids))
+    conn = sqlite3.connect(DB_NAME)
+    c = conn.cursor()
+    try:
+        for table in ("events", "registrations", "registration_weapons", "registration_events"):
+            c.execute(f"DELETE FROM {table} WHERE event_id IN ({marks})", event_ids)
+        conn.commit()
+        optimize_search_index(c)
+        conn.commit()
+    except:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    invalidate_event_index()
+    for event_id in event_ids:
+        weapon_index.drop_event(event_id)
+        lineup_index.drop_event(event_id)
 
 def delete_event_db(event_id):
+    delete_events_db([event_id])
+
+@traced("db.find_events")
+def find_events(id_ranges=None, title=None, active=None, closed_before=None):
+    # เลือก Event ตามช่วง ID / ชื่อ (ใช้ * แทนอะไรก็ได้) / สถานะ / ปิดก่อนเวลา (UTC แบบเดียวกับ closed_at)
+    where, params = [], []
+    if id_ranges:
+        where.append("(" + " OR ".join(["event_id BETWEEN ? AND ?"] * len(id_ranges)) + ")")
+        for lo, hi in id_ranges: params += [lo, hi]
+    if title:
+        pattern = title.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_").replace("*", "%")
+        where.append("title LIKE ? ESCAPE '\\'")
+        params.append(pattern if "*" in title else f"%{pattern}%")
+    if active is not None:
+        where.append("active=?")
+        params.append(1 if active else 0)
+    if closed_before:
+        where.append("closed_at < ?")
+        params.append(closed_before)
+    conn = sqlite3.connect(DB_NAME)
+    rows = conn.execute(f"SELECT * FROM events{' WHERE ' + ' AND '.join(where) if where else ''} ORDER BY event_id", params).fetchall()
+    conn.close()
+    return rows
+
+REG_STATE_FIELDS = ("username", "team", "role", "time_text", "weapons", "joined_at")
+
+def _reg_state(c, event_id, user_id):
+    c.execute("SELECT username, team, role, time_text, weapons, joined_at FROM registrations WHERE event_id=? AND user_id=?", (event_id, user_id))
+    row = c.fetchone()
+    return dict(zip(REG_STATE_FIELDS, row)) if row else None
+
+def _log_reg_change(c, event_id, user_id, action, before, after, actor_id=None, ref_seq=None):
+    # เขียนในทรานแซกชันเดียวกับการแก้ registrations เสมอ
+    c.execute('''INSERT INTO registration_events (event_id, event_seq, user_id, action, actor_id, ref_seq, before, after)
+                 VALUES (?, (SELECT COALESCE(MAX(event_seq), 0) + 1 FROM registration_events WHERE event_id=?), ?, ?, ?, ?, ?, ?)''',
+              (event_id, event_id, user_id, action, actor_id if actor_id is not None else user_id, ref_seq,
+               json.dumps(before, ensure_ascii=False) if before else None, json.dumps(after, ensure_ascii=False) if after else None))
+
+def parse_weapons(text):
+    # "Nameless Sword + Panacea Fan" -> ["Nameless Sword", "Panacea Fan"] ("-" = ยังไม่ระบุ)
+    names = []
+    for name in (text or "").split("+"):
+        name = name.strip()
+        if name and name != "-" and name not in names: names.append(name)
+    return names
+
+def _weapon_rows(c, names):
+    rows = []
+    for slot, name in enumerate(names):
+        c.execute("INSERT OR IGNORE INTO weapons (name) VALUES (?)", (name,))
+        c.execute("SELECT weapon_id FROM weapons WHERE name=?", (name,))
+        rows.append((slot, c.fetchone()[0]))
+    return rows
+
+def _reg_weapons_tx(c, event_id, user_id, weapons):
+    # weapons=None = ลบแถวของคนนี้ออก
+    c.execute("DELETE FROM registration_weapons WHERE event_id=? AND user_id=?", (event_id, user_id))
+    if weapons is not None:
+        c.executemany("INSERT INTO registration_weapons (event_id, user_id, slot, weapon_id) VALUES (?, ?, ?, ?)",
+                      [(event_id, user_id, slot, wid) for slot, wid in _weapon_rows(c, parse_weapons(weapons))])
+
+def _member_weapons_tx(c, user_id, weapons):
+    c.execute("DELETE FROM member_weapons WHERE user_id=?", (user_id,))
+    if weapons is not None:
+        c.executemany("INSERT INTO member_weapons (user_id, slot, weapon_id) VALUES (?, ?, ?)",
+                      [(user_id, slot, wid) for slot, wid in _weapon_rows(c, parse_weapons(weapons))])
+
+def rebuild_weapon_tables(c):
+    # สร้างตาราง normalized ใหม่จากข้อความอาวุธเดิม (ครั้งแรกหลังอัปเกรด หรือหลังนำเข้าข้อมูลตรงเข้าตาราง)
+    c.execute("DELETE FROM registration_weapons")
+    c.execute("DELETE FROM member_weapons")
+    for event_id, user_id, weapons in c.execute("SELECT event_id, user_id, weapons FROM registrations WHERE weapons IS NOT NULL AND weapons != '-'").fetchall():
+        _reg_weapons_tx(c, event_id, user_id, weapons)
+    for user_id, weapons in c.execute("SELECT user_id, weapons FROM guild_members WHERE weapons IS NOT NULL AND weapons != '-'").fetchall():
+        _member_weapons_tx(c, user_id, weapons)
+
+def _reg_upsert_tx(c, event_id, user_id, username, team, role, time_text, weapons):
+    before = _reg_state(c, event_id, user_id)
+    c.execute('''INSERT OR REPLACE INTO registrations (event_id, user_id, username, team, role, time_text, weapons, joined_at, round_mask) VALUES (?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP, ?)''', (event_id, user_id, username, team, role, time_text, weapons, round_mask(time_text)))
+    _reg_weapons_tx(c, event_id, user_id, weapons)
+    _log_reg_change(c, event_id, user_id, "update" if before else "join", before, _reg_state(c, event_id, user_id))
+
+def _reg_join_tx(c, event_id, user_id, username, team, role, time_text, weapons, limit):
+    # นับตัวจริงแล้วเขียนบน connection/ทรานแซกชันเดียวกัน: ในก้อน group commit รายการก่อนหน้าเขียนไปแล้วบน connection นี้
+    # จึงเห็นคนที่เพิ่งลงในก้อนเดียวกันด้วย ตัวจริงไม่มีทางเกินโควต้าแม้กดพร้อมกัน
+    if limit > 0 and "Late" not in time_text and "Standby" not in time_text:
+        c.execute("SELECT COUNT(*) FROM registrations WHERE event_id=? AND team=? AND user_id!=? AND instr(time_text, 'Late')=0 AND instr(time_text, 'Standby')=0",
+                  (event_id, team, user_id))
+        if c.fetchone()[0] >= limit: time_text = "Standby"
+    _reg_upsert_tx(c, event_id, user_id, username, team, role, time_text, weapons)
+    return time_text
+
+@traced("db.reg_upsert")
+def reg_upsert(event_id, user_id, username, team, role, time_text, weapons):
+    conn = sqlite3.connect(DB_NAME)
+    _reg_upsert_tx(conn.cursor(), event_id, user_id, username, team, role, time_text, weapons)
+    conn.commit()
+    conn.close()
+
+def _reg_remove_tx(c, event_id, user_id):
+    before = _reg_state(c, event_id, user_id)
+    c.execute("DELETE FROM registrations WHERE event_id=? AND user_id=?", (event_id, user_id))
+    _reg_weapons_tx(c, event_id, user_id, None)
+    if before: _log_reg_change(c, event_id, user_id, "remove", before, None)
+
+@traced("db.reg_remove")
+def reg_remove(event_id, user_id):
+    conn = sqlite3.connect(DB_NAME)
+    _reg_remove_tx(conn.cursor(), event_id, user_id)
+    conn.commit()
+    conn.close()
+
+@traced("db.get_roster")
+def get_roster(event_id):
+    conn = sqlite3.connect(DB_NAME)
+    c = conn.cursor()
+    c.execute("SELECT user_id, username, team, role, time_text, weapons FROM registrations WHERE event_id=? ORDER BY joined_at ASC", (event_id,))
+    data = c.fetchall()
+    conn.close()
+    return data
+
+@traced("db.db_get_leaderboard")
+def db_get_leaderboard():
+    conn = connect_with_archive()
+    c = conn.cursor()
+    c.execute('''SELECT username, COUNT(*) as count FROM (SELECT user_id, username FROM registrations UNION ALL SELECT user_id, username FROM arc.archived_registrations) GROUP BY user_id ORDER BY count DESC LIMIT 10''')
+    data = c.fetchall()
+    conn.close()
+    return data
+
+@traced("db.set_bot_config")
+def set_bot_config(name, guild_id, channel_id, message_id):
     conn = sqlite3.connect(DB_NAME)
     c = conn.cursor()
-    c.execute("DELETE FROM events WHERE event_id=?", (event_id,))
-    c.execute("DELETE FROM registrations WHERE event_id=?", (event_id,))
+    c.execute('''INSERT OR REPLACE INTO bot_config (config_name, guild_id, channel_id, message_id) VALUES (?, ?, ?, ?)''', (name, guild_id, channel_id, message_id))
     conn.commit()
     conn.close()
 
-def reg_upsert(event_id, user_id, username, team, role, time_text, weapons):
+@traced("db.get_bot_config")
+def get_bot_config(name):
     conn = sqlite3.connect(DB_NAME)
     c = conn.cursor()
-    c.execute('''INSERT OR REPLACE INTO registrations (event_id, user_id, username, team, role, time_text, weapons, joined_at) VALUES (?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)''', (event_id, user_id, username, team, role, time_text, weapons))
+    c.execute("SELECT guild_id, channel_id, message_id FROM bot_config WHERE config_name=?", (name,))
+    row = c.fetchone()
+    conn.close()
+    return row
+
+def _member_upsert_tx(c, user_id, username, role, weapons):
+    c.execute('''INSERT OR REPLACE INTO guild_members (user_id, username, role, weapons, joined_at) VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)''', (user_id, username, role, weapons))
+    _member_weapons_tx(c, user_id, weapons)
+
+@traced("db.member_upsert")
+def member_upsert(user_id, username, role, weapons):
+    conn = sqlite3.connect(DB_NAME)
+    _member_upsert_tx(conn.cursor(), user_id, username, role, weapons)
     conn.commit()
     conn.close()
+    on_member_changed(user_id)
 
-def reg_remove(event_id, user_id):
+def _member_remove_tx(c, user_id):
+    c.execute("DELETE FROM guild_members WHERE user_id=?", (user_id,))
+    _member_weapons_tx(c, user_id, None)
+
+@traced("db.member_remove")
+def member_remove(user_id):
+    conn = sqlite3.connect(DB_NAME)
+    _member_remove_tx(conn.cursor(), user_id)
+    conn.commit()
+    conn.close()
+    on_member_changed(user_id)
+
+@traced("db.get_all_members")
+def get_all_members():
     conn = sqlite3.connect(DB_NAME)
     c = conn.cursor()
-    c.execute("DELETE FROM registrations WHERE event_id=? AND user_id=?", (event_id, user_id))
+    c.execute("SELECT username, role, weapons FROM guild_members ORDER BY joined_at ASC")
+    data = c.fetchall()
+    conn.close()
+    return data
+
+@traced("db.clear_all_members")
+def clear_all_members():
+    conn = sqlite3.connect(DB_NAME)
+    c = conn.cursor()
+    c.execute("DELETE FROM guild_members")
+    c.execute("DELETE FROM member_weapons")
+    conn.commit()
+    conn.close()
+    on_member_changed()
+
+def _leave_upsert_tx(c, user_id, username, leave_type, date_text, expiry_date_str, reason):
+    c.execute('''INSERT OR REPLACE INTO leave_records (user_id, username, leave_type, date_text, expiry_date, reason, posted_at) VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)''', (user_id, username, leave_type, date_text, expiry_date_str, reason))
+
+@traced("db.leave_upsert")
+def leave_upsert(user_id, username, leave_type, date_text, expiry_date_str, reason):
+    conn = sqlite3.connect(DB_NAME)
+    _leave_upsert_tx(conn.cursor(), user_id, username, leave_type, date_text, expiry_date_str, reason)
     conn.commit()
     conn.close()
+    on_leave_changed(user_id)
+
+def _leave_remove_tx(c, user_id):
+    c.execute("DELETE FROM leave_records WHERE user_id=?", (user_id,))
+
+@traced("db.leave_remove")
+def leave_remove(user_id):
+    conn = sqlite3.connect(DB_NAME)
+    _leave_remove_tx(conn.cursor(), user_id)
+    conn.commit()
+    conn.close()
+    on_leave_changed(user_id)
+
+@traced("db.get_all_leaves")
+def get_all_leaves():
+    conn = sqlite3.connect(DB_NAME)
+    c = conn.cursor()
+    c.execute('''SELECT l.user_id, l.username, l.leave_type, l.date_text, l.expiry_date, l.reason, m.role FROM leave_records l LEFT JOIN guild_members m ON l.user_id = m.user_id ORDER BY l.posted_at ASC''')
+    data = c.fetchall()
+    conn.close()
+    return data
+
+@traced("db.archive_closed_events")
+def archive_closed_events(retention_days=ARCHIVE_RETENTION_DAYS, batch=ARCHIVE_BATCH_EVENTS):
+    # ย้ายงานที่ปิดเกิน retention_days วันไปไฟล์ archive ในทรานแซกชันเดียว (ทั้งสองไฟล์) เก็บสรุปไว้ใน DB หลัก
+    # (วอที่ไม่มีคนลงชื่อ SUM จะได้ NULL -> COALESCE เป็น 0)
+    conn = connect_with_archive()
+    c = conn.cursor()
+    c.execute("SELECT event_id FROM events WHERE active=0 AND closed_at <= datetime('now', ?) ORDER BY event_id LIMIT ?", (f"-{int(retention_days)} days", batch))
+    ids = [row[0] for row in c.fetchall()]
+    if not ids:
+        conn.close()
+        return 0
+    marks = ",".join("?" * len(ids))
+    try:
+        c.execute(f"""INSERT OR REPLACE INTO event_summaries (event_id, title, date_str, time_str, teams, total_players, main_count, late_count, standby_count, absence_count, closed_at)
+                     SELECT e.event_id, e.title, e.date_str, e.time_str, e.teams,
+                            COUNT(r.user_id) - COALESCE(SUM(r.team = 'Absence'), 0),
+                            COALESCE(SUM(r.team != 'Absence' AND r.time_text NOT LIKE '%Late%' AND r.time_text NOT LIKE '%Standby%'), 0),
+                            COALESCE(SUM(r.team != 'Absence' AND r.time_text LIKE '%Late%'), 0),
+                            COALESCE(SUM(r.team != 'Absence' AND r.time_text LIKE '%Standby%'), 0),
+                            COALESCE(SUM(r.team = 'Absence'), 0),
+                            e.closed_at
+                     FROM events e LEFT JOIN registrations r ON r.event_id = e.event_id
+                     WHERE e.event_id IN ({marks}) GROUP BY e.event_id""", ids)
+        c.execute(f"INSERT OR REPLACE INTO arc.archived_events SELECT event_id, title, date_str, time_str, teams, color, closed_at FROM events WHERE event_id IN ({marks})", ids)
+        c.execute(f"INSERT OR REPLACE INTO arc.archived_registrations SELECT event_id, user_id, username, team, role, time_text, weapons, joined_at FROM registrations WHERE event_id IN ({marks})", ids)
+        c.execute(f"""INSERT OR REPLACE INTO arc.archived_registration_events SELECT seq, event_id, event_seq, user_id, action, actor_id, ref_seq, before, after, created_at
+                      FROM registration_events WHERE event_id IN ({marks})""", ids)
+        c.execute(f"DELETE FROM registrations WHERE event_id IN ({marks})", ids)
+        c.execute(f"DELETE FROM registration_weapons WHERE event_id IN ({marks})", ids)
+        c.execute(f"DELETE FROM registration_events WHERE event_id IN ({marks})", ids)
+        c.execute(f"DELETE FROM events WHERE event_id IN ({marks})", ids)
+        conn.commit()
+        optimize_search_index(c)
+        conn.commit()
+    except:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    for event_id in ids:
+        weapon_index.drop_event(event_id)
+        lineup_index.drop_event(event_id)
+    return len(ids)
+
+# ==========================================
+# 🖼️ DASHBOARD SNAPSHOT (Batch Render)
+# ==========================================
+render_stats = {"batches": 0, "dashboards": 0, "queries": 0, "last_batch_queries": 0, "last_batch_dashboards": 0}
+
+@traced("db.load_dashboard_snapshot")
+def load_dashboard_snapshot(event_ids=None):
+    # โหลด event + roster ทุกตาราง + ใบลา ด้วย 3 query ใน read transaction เดียว (ข้อมูลชุดเดียวกันทั้งหมด)
+    conn = sqlite3.connect(DB_NAME)
+    c = conn.cursor()
+    queries = 0
+    try:
+        c.execute("BEGIN")
+        if event_ids is None:
+            ev_where, params = "active=1", []
+        else:
+            event_ids = list(event_ids)
+            ev_where, params = f"event_id IN ({','.join('?' * len(event_ids))})", event_ids
+        c.execute(f"SELECT * FROM events WHERE {ev_where} ORDER BY event_id", params)
+        events = c.fetchall()
+        queries += 1
+        rosters = {ev[0]: [] for ev in events}
+        if events:
+            c.execute(f"SELECT event_id, user_id, username, team, role, time_text, weapons FROM registrations WHERE event_id IN (SELECT event_id FROM events WHERE {ev_where}) ORDER BY event_id ASC, joined_at ASC", params)
+            for row in c.fetchall():
+                if row[0] in rosters: rosters[row[0]].append(row[1:])
+            queries += 1
+        c.execute('''SELECT l.user_id, l.username, l.leave_type, l.date_text, l.expiry_date, l.reason, m.role FROM leave_records l LEFT JOIN guild_members m ON l.user_id = m.user_id ORDER BY l.posted_at ASC''')
+        leaves = c.fetchall()
+        queries += 1
+        conn.commit()
+    finally:
+        conn.close()
+    return events, rosters, leaves, queries
+
+@traced("render.render_dashboards")
+def render_dashboards(event_ids=None):
+    # คืนค่า [(event_row, embed)] ของทุกตาราง (ค่าเริ่มต้น: ทุกตารางที่เปิดอยู่) จาก snapshot เดียวกัน
+    events, rosters, leaves, queries = load_dashboard_snapshot(event_ids)
+    rendered = [(ev, build_dashboard_embed(ev, rosters[ev[0]], leaves)) for ev in events]
+    render_stats["batches"] += 1
+    render_stats["dashboards"] += len(rendered)
+    render_stats["queries"] += queries
+    render_stats["last_batch_queries"] = queries
+    render_stats["last_batch_dashboards"] = len(rendered)
+    return rendered
+
+# ==========================================
+# 📜 ROSTER CHANGE LOG
+# ==========================================
+def _change_row(row):
+    seq, event_seq, user_id, action, actor_id, ref_seq, before, after, created_at = row
+    return {"seq": seq, "event_seq": event_seq, "user_id": user_id, "action": action, "actor_id": actor_id, "ref_seq": ref_seq,
+            "before": json.loads(before) if before else None, "after": json.loads(after) if after else None, "created_at": created_at}
+
+@traced("db.get_roster_version")
+def get_roster_version(event_id):
+    conn = sqlite3.connect(DB_NAME)
+    row = conn.execute("SELECT COALESCE(MAX(event_seq), 0) FROM registration_events WHERE event_id=?", (event_id,)).fetchone()
+    conn.close()
+    return row[0]
+
+@traced("db.get_roster_changes")
+def get_roster_changes(event_id, since_seq=0, limit=None):
+    # การเปลี่ยนแปลงหลังเลขลำดับ since_seq (เรียงจากเก่าไปใหม่) ให้ผู้ใช้ข้อมูลอ่านเฉพาะส่วนที่เปลี่ยน
+    conn = sqlite3.connect(DB_NAME)
+    sql = "SELECT seq, event_seq, user_id, action, actor_id, ref_seq, before, after, created_at FROM registration_events WHERE event_id=? AND event_seq>? ORDER BY event_seq ASC"
+    params = [event_id, since_seq]
+    if limit:
+        sql += " LIMIT ?"
+        params.append(limit)
+    data = [_change_row(r) for r in conn.execute(sql, params).fetchall()]
+    conn.close()
+    return data
+
+def _reg_restore_tx(c, event_id, user_id, state, actor_id, ref_seq):
+    before = _reg_state(c, event_id, user_id)
+    if state:
+        c.execute('''INSERT OR REPLACE INTO registrations (event_id, user_id, username, team, role, time_text, weapons, joined_at, round_mask) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                  (event_id, user_id) + tuple(state[k] for k in REG_STATE_FIELDS) + (round_mask(state["time_text"]),))
+    else:
+        c.execute("DELETE FROM registrations WHERE event_id=? AND user_id=?", (event_id, user_id))
+    _reg_weapons_tx(c, event_id, user_id, state["weapons"] if state else None)
+    _log_reg_change(c, event_id, user_id, "undo", before, _reg_state(c, event_id, user_id), actor_id, ref_seq)
+
+@traced("db.undo_roster_changes")
+def undo_roster_changes(event_id, count, actor_id):
+    # ย้อนการเปลี่ยนแปลงล่าสุด count รายการ (ข้ามรายการ undo และรายการที่ย้อนไปแล้ว) ในทรานแซกชันเดียว
+    conn = sqlite3.connect(DB_NAME)
+    c = conn.cursor()
+    c.execute('''SELECT seq, event_seq, user_id, action, actor_id, ref_seq, before, after, created_at FROM registration_events
+                 WHERE event_id=? AND action != 'undo' AND event_seq NOT IN (SELECT ref_seq FROM registration_events WHERE event_id=? AND action='undo' AND ref_seq IS NOT NULL)
+                 ORDER BY event_seq DESC LIMIT ?''', (event_id, event_id, count))
+    targets = [_change_row(r) for r in c.fetchall()]
+    try:
+        for ch in targets: _reg_restore_tx(c, event_id, ch["user_id"], ch["before"], actor_id, ch["event_seq"])
+        conn.commit()
+    except:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return targets
+
+# ==========================================
+# ⚖️ AUTO BALANCE (Greedy + Local Search)
+# ==========================================
+ROUND_COUNT = 8
+ALL_ROUNDS = (1 << ROUND_COUNT) - 1
+MASK_BITS = [tuple(r for r in range(ROUND_COUNT) if m >> r & 1) for m in range(ALL_ROUNDS + 1)]
+
+def round_mask(time_text):
+    # "Round 1, Round 3" -> 0b101; Full Time หรือไม่ได้ระบุรอบ = ครบทุกรอบ
+    mask = 0
+    for i in range(1, ROUND_COUNT + 1):
+        if f"Round {i}" in (time_text or ""): mask |= 1 << (i - 1)
+    return mask or ALL_ROUNDS
+
+def role_index(role):
+    # ลำดับเดียวกับ ROLE_CODES / _ROLE_SQL
+    role = role or ""
+    return 0 if "DPS" in role else 1 if "Tank" in role else 2 if "Heal" in role else 3
+
+def _water_fill(total, caps):
+    # แบ่ง total ให้ทุกทีมเท่า ๆ กันแต่ไม่เกิน cap ของทีม ส่วนที่ล้นกระจายให้ทีมที่ยังรับได้
+    target = [0.0] * len(caps)
+    open_teams = list(range(len(caps)))
+    left = float(total)
+    while open_teams and left > 1e-9:
+        share = left / len(open_teams)
+        full = [t for t in open_teams if caps[t] - target[t] <= share]
+        if not full:
+            for t in open_teams: target[t] += share
+            break
+        for t in full:
+            left -= caps[t] - target[t]
+            target[t] = caps[t]
+            open_teams.remove(t)
+    return target
+
+class BalanceSolver:
+    # state: ตัวนับต่อทีม (ขนาด, ตำแหน่ง, ตำแหน่งที่พร้อมในแต่ละรอบ) ให้คำนวณ cost ของทีมที่เปลี่ยนได้ทันทีโดยไม่ต้องนับใหม่ทั้งหมด
+    def __init__(self, players, limits, weights=None, ratio=None):
+        # players: [(role_idx, mask, preferred_team_idx)] เรียงตามลำดับลงชื่อ (คนลงก่อนได้สิทธิ์ก่อน)
+        self.players = players
+        self.w = weights or AUTO_BALANCE_WEIGHTS
+        n_teams = len(limits)
+        n = len(players)
+        self.caps = [lim if lim > 0 else n for lim in limits]
+        self.assign = [-1] * n  # -1 = ย้ายไปสำรอง (ทีมเต็มทุกทีม)
+        self.size = [0] * n_teams
+        self.roles = [[0] * 4 for _ in range(n_teams)]
+        self.avail = [[[0] * 4 for _ in range(ROUND_COUNT)] for _ in range(n_teams)]
+        # รอบแรก (greedy): อยู่ทีมเดิมถ้ายังไม่เต็ม ไม่งั้นทีมที่ว่างที่สุด ถ้าเต็มหมดเป็นสำรอง
+        for i, (_, _, pref) in enumerate(players):
+            team = pref if 0 <= pref < n_teams and self.size[pref] < self.caps[pref] else None
+            if team is None:
+                room = [(self.caps[t] - self.size[t], -t) for t in range(n_teams) if self.size[t] < self.caps[t]]
+                if not room: continue
+                team = -max(room)[1]
+            self._add(i, team)
+        placed = [i for i in range(n) if self.assign[i] >= 0]
+        total = len(placed)
+        role_total = [0] * 4
+        round_total = [[0] * 4 for _ in range(ROUND_COUNT)]
+        for i in placed:
+            k, m, _ = players[i]
+            role_total[k] += 1
+            for r in MASK_BITS[m]: round_total[r][k] += 1
+        share = list(ratio) if ratio else [c / total if total else 0 for c in role_total]
+        self.t_size = _water_fill(total, self.caps)
+        self.t_roles = [[ts * share[k] for k in range(4)] for ts in self.t_size]
+        self.t_avail = [[[ts / total * round_total[r][k] if total else 0 for k in range(4)] for r in range(ROUND_COUNT)] for ts in self.t_size]
+
+    def _add(self, i, team, sign=1):
+        k, m, _ = self.players[i]
+        self.assign[i] = team if sign > 0 else -1
+        self.size[team] += sign
+        self.roles[team][k] += sign
+        for r in MASK_BITS[m]: self.avail[team][r][k] += sign
+
+    def team_cost(self, t):
+        w = self.w
+        cost = w["size"] * (self.size[t] - self.t_size[t]) ** 2
+        cost += w["role"] * sum((self.roles[t][k] - self.t_roles[t][k]) ** 2 for k in range(4))
+        cost += w["round"] / ROUND_COUNT * sum((self.avail[t][r][k] - self.t_avail[t][r][k]) ** 2 for r in range(ROUND_COUNT) for k in range(4))
+        return cost
+
+    def move_penalty(self, i, team):
+        return self.w["move"] if team != self.players[i][2] else 0.0
+
+    def _delta(self, t, out=None, into=None):
+        # cost ที่เปลี่ยนของทีม t เมื่อเอาผู้เล่น out ออก/รับ into เข้า: (x+c-target)^2 - (x-target)^2 = 2(x-target)c + c^2
+        w = self.w
+        terms = []  # (ตำแหน่ง, รอบที่พร้อม, +1/-1)
+        if out is not None:
+            k, m, _ = self.players[out]
+            terms.append((k, m, -1))
+        if into is not None:
+            k, m, _ = self.players[into]
+            if terms and terms[0][0] == k:
+                # ตำแหน่งเดียวกัน: ขนาดและจำนวนตำแหน่งไม่เปลี่ยน เหลือแค่รอบที่ไม่ทับกัน
+                mo = terms[0][1]
+                terms = [(k, mo & ~m, -1), (k, m & ~mo, 1)]
+                role_terms = ()
+            else:
+                terms.append((k, m, 1))
+                role_terms = terms
+        else:
+            role_terms = terms
+        cost = 0.0
+        if len(role_terms) == 1:
+            c = role_terms[0][2]
+            cost += w["size"] * (2 * (self.size[t] - self.t_size[t]) * c + 1)
+        for k, _, c in role_terms:
+            cost += w["role"] * (2 * (self.roles[t][k] - self.t_roles[t][k]) * c + 1)
+        wr = w["round"] / ROUND_COUNT
+        avail, target = self.avail[t], self.t_avail[t]
+        for k, m, c in terms:
+            for r in MASK_BITS[m]:
+                cost += wr * (2 * (avail[r][k] - target[r][k]) * c + 1)
+        return cost
+
+    def move_delta(self, i, t2):
+        t1 = self.assign[i]
+        return self._delta(t1, out=i) + self._delta(t2, into=i) + self.move_penalty(i, t2) - self.move_penalty(i, t1)
+
+    def swap_delta(self, i, j):
+        t1, t2 = self.assign[i], self.assign[j]
+        return (self._delta(t1, out=i, into=j) + self._delta(t2, out=j, into=i)
+                + self.move_penalty(i, t2) + self.move_penalty(j, t1) - self.move_penalty(i, t1) - self.move_penalty(j, t2))
+
+    def _relocate(self, i, team):
+        self._add(i, self.assign[i], -1)
+        self._add(i, team)
+
+    def solve(self, max_iters=AUTO_BALANCE_MAX_ITERS):
+        # local search แบบ first-improvement: ผู้เล่นที่ (ทีม, ทีมที่เลือก, รอบ, ตำแหน่ง) เหมือนกันย้ายแล้วได้ผลเท่ากัน จึงลองแค่ตัวแทนของแต่ละกลุ่ม
+        # ลองย้ายทีละคนก่อน ถ้าไม่มีทางดีขึ้นแล้วค่อยลองสลับคู่ (ทีมเต็มย้ายเดี่ยวไม่ได้)
+        n_teams = len(self.caps)
+        iters = 0
+        while iters < max_iters:
+            iters += 1
+            groups = {}
+            for i, team in enumerate(self.assign):
+                if team >= 0: groups.setdefault((team,) + self.players[i][::-1], i)
+            reps = list(groups.values())
+            improved = False
+            for i in reps:
+                best, best_team = -1e-9, None
+                for t2 in range(n_teams):
+                    if t2 != self.assign[i] and self.size[t2] < self.caps[t2]:
+                        d = self.move_delta(i, t2)
+                        if d < best: best, best_team = d, t2
+                if best_team is not None:
+                    self._relocate(i, best_team)
+                    improved = True
+            if improved: continue
+            for a in range(len(reps)):
+                for b in range(a + 1, len(reps)):
+                    i, j = reps[a], reps[b]
+                    t1, t2 = self.assign[i], self.assign[j]
+                    if t1 == t2 or (self.players[i][:2] == self.players[j][:2] and self.players[i][2] != t2 and self.players[j][2] != t1): continue
+                    if self.swap_delta(i, j) < -1e-9:
+                        self._relocate(i, t2)
+                        self._relocate(j, t1)
+                        improved = True
+            if not improved: break
+        return self.assign, iters
+
+@traced("render.plan_auto_balance")
+def plan_auto_balance(event_id):
+    # คืนแผนการย้าย (ยังไม่เขียน DB): เฉพาะตัวจริง (ไม่ใช่ Late/Standby/Absence) ในทีมของ Event
+    # อ่าน Event, รายชื่อ และเลขลำดับ log ใน read transaction เดียว แผนจึงผูกกับรายชื่อชุดที่ใช้คำนวณจริง
+    conn = sqlite3.connect(DB_NAME)
+    try:
+        conn.execute("BEGIN")
+        ev = conn.execute("SELECT * FROM events WHERE event_id=?", (event_id,)).fetchone()
+        rows = conn.execute("SELECT user_id, username, team, role, time_text FROM registrations WHERE event_id=? ORDER BY joined_at ASC, user_id ASC", (event_id,)).fetchall()
+        version = conn.execute("SELECT COALESCE(MAX(event_seq), 0) FROM registration_events WHERE event_id=?", (event_id,)).fetchone()[0]
+        conn.commit()
+    finally:
+        conn.close()
+    if not ev: return None
+    teams, limits = parse_teams(ev[4])
+    mains = [r for r in rows if r[2] in teams and attendance_status(r[2], r[4]) == "Main"]
+    players = [(role_index(role), round_mask(tt), teams.index(team)) for _, _, team, role, tt in mains]
+    t0 = time.perf_counter()
+    solver = BalanceSolver(players, [limits[t] for t in teams], ratio=AUTO_BALANCE_ROLE_RATIO)
+    before = [solver.team_cost(t) for t in range(len(teams))]
+    assign, iters = solver.solve()
+    solve_ms = (time.perf_counter() - t0) * 1000
+    moves = [(uid, name, team, teams[a] if a >= 0 else None) for (uid, name, team, _, _), a in zip(mains, assign) if a < 0 or teams[a] != team]
+    stats = {t: {"size": solver.size[i], "limit": limits[t], "roles": solver.roles[i][:3],
+                 "min_round": min(sum(solver.avail[i][r]) for r in range(ROUND_COUNT)) if solver.size[i] else 0} for i, t in enumerate(teams)}
+    return {"event_id": event_id, "version": version, "moves": moves, "stats": stats, "iterations": iters, "solve_ms": solve_ms,
+            "cost_before": sum(before) + 0.0, "cost_after": sum(solver.team_cost(t) for t in range(len(teams))) + sum(solver.move_penalty(i, a) for i, a in enumerate(assign) if a >= 0)}
+
+def _reg_move_tx(c, event_id, user_id, team, actor_id):
+    # ย้ายทีมโดยคงลำดับการลงชื่อ (joined_at) เดิม; team=None = ย้ายไปสำรองในทีมเดิม
+    # (เติม "Standby" ไว้หน้าความพร้อมเดิม รอบที่เลือกไว้ยังอยู่ครบ และ round_mask คำนวณจากข้อความใหม่)
+    before = _reg_state(c, event_id, user_id)
+    if not before: return
+    if team is None:
+        time_text = before["time_text"] or ""
+        if "Standby" not in time_text: time_text = f"Standby, {time_text}" if time_text else "Standby"
+        c.execute("UPDATE registrations SET time_text=?, round_mask=? WHERE event_id=? AND user_id=?", (time_text, round_mask(time_text), event_id, user_id))
+    else: c.execute("UPDATE registrations SET team=? WHERE event_id=? AND user_id=?", (team, event_id, user_id))
+    _log_reg_change(c, event_id, user_id, "balance", before, _reg_state(c, event_id, user_id), actor_id)
+
+@traced("db.apply_auto_balance")
+def apply_auto_balance(plan, actor_id):
+    # เขียนทุกการย้ายในทรานแซกชันเดียว; ถ้ารายชื่อเปลี่ยนหลังดูตัวอย่าง (เลขลำดับไม่ตรง) ไม่เขียนและคืน False
+    conn = sqlite3.connect(DB_NAME, isolation_level=None)
+    c = conn.cursor()
+    try:
+        c.execute("BEGIN IMMEDIATE")
+        current = c.execute("SELECT COALESCE(MAX(event_seq), 0) FROM registration_events WHERE event_id=?", (plan["event_id"],)).fetchone()[0]
+        if current != plan["version"]:
+            c.execute("ROLLBACK")
+            return False
+        for uid, _, _, new_team in plan["moves"]: _reg_move_tx(c, plan["event_id"], uid, new_team, actor_id)
+        c.execute("COMMIT")
+        return True
+    except:
+        c.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+# ==========================================
+# 🧩 ROUND LINEUP (Round x Team x Role Matrix)
+# ==========================================
+class LineupIndex:
+    # ต่อ Event: ตัวจริง (Main) ของแต่ละคน + ตารางนับ [รอบ][ตำแหน่ง] ต่อทีม ปรับทีละคนตาม log การเปลี่ยนแปลง (แบบเดียวกับ WeaponIndex)
+    # ตามให้ทันตอนอ่าน (lazy catch-up) ไม่ได้แก้ตอนเขียน: event_view อ่าน MAX(event_seq) หนึ่ง query แล้ว apply เฉพาะ log ที่ใหม่กว่า
+    # การเขียนมาจากหลายทาง (write queue thread / ปุ่ม / undo / auto_balance) log จึงเป็นจุดเดียวที่รับประกันลำดับและไม่พลาด
+    # ราคาต่อการอ่านเมื่อไม่มีอะไรเปลี่ยน = query เลขลำดับหนึ่งครั้ง, Event ที่ไม่มีใครเปิดดูก็ไม่ต้องเสียค่าอัปเดตเลย
+    def __init__(self):
+        self.events = {}  # event_id -> {"version", "regs": {user_id: (username, team, role_idx, mask)}, "counts": {team: [[4 ตำแหน่ง] x 8 รอบ]}, "late": Counter}
+        self.stats = {"event_loads": 0, "changes_applied": 0, "queries": 0}
+
+    def drop_event(self, event_id):
+        self.events.pop(event_id, None)
+
+    def _set_reg(self, ev, user_id, state):
+        # state = (username, team, role, time_text, mask) หรือ None
+        old = ev["regs"].pop(user_id, None)
+        if old:
+            counts = ev["counts"][old[1]]
+            for r in MASK_BITS[old[3]]: counts[r][old[2]] -= 1
+        ev["late"].pop(user_id, None)
+        if not state: return
+        username, team, role, time_text, mask = state
+        status = attendance_status(team, time_text)
+        if status == "Late": ev["late"][user_id] = team
+        if status != "Main": return
+        k = role_index(role)
+        ev["regs"][user_id] = (username, team, k, mask)
+        counts = ev["counts"].setdefault(team, [[0] * 4 for _ in range(ROUND_COUNT)])
+        for r in MASK_BITS[mask]: counts[r][k] += 1
+
+    def _load_event(self, event_id, version):
+        conn = sqlite3.connect(DB_NAME)
+        rows = conn.execute("SELECT user_id, username, team, role, time_text, round_mask FROM registrations WHERE event_id=? ORDER BY joined_at ASC, user_id ASC", (event_id,)).fetchall()
+        conn.close()
+        ev = {"version": version, "regs": {}, "counts": {}, "late": {}}
+        for uid, username, team, role, time_text, mask in rows:
+            self._set_reg(ev, uid, (username, team, role, time_text, mask if mask is not None else round_mask(time_text)))
+        self.events[event_id] = ev
+        self.stats["event_loads"] += 1
+        return ev
+
+    def event_view(self, event_id):
+        self.stats["queries"] += 1
+        version = get_roster_version(event_id)
+        ev = self.events.get(event_id)
+        if ev is None or version < ev["version"]: return self._load_event(event_id, version)
+        if version > ev["version"]:
+            for ch in get_roster_changes(event_id, ev["version"]):
+                a = ch["after"]
+                self._set_reg(ev, ch["user_id"], (a["username"], a["team"], a["role"], a["time_text"], round_mask(a["time_text"])) if a else None)
+                self.stats["changes_applied"] += 1
+            ev["version"] = version
+        return ev
+
+lineup_index = LineupIndex()
+LINEUP_ROLE_EMOJI = ("⚔️", "🛡️", "🌿", "👤")  # ตามลำดับ ROLE_CODES
+
+def lineup_gaps(counts, limit):
+    # counts = [DPS, Tank, Heal, อื่น ๆ] ของทีมหนึ่งในรอบหนึ่ง -> รายการปัญหา (🔴 ตำแหน่งขาด, 🟡 คนไม่ครบโควต้า)
+    gaps = [f"🔴 ไม่มี {role}" if need == 1 else f"🔴 {role} {counts[ROLE_CODES.index(role)]}/{need}"
+            for role, need in LINEUP_MIN_ROLES.items() if counts[ROLE_CODES.index(role)] < need]
+    total = sum(counts)
+    if limit > 0 and total < limit: gaps.append(f"🟡 ขาด {limit - total} คน")
+    return gaps
+
+def round_lineup_embed(ev, index, round_no=None, team=None):
+    teams, limits = parse_teams(ev[4])
+    teams = [t for t in teams if t != "Absence" and (team is None or t == team)]
+    empty = [[0] * 4 for _ in range(ROUND_COUNT)]
+    embed = discord.Embed(title=f"🧩 Round Lineup: {ev[1]}", color=ev[5] or 0x3498db)
+    if round_no is None:
+        # ภาพรวมทั้ง 8 รอบจากตารางนับอย่างเดียว (ไม่ต้องไล่รายชื่อ)
+        for r in range(ROUND_COUNT):
+            lines = []
+            for t in teams:
+                c = index["counts"].get(t, empty)[r]
+                cap = f"/{limits[t]}" if limits[t] > 0 else ""
+                gaps = lineup_gaps(c, limits[t])
+                lines.append(f"**{t}** {sum(c)}{cap} ⚔️{c[0]} 🛡️{c[1]} 🌿{c[2]}" + (f" {' '.join(gaps)}" if gaps else " ✅"))
+            embed.add_field(name=f"Round {r + 1}", value="\n".join(lines)[:1024] or "-", inline=False)
+    else:
+        r = round_no - 1
+        for t in teams:
+            players = [(username, k) for username, pt, k, mask in index["regs"].values() if pt == t and mask >> r & 1]
+            c = index["counts"].get(t, empty)[r]
+            gaps = lineup_gaps(c, limits[t])
+            cap = f"/{limits[t]}" if limits[t] > 0 else ""
+            lines = [f"{LINEUP_ROLE_EMOJI[k]} {username}" for username, k in sorted(players, key=lambda p: p[1])]
+            late = sum(1 for lt in index["late"].values() if lt == t)
+            value = (" ".join(gaps) + "\n" if gaps else "") + ("\n".join(lines) or "*ไม่มีตัวจริงในรอบนี้*") + (f"\n🐢 มาสายอีก {late} คน" if late else "")
+            embed.add_field(name=f"{t} — Round {round_no} ({sum(c)}{cap} | ⚔️{c[0]} 🛡️{c[1]} 🌿{c[2]})", value=value[:1024], inline=False)
+    embed.set_footer(text="นับเฉพาะตัวจริง (ไม่รวมมาสาย/สำรอง) | 🔴 ตำแหน่งขาด 🟡 คนไม่ครบโควต้า")
+    return embed
+
+# ==========================================
+# ✍️ WRITE-BEHIND QUEUE (Group Commit)
+# ==========================================
+class WriteQueue:
+    # thread เขียนตัวเดียว: รอ WRITE_BATCH_WINDOW_MS ให้คำขอพร้อมกันมารวมกัน แล้ว commit ครั้งเดียว
+    # key เดียวกันในก้อนเดียวกัน (เช่น (event, user) เดิม) ใช้ค่าล่าสุด (last-writer-wins) เฉพาะงานชนิดเดียวกันที่ต่อกัน
+    # ถ้าชนิดต่างกัน (เช่น ลงชื่อแล้วถอนชื่อ) ทำทั้งคู่ตามลำดับ แต่ละคนที่รอได้ผลของงานชนิดที่ตัวเองส่งมา
+    def __init__(self, window_ms=WRITE_BATCH_WINDOW_MS, max_batch=WRITE_BATCH_MAX):
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self._q = queue.SimpleQueue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self.stats = {"writes": 0, "coalesced": 0, "commits": 0, "failed": 0, "max_batch": 0}
+
+    def submit(self, key, fn, *args):
+        # คืน Future ที่เสร็จเมื่อข้อมูลถูก commit ลงดิสก์แล้ว (ค่าที่ได้ = ค่าที่ fn คืน)
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        self._ensure_thread()
+        self._q.put((key, fn, args, loop, fut))
+        return fut
+
+    def _ensure_thread(self):
+        if self._thread and self._thread.is_alive(): return
+        with self._start_lock:
+            if self._thread and self._thread.is_alive(): return
+            self._thread = threading.Thread(target=self._run, name="write-queue", daemon=True)
+            self._thread.start()
+
+    def close(self, timeout=5):
+        if self._thread and self._thread.is_alive():
+            self._q.put(None)
+            self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            first = self._q.get()
+            if first is None: return
+            if self.window: time.sleep(self.window)
+            items, stop = [first], False
+            while len(items) < self.max_batch:
+                try: item = self._q.get_nowait()
+                except queue.Empty: break
+                if item is None:
+                    stop = True
+                    break
+                items.append(item)
+            self._commit(items)
+            if stop: return
+
+    def _commit(self, items):
+        ops, last = [], {}  # ops = [[fn, args, [(loop, fut)]]] ตามลำดับที่จะเขียน, last = key -> งานล่าสุดของ key นั้น
+        for key, fn, args, loop, fut in items:
+            op = last.get(key)
+            if op is not None and op[0] is fn:
+                self.stats["coalesced"] += 1
+                op[1] = args
+            else:
+                op = last[key] = [fn, args, []]
+                ops.append(op)
+            op[2].append((loop, fut))
+        self.stats["writes"] += len(items)
+        self.stats["max_batch"] = max(self.stats["max_batch"], len(items))
+        errors, results = {}, {}
+        conn = sqlite3.connect(DB_NAME)
+        try:
+            c = conn.cursor()
+            for i, (fn, args, _) in enumerate(ops): results[i] = fn(c, *args)
+            conn.commit()
+            self.stats["commits"] += 1
+        except Exception:
+            # ก้อนรวมพัง -> ทำทีละรายการ เพื่อให้รายการที่ไม่ผิดยังบันทึกได้
+            conn.rollback()
+            results = {}
+            for i, (fn, args, _) in enumerate(ops):
+                try:
+                    results[i] = fn(conn.cursor(), *args)
+                    conn.commit()
+                    self.stats["commits"] += 1
+                except Exception as e:
+                    conn.rollback()
+                    self.stats["failed"] += 1
+                    errors[i] = e
+        finally:
+            conn.close()
+        for i, (_, _, waiters) in enumerate(ops):
+            for loop, fut in waiters: loop.call_soon_threadsafe(_settle_write, fut, errors.get(i), results.get(i))
+
+def _settle_write(fut, error, result=None):
+    if fut.done(): return
+    if error is not None: fut.set_exception(error)
+    else: fut.set_result(result)
+
+write_queue = WriteQueue()
+
+async def reg_upsert_async(event_id, user_id, username, team, role, time_text, weapons):
+    with span("db.reg_upsert.queued"):
+        await write_queue.submit(("reg", event_id, user_id), _reg_upsert_tx, event_id, user_id, username, team, role, time_text, weapons)
+
+async def reg_join_async(event_id, user_id, username, team, role, time_text, weapons, limit):
+    # คืน time_text ที่บันทึกจริง ("Standby" ถ้าโควต้าตัวจริงเต็ม)
+    with span("db.reg_join.queued"):
+        return await write_queue.submit(("reg", event_id, user_id), _reg_join_tx, event_id, user_id, username, team, role, time_text, weapons, limit)
+
+async def reg_remove_async(event_id, user_id):
+    with span("db.reg_remove.queued"):
+        await write_queue.submit(("reg", event_id, user_id), _reg_remove_tx, event_id, user_id)
+
+async def member_upsert_async(user_id, username, role, weapons):
+    with span("db.member_upsert.queued"):
+        await write_queue.submit(("member", user_id), _member_upsert_tx, user_id, username, role, weapons)
+    on_member_changed(user_id)
+
+async def member_remove_async(user_id):
+    with span("db.member_remove.queued"):
+        await write_queue.submit(("member", user_id), _member_remove_tx, user_id)
+    on_member_changed(user_id)
+
+async def leave_upsert_async(user_id, username, leave_type, date_text, expiry_date_str, reason):
+    with span("db.leave_upsert.queued"):
+        await write_queue.submit(("leave", user_id), _leave_upsert_tx, user_id, username, leave_type, date_text, expiry_date_str, reason)
+    on_leave_changed(user_id)
+
+async def leave_remove_async(user_id):
+    with span("db.leave_remove.queued"):
+        await write_queue.submit(("leave", user_id), _leave_remove_tx, user_id)
+    on_leave_changed(user_id)
+
+# ==========================================
+# 🎯 DASHBOARD DEPENDENCIES (Targeted Invalidation)
+# ==========================================
+class DashboardDeps:
+    # ใบลาของใครจะแสดงเฉพาะบน dashboard ของงานที่เปิดอยู่และคนนั้น "ยังไม่ได้ลงชื่อ" (ดู build_dashboard_embed)
+    # จดไว้ว่าใบลาของใครเปลี่ยน แล้วตอนรีเฟรชค่อยแปลงเป็นชุด Event ที่ต้อง render ใหม่จริง ๆ (หลายการเปลี่ยนแปลงรวบเป็นรอบเดียว)
+    def __init__(self):
+        self.pending = set()
+        self.pending_all = False
+        self.stats = {"leave_changes": 0, "refreshes": 0, "dashboards_refreshed": 0, "edits_saved": 0}
+
+    def leave_changed(self, user_id=None):
+        self.stats["leave_changes"] += 1
+        if user_id is None: self.pending_all = True
+        else: self.pending.add(user_id)
+
+    def take(self):
+        users, everything = self.pending, self.pending_all
+        self.pending, self.pending_all = set(), False
+        return (None if everything else users), bool(users or everything)
+
+dashboard_deps = DashboardDeps()
+
+@traced("db.leave_dependent_dashboards")
+def leave_dependent_dashboards(user_ids=None):
+    # คืน (จำนวนตารางที่เปิดอยู่, [Event ที่มีอย่างน้อยหนึ่งคนใน user_ids ยังไม่ได้ลงชื่อ]) user_ids = None -> ทุกตาราง
+    conn = sqlite3.connect(DB_NAME)
+    active = [row[0] for row in conn.execute("SELECT event_id FROM events WHERE active=1 ORDER BY event_id")]
+    if user_ids is None:
+        conn.close()
+        return len(active), active
+    user_ids = list(user_ids)
+    registered = dict(conn.execute(f"SELECT event_id, COUNT(*) FROM registrations WHERE event_id IN (SELECT event_id FROM events WHERE active=1) AND user_id IN ({','.join('?' * len(user_ids))}) GROUP BY event_id", user_ids).fetchall())
+    conn.close()
+    return len(active), [eid for eid in active if registered.get(eid, 0) < len(user_ids)]
+
+async def refresh_leave_dependents(bot_client):
+    # ใช้แทน refresh_all_active_wars หลังใบลาเปลี่ยน: render/แก้เฉพาะตารางที่แสดงใบลาของคนที่เปลี่ยน
+    user_ids, dirty = dashboard_deps.take()
+    if not dirty: return
+    total, event_ids = leave_dependent_dashboards(user_ids)
+    st = dashboard_deps.stats
+    st["refreshes"] += 1
+    st["dashboards_refreshed"] += len(event_ids)
+    st["edits_saved"] += total - len(event_ids)
+    if event_ids: await refresh_all_active_wars(bot_client, event_ids)
+
+# ==========================================
+# 🗡️ WEAPON INDEX (Inverted Index)
+# ==========================================
+class WeaponIndex:
+    # อาวุธ -> ชุด user_id ของทั้งกิลด์ และของแต่ละ Event (พร้อมจำนวนอาวุธต่อทีม) ตอบคำถามได้โดยไม่ต้องสแกนตาราง
+    # ส่วนของ Event ตามให้ทันด้วย log การเปลี่ยนแปลง (เฉพาะรายการหลังเลขลำดับที่เคยอ่าน) ส่วนของกิลด์โหลดใหม่เฉพาะคนที่ถูกแก้
+    # ทั้งสองส่วนตามให้ทันตอนอ่าน (lazy catch-up) ไม่ได้แก้ตอนเขียน: การเขียนแค่ทิ้งร่องรอย (แถวใน log / member_changed)
+    # ราคาต่อการอ่านเมื่อไม่มีอะไรเปลี่ยน = query เลขลำดับหนึ่งครั้ง
+    def __init__(self):
+        self.names = {}  # ชื่อตัวเล็ก -> ชื่อจริง (ไว้ทำ autocomplete / ค้นแบบไม่สนตัวพิมพ์) เฉพาะอาวุธที่ยังมีคนใช้
+        self.refs = collections.Counter()  # ชื่อจริง -> จำนวนชุด user_id (ของกิลด์ / ของแต่ละ Event) ที่มีอาวุธนี้
+        self.members = None  # user_id -> (username, role, [อาวุธ])
+        self.guild = {}  # อาวุธ -> {user_id}
+        self.dirty_members = set()
+        self.events = {}  # event_id -> {"version", "regs": {user_id: (username, team, role, [อาวุธ], joined_at)}, "users": {อาวุธ: {user_id}}, "teams": {team: Counter}}
+        self.stats = {"event_loads": 0, "changes_applied": 0, "member_loads": 0, "member_refreshes": 0, "queries": 0}
+
+    def _add_user(self, users, name, user_id):
+        # users = dict อาวุธ -> {user_id} (ของกิลด์หรือของ Event) นับอ้างอิงเมื่อมีชุดใหม่เกิดขึ้น
+        if name not in users:
+            users[name] = set()
+            self.refs[name] += 1
+            self.names.setdefault(name.lower(), name)
+        users[name].add(user_id)
+
+    def _discard_user(self, users, name, user_id):
+        bucket = users.get(name)
+        if bucket is None: return
+        bucket.discard(user_id)
+        if not bucket:
+            del users[name]
+            self._release(name)
+
+    def _release(self, name):
+        # ชุดสุดท้ายที่มีอาวุธนี้หายไป -> เอาออกจาก autocomplete / resolve
+        self.refs[name] -= 1
+        if self.refs[name] > 0: return
+        del self.refs[name]
+        key = name.lower()
+        if self.names.get(key) == name:
+            del self.names[key]
+            other = next((n for n in self.refs if n.lower() == key), None)  # ชื่อเดียวกันแต่ตัวพิมพ์ต่างที่ยังมีคนใช้
+            if other: self.names[key] = other
+
+    # --- กิลด์ ---
+    def member_changed(self, user_id=None):
+        # None = ล้างทั้งหมด (เช่น /clear_members)
+        if user_id is None: self.members = None
+        elif self.members is not None: self.dirty_members.add(user_id)
+
+    def _set_member(self, user_id, entry):
+        old = self.members.pop(user_id, None)
+        if old:
+            for name in old[2]: self._discard_user(self.guild, name, user_id)
+        if entry:
+            self.members[user_id] = entry
+            for name in entry[2]: self._add_user(self.guild, name, user_id)
+
+    def _member_rows(self, conn, where="", params=()):
+        rows = conn.execute(f'''SELECT m.user_id, m.username, m.role, w.name FROM guild_members m
+                                LEFT JOIN member_weapons mw ON mw.user_id = m.user_id LEFT JOIN weapons w ON w.weapon_id = mw.weapon_id
+                                {where} ORDER BY m.joined_at ASC, m.user_id ASC, mw.slot ASC''', params).fetchall()
+        out = {}
+        for uid, username, role, name in rows:
+            entry = out.setdefault(uid, (username, role, []))
+            if name: entry[2].append(name)
+        return out
+
+    def guild_view(self):
+        if self.members is None:
+            conn = sqlite3.connect(DB_NAME)
+            for name in self.guild: self._release(name)
+            self.members, self.guild, self.dirty_members = {}, {}, set()
+            for uid, entry in self._member_rows(conn).items(): self._set_member(uid, entry)
+            conn.close()
+            self.stats["member_loads"] += 1
+        elif self.dirty_members:
+            dirty, self.dirty_members = list(self.dirty_members), set()
+            conn = sqlite3.connect(DB_NAME)
+            fresh = self._member_rows(conn, f"WHERE m.user_id IN ({','.join('?' * len(dirty))})", dirty)
+            conn.close()
+            for uid in dirty: self._set_member(uid, fresh.get(uid))
+            self.stats["member_refreshes"] += len(dirty)
+        return self.members
+
+    # --- Event ---
+    def drop_event(self, event_id):
+        ev = self.events.pop(event_id, None)
+        if ev:
+            for name in ev["users"]: self._release(name)
+
+    def _set_reg(self, ev, user_id, entry):
+        old = ev["regs"].get(user_id)
+        if old:
+            for name in old[3]:
+                self._discard_user(ev["users"], name, user_id)
+                ev["teams"][old[1]][name] -= 1
+            if not entry or entry[4] != old[4]: del ev["regs"][user_id]  # ลงชื่อใหม่ -> ไปต่อท้าย
+        if entry:
+            last = None if user_id in ev["regs"] else next(reversed(ev["regs"].values()), None)
+            ev["regs"][user_id] = entry
+            if last and entry[4] < last[4]:
+                # undo คืนเวลาลงชื่อเดิม -> เรียงใหม่ให้ตรงกับ ORDER BY joined_at
+                ev["regs"] = dict(sorted(ev["regs"].items(), key=lambda kv: (kv[1][4], kv[0])))
+            counts = ev["teams"].setdefault(entry[1], collections.Counter())
+            for name in entry[3]:
+                self._add_user(ev["users"], name, user_id)
+                counts[name] += 1
+
+    def _load_event(self, event_id, version):
+        conn = sqlite3.connect(DB_NAME)
+        rows = conn.execute('''SELECT r.user_id, r.username, r.team, r.role, r.joined_at, w.name FROM registrations r
+                                LEFT JOIN registration_weapons rw ON rw.event_id = r.event_id AND rw.user_id = r.user_id
+                                LEFT JOIN weapons w ON w.weapon_id = rw.weapon_id
+                                WHERE r.event_id=? ORDER BY r.joined_at ASC, r.user_id ASC, rw.slot ASC''', (event_id,)).fetchall()
+        conn.close()
+        regs = {}
+        for uid, username, team, role, joined_at, name in rows:
+            entry = regs.setdefault(uid, (username, team, role, [], joined_at))
+            if name: entry[3].append(name)
+        self.drop_event(event_id)
+        ev = {"version": version, "regs": {}, "users": {}, "teams": {}}
+        for uid, entry in regs.items(): self._set_reg(ev, uid, entry)
+        self.events[event_id] = ev
+        self.stats["event_loads"] += 1
+        return ev
+
+    def event_view(self, event_id):
+        # อ่านเลขลำดับก่อนโหลด: ถ้ามีการเขียนแทรกระหว่างนั้น รอบหน้าจะอ่าน log ซ้ำซึ่งให้ผลเหมือนเดิม (ตั้งเป็นสถานะ after)
+        version = get_roster_version(event_id)
+        ev = self.events.get(event_id)
+        if ev is None or version < ev["version"]: return self._load_event(event_id, version)
+        if version > ev["version"]:
+            for ch in get_roster_changes(event_id, ev["version"]):
+                after = ch["after"]
+                entry = (after["username"], after["team"], after["role"], parse_weapons(after["weapons"]), after["joined_at"]) if after else None
+                self._set_reg(ev, ch["user_id"], entry)
+                self.stats["changes_applied"] += 1
+            ev["version"] = version
+        return ev
+
+    # --- คำถาม ---
+    def resolve(self, query):
+        # ชื่อตรงตัว (ไม่สนตัวพิมพ์) ก่อน ไม่งั้นทุกชื่อที่มีคำค้นอยู่ข้างใน
+        self.stats["queries"] += 1
+        query = (query or "").strip().lower()
+        if query in self.names: return [self.names[query]]
+        return sorted(name for key, name in self.names.items() if query and query in key)
+
+    def suggest(self, current, limit=25):
+        current = (current or "").lower()
+        return sorted(name for key, name in self.names.items() if current in key)[:limit]
+
+weapon_index = WeaponIndex()
+
+def role_emoji(role):
+    return "⚔️" if "DPS" in (role or "") else "🛡️" if "Tank" in (role or "") else "🌿"
+
+def weapon_composition(counts, limit=6):
+    # Counter ของทีม -> "Panacea Fan x3, Hengdao x2, ..."
+    top = [f"{name} x{n}" for name, n in counts.most_common() if n > 0]
+    return ", ".join(top[:limit]) + (f" (+{len(top) - limit})" if len(top) > limit else "")
+
+# ==========================================
+# 📦 HISTORY EXPORT (Streaming)
+# ==========================================
+EXPORT_FIELDS = ["record", "event_id", "title", "date_str", "user_id", "username", "team", "role", "status", "time_text", "weapons", "joined_at", "leave_type", "reason"]
+
+def parse_id_ranges(spec):
+    # "1-5,8,12-14" -> [(1, 5), (8, 8), (12, 14)]
+    ranges = []
+    for part in (spec or "").replace(" ", "").split(","):
+        if not part: continue
+        if "-" in part:
+            lo, hi = part.split("-", 1)
+            lo, hi = int(lo), int(hi)
+            ranges.append((min(lo, hi), max(lo, hi)))
+        else:
+            ranges.append((int(part), int(part)))
+    return ranges
+
+def attendance_status(team, time_text):
+    if team == "Absence": return "Absence"
+    time_text = time_text or ""
+    if "Late" in time_text or "🐢" in time_text: return "Late"
+    if "Standby" in time_text or "💤" in time_text: return "Standby"
+    return "Main"
+
+def iter_history_rows(id_ranges=None, include_active=False, include_leaves=True, chunk_size=EXPORT_CHUNK_ROWS):
+    # อ่านทีละก้อนด้วย fetchmany เพื่อให้ใช้หน่วยความจำคงที่ไม่ว่าประวัติจะยาวแค่ไหน
+    range_sql, range_params = "", []
+    if id_ranges:
+        range_sql = " AND (" + " OR ".join(["r.event_id BETWEEN ? AND ?"] * len(id_ranges)) + ")"
+        for lo, hi in id_ranges: range_params += [lo, hi]
+    cols = "r.event_id, e.title, e.date_str, r.user_id, r.username, r.team, r.role, r.time_text, r.weapons, r.joined_at"
+    hot_where = ("1=1" if include_active else "e.active=0") + range_sql
+    sql = (f"SELECT {cols} FROM registrations r JOIN events e ON e.event_id = r.event_id WHERE {hot_where}"
+           f" UNION ALL SELECT {cols} FROM arc.archived_registrations r JOIN arc.archived_events e ON e.event_id = r.event_id WHERE 1=1{range_sql}"
+           " ORDER BY 1 ASC, 10 ASC")
+    params = range_params + range_params
+    conn = connect_with_archive()
+    try:
+        c = conn.cursor()
+        c.execute(sql, params)
+        while True:
+            rows = c.fetchmany(chunk_size)
+            if not rows: break
+            for ev_id, title, date_str, uid, uname, team, role, time_text, weapons, joined_at in rows:
+                yield {"record": "registration", "event_id": ev_id, "title": title, "date_str": date_str, "user_id": uid, "username": uname, "team": team, "role": role, "status": attendance_status(team, time_text), "time_text": time_text, "weapons": weapons, "joined_at": joined_at, "leave_type": None, "reason": None}
+        if include_leaves:
+            # ใบลาที่ยังมีผลอยู่ตอนนี้ของทั้งกิลด์ (ไม่ผูกกับ Event ใด ๆ และไม่ถูกกรองด้วย id_ranges / include_active)
+            c.execute("SELECT l.user_id, l.username, l.leave_type, l.date_text, l.reason, l.posted_at, m.role FROM leave_records l LEFT JOIN guild_members m ON l.user_id = m.user_id ORDER BY l.posted_at ASC")
+            while True:
+                rows = c.fetchmany(chunk_size)
+                if not rows: break
+                for uid, uname, ltype, dtext, reason, posted_at, role in rows:
+                    yield {"record": "leave", "event_id": None, "title": None, "date_str": None, "user_id": uid, "username": uname, "team": None, "role": role, "status": "Leave", "time_text": dtext, "weapons": None, "joined_at": posted_at, "leave_type": ltype, "reason": reason}
+    finally:
+        conn.close()
+
+def write_history_export(fileobj, fmt="csv", id_ranges=None, include_active=False, include_leaves=True, chunk_size=EXPORT_CHUNK_ROWS):
+    # เขียนลง gzip ทีละแถว คืนค่าจำนวนแถวที่เขียน
+    count = 0
+    with gzip.GzipFile(fileobj=fileobj, mode="wb", compresslevel=6) as gz:
+        out = io.TextIOWrapper(gz, encoding="utf-8", newline="")
+        if fmt == "csv":
+            writer = csv.DictWriter(out, fieldnames=EXPORT_FIELDS)
+            writer.writeheader()
+            for row in iter_history_rows(id_ranges, include_active, include_leaves, chunk_size):
+                writer.writerow(row)
+                count += 1
+        else:
+            for row in iter_history_rows(id_ranges, include_active, include_leaves, chunk_size):
+                out.write(json.dumps(row, ensure_ascii=False))
+                out.write("\n")
+                count += 1
+        out.flush()
+        out.detach()
+    return count
+
+# ==========================================
+# 📋 ROSTER COPY (Attachment Export)
+# ==========================================
+ROSTER_COPY_FORMATS = {"plain": ("📄 ข้อความ", "txt"), "csv": ("📊 CSV", "csv"), "ingame": ("🎮 แปะในเกม", "txt")}
+ROSTER_COPY_CSV_FIELDS = ["event_id", "team", "slot", "status", "username", "user_id", "role", "time_text", "weapons"]
+roster_copy_cache = collections.OrderedDict()
+roster_copy_stats = {"hits": 0, "misses": 0, "inline": 0, "attachments": 0}
+
+def _split_team(team_players):
+    main = [p for p in team_players if "Late" not in p[4] and "Standby" not in p[4]]
+    late = [p for p in team_players if "Late" in p[4]]
+    standby = [p for p in team_players if "Standby" in p[4]]
+    return main, late, standby
+
+def write_roster_copy(out, event_id, teams, data, fmt="plain"):
+    # เขียนทีละบรรทัดลง text stream (ไม่ต่อ string ก้อนใหญ่)
+    if fmt == "csv":
+        writer = csv.writer(out)
+        writer.writerow(ROSTER_COPY_CSV_FIELDS)
+    elif fmt == "plain":
+        out.write(f"📋 สรุปรายชื่อ Event #{event_id}\n=========================\n")
+    for t in teams:
+        team_players = [p for p in data if p[2] == t]
+        if not team_players: continue
+        main, late, standby = _split_team(team_players)
+        if fmt == "csv":
+            for status, group in (("main", main), ("late", late), ("standby", standby)):
+                for i, p in enumerate(group, 1):
+                    writer.writerow([event_id, t, i, status, p[1], p[0], p[3], p[4], p[5]])
+        elif fmt == "ingame":
+            out.write(f"[{t}] " + ", ".join(p[1] for p in main))
+            if late: out.write(" | Late: " + ", ".join(p[1] for p in late))
+            if standby: out.write(" | Standby: " + ", ".join(p[1] for p in standby))
+            out.write("\n")
+        else:
+            out.write(f"🛡️ {t.upper()}\n")
+            for i, p in enumerate(main, 1): out.write(f"{i}. {p[1]} ({p[3]}) - {p[4]} [{p[5]}]\n")
+            if late:
+                out.write("\n*🐢 สาย (Late):*\n")
+                for p in late: out.write(f"- {p[1]} ({p[3]}) [{p[5]}]\n")
+            if standby:
+                out.write("\n*💤 สำรอง (Standby):*\n")
+                for p in standby: out.write(f"- {p[1]} ({p[3]}) [{p[5]}]\n")
+            out.write("-------------------------\n")
+
+@traced("render.roster_copy")
+def build_roster_copy(event_id, fmt="plain"):
+    # คืนค่า bytes (UTF-8) ของ roster ตามรูปแบบที่เลือก; roster ที่ไม่เปลี่ยน (เลขลำดับใน registration_events เท่าเดิม) ใช้ของใน cache
+    ev = get_event(event_id)
+    if not ev: return None
+    key = (event_id, fmt)
+    version = (get_roster_version(event_id), ev[4])
+    cached = roster_copy_cache.get(key)
+    if cached and cached[0] == version:
+        roster_copy_cache.move_to_end(key)
+        roster_copy_stats["hits"] += 1
+        return cached[1]
+    roster_copy_stats["misses"] += 1
+    teams = [t.split("|")[0] if "|" in t else t for t in ev[4].split(",")]
+    buf = io.BytesIO()
+    # CSV ใส่ BOM ให้ Excel อ่านภาษาไทยถูก
+    out = io.TextIOWrapper(buf, encoding="utf-8-sig" if fmt == "csv" else "utf-8", newline="")
+    write_roster_copy(out, event_id, teams, get_roster(event_id), fmt)
+    out.flush()
+    out.detach()
+    payload = buf.getvalue()
+    roster_copy_cache[key] = (version, payload)
+    while len(roster_copy_cache) > ROSTER_COPY_CACHE_SIZE: roster_copy_cache.popitem(last=False)
+    return payload
+
+def roster_copy_message(event_id, fmt="plain"):
+    # (content, files) สำหรับส่ง: สั้นพอ -> code block, ยาวเกิน 2000 ตัวอักษร -> ไฟล์แนบ
+    payload = build_roster_copy(event_id, fmt)
+    if payload is None: return "❌ ไม่พบ Event ID นี้", []
+    label, ext = ROSTER_COPY_FORMATS[fmt]
+    if fmt != "csv":
+        text = payload.decode("utf-8")
+        block = f"```text\n{text}```"
+        if len(block) <= ROSTER_COPY_INLINE_LIMIT:
+            roster_copy_stats["inline"] += 1
+            return block, []
+    roster_copy_stats["attachments"] += 1
+    file = discord.File(io.BytesIO(payload), filename=f"roster_event_{event_id}_{fmt}.{ext}")
+    return f"{label} รายชื่อ Event #{event_id} (ไฟล์แนบ {len(payload) / 1024:.1f} KB)", [file]
+
+# ==========================================
+# 📈 ATTENDANCE CHARTS (NumPy + Process Pool)
+# ==========================================
+STATUS_CODES = ("Main", "Late", "Standby", "Absence")
+ROLE_CODES = ("DPS", "Tank", "Heal", "Other")
+# เหมือน attendance_status() และการแยกตำแหน่งใน dashboard แต่คำนวณใน SQL ให้ได้เป็นตัวเลขตรง ๆ
+_STATUS_SQL = ("CASE WHEN r.team = 'Absence' THEN 3 WHEN instr(r.time_text, 'Late') OR instr(r.time_text, '🐢') THEN 1"
+               " WHEN instr(r.time_text, 'Standby') OR instr(r.time_text, '💤') THEN 2 ELSE 0 END")
+_ROLE_SQL = "CASE WHEN instr(r.role, 'DPS') THEN 0 WHEN instr(r.role, 'Tank') THEN 1 WHEN instr(r.role, 'Heal') THEN 2 ELSE 3 END"
+WEEK_SECONDS = 7 * 24 * 3600
+
+chart_cache = collections.OrderedDict()
+chart_inflight = {}
+chart_stats = {"hits": 0, "misses": 0, "shared": 0, "renders": 0, "render_ms": 0.0}
+_chart_pool = None
+
+@traced("db.history_version")
+def history_version():
+    # เปลี่ยนทุกครั้งที่รายชื่อถูกแก้ (seq ของ registration_events ไม่ย้อนกลับ) หรือมีวอปิด/ย้ายเข้าคลัง
+    conn = connect_with_archive()
+    row = conn.execute("SELECT (SELECT seq FROM sqlite_sequence WHERE name='registration_events'),"
+                       " (SELECT COUNT(*) FROM events WHERE active=0), (SELECT MAX(closed_at) FROM events WHERE active=0),"
+                       " (SELECT COUNT(*) FROM arc.archived_events)").fetchone()
+    conn.close()
+    return tuple(row)
+
+def _columns(rows, dtypes):
+    # list ของ tuple -> dict ของ array ต่อคอลัมน์
+    if not rows: return {name: np.empty(0, dtype=dt) for name, dt in dtypes}
+    cols = list(zip(*rows))
+    return {name: np.asarray(cols[i], dtype=dt) for i, (name, dt) in enumerate(dtypes)}
+
+@traced("db.load_attendance_arrays")
+def load_attendance_arrays(since_ts=0):
+    # วอที่ปิดแล้ว (hot + คลัง) และรายชื่อของวอเหล่านั้น โหลดเป็นคอลัมน์ NumPy (query ละ 1 ตาราง)
+    since = datetime.fromtimestamp(since_ts, pytz.utc).strftime("%Y-%m-%d %H:%M:%S")
+    conn = connect_with_archive()
+    try:
+        ev_rows = conn.execute("SELECT event_id, CAST(strftime('%s', closed_at) AS INTEGER) FROM events WHERE active=0 AND closed_at >= ?"
+                               " UNION ALL SELECT event_id, CAST(strftime('%s', closed_at) AS INTEGER) FROM arc.archived_events WHERE closed_at >= ?"
+                               " ORDER BY 2, 1", (since, since)).fetchall()
+        # ตำแหน่งกับสถานะรวมเป็นเลขเดียว (role * 4 + status) ลดจำนวน object ต่อแถว; ชื่อผู้เล่นโหลดแยกเฉพาะคนที่ต้องแสดง
+        cols = f"r.event_id, r.user_id, ({_ROLE_SQL}) * 4 + {_STATUS_SQL}"
+        reg_rows = conn.execute(f"SELECT {cols} FROM registrations r JOIN events e ON e.event_id = r.event_id WHERE e.active=0 AND e.closed_at >= ?"
+                                f" UNION ALL SELECT {cols} FROM arc.archived_registrations r JOIN arc.archived_events e ON e.event_id = r.event_id WHERE e.closed_at >= ?",
+                                (since, since)).fetchall()
+    finally:
+        conn.close()
+    events = _columns(ev_rows, [("event_id", np.int64), ("closed_ts", np.int64)])
+    regs = _columns(reg_rows, [("event_id", np.int64), ("user_id", np.int64), ("code", np.int8)])
+    regs["role"], regs["status"] = np.divmod(regs.pop("code"), 4)
+    return events, regs
+
+@traced("db.load_usernames")
+def load_usernames(user_ids):
+    # ชื่อจากทำเนียบกิลด์ คนที่ไม่อยู่ในทำเนียบแล้วใช้ชื่อจากการลงทะเบียนครั้งหลังสุด
+    user_ids = [int(u) for u in user_ids]
+    if not user_ids: return {}
+    conn = connect_with_archive()
+    try:
+        marks = ",".join("?" * len(user_ids))
+        names = dict(conn.execute(f"SELECT user_id, username FROM guild_members WHERE user_id IN ({marks})", user_ids))
+        missing = [u for u in user_ids if u not in names]
+        if missing:
+            marks = ",".join("?" * len(missing))
+            for table in ("arc.archived_registrations", "registrations"):
+                names.update(conn.execute(f"SELECT user_id, username FROM {table} WHERE user_id IN ({marks}) ORDER BY event_id", missing))
+    finally:
+        conn.close()
+    return names
+
+def _event_positions(event_ids, lookup_ids):
+    # ตำแหน่งของ lookup_ids ใน event_ids (event_ids ไม่ซ้ำกัน) ไม่พบ = -1
+    order = np.argsort(event_ids, kind="stable")
+    pos = np.searchsorted(event_ids, lookup_ids, sorter=order)
+    pos = np.clip(pos, 0, max(len(event_ids) - 1, 0))
+    found = order[pos] if len(event_ids) else np.zeros(0, dtype=np.int64)
+    hit = (event_ids[found] == lookup_ids) if len(event_ids) else np.zeros(len(lookup_ids), dtype=bool)
+    return np.where(hit, found, -1)
+
+def week_anchor(now=None):
+    # 00:00 วันจันทร์ของสัปดาห์ปัจจุบัน (เวลาไทย) เป็น unix timestamp
+    now = now or bangkok_now()
+    monday = (now - timedelta(days=now.weekday())).replace(hour=0, minute=0, second=0, microsecond=0)
+    return int(monday.timestamp())
+
+@traced("render.attendance_chart_spec")
+def attendance_chart_spec(kind, weeks, member_id=None, anchor=None):
+    # รวมข้อมูลด้วย NumPy แล้วคืน spec ที่ pickle ได้ให้ render_chart_png ใน process pool; ไม่มีข้อมูล = None
+    anchor = anchor if anchor is not None else week_anchor()
+    start = anchor - (weeks - 1) * WEEK_SECONDS
+    events, regs = load_attendance_arrays(start)
+    if not len(events["event_id"]): return None
+    ev_pos = _event_positions(events["event_id"], regs["event_id"])
+    keep = (ev_pos >= 0) & (regs["status"] != 3)
+    if kind == "roles":
+        n = min(len(events["event_id"]), CHART_MAX_WARS)
+        first = len(events["event_id"]) - n  # events เรียงตามเวลาปิดแล้ว เอา n วอล่าสุด
+        m = keep & (ev_pos >= first)
+        counts = np.bincount((ev_pos[m] - first) * len(ROLE_CODES) + regs["role"][m], minlength=n * len(ROLE_CODES)).reshape(n, len(ROLE_CODES))
+        return {"kind": "stacked", "title": f"Role composition - last {n} wars", "x_labels": [f"#{e}" for e in events["event_id"][first:]],
+                "series": list(ROLE_CODES), "values": counts, "ylabel": "players"}
+    ev_week = np.clip((events["closed_ts"] - start) // WEEK_SECONDS, 0, weeks - 1)
+    wars_per_week = np.bincount(ev_week, minlength=weeks)[:weeks]
+    week_labels = [datetime.fromtimestamp(start + i * WEEK_SECONDS, pytz.timezone('Asia/Bangkok')).strftime("%d/%m") for i in range(weeks)]
+    reg_week = ev_week[ev_pos[keep]]
+    uids, uinv = np.unique(regs["user_id"][keep], return_inverse=True)
+    attended = np.bincount(uinv * weeks + reg_week, minlength=len(uids) * weeks).reshape(len(uids), weeks)
+    rate = attended / np.maximum(wars_per_week, 1)
+    if member_id is not None:
+        names = load_usernames([member_id])
+        row = np.searchsorted(uids, member_id)
+        values = rate[row] if row < len(uids) and uids[row] == member_id else np.zeros(weeks)
+        return {"kind": "line", "title": f"Weekly attendance - {names.get(member_id, member_id)}", "x_labels": week_labels,
+                "values": values, "bars": wars_per_week, "ylabel": "attendance rate"}
+    top = np.argsort(-attended.sum(axis=1), kind="stable")[:CHART_TOP_MEMBERS]
+    names = load_usernames(uids[top])
+    return {"kind": "heatmap", "title": f"Weekly attendance rate - top {len(top)} members", "x_labels": week_labels,
+            "y_labels": [str(names.get(int(u), u)) for u in uids[top]], "values": rate[top]}
+
+def render_chart_png(spec):
+    # ทำงานใน process ของ pool: import matplotlib ที่นี่ ไม่ให้ process หลักต้องโหลด
+    import matplotlib
+    matplotlib.use("Agg")
+    from matplotlib import font_manager, pyplot as plt
+    available = {f.name for f in font_manager.fontManager.ttflist}
+    plt.rcParams["font.family"] = [f for f in CHART_FONTS if f in available] or ["DejaVu Sans"]
+    x = np.arange(len(spec["x_labels"]))
+    if spec["kind"] == "heatmap":
+        fig, ax = plt.subplots(figsize=(max(6, len(x) * 0.5), max(3, len(spec["y_labels"]) * 0.35)))
+        im = ax.imshow(spec["values"], aspect="auto", cmap="Greens", vmin=0, vmax=1)
+        ax.set_yticks(np.arange(len(spec["y_labels"])), spec["y_labels"])
+        fig.colorbar(im, ax=ax, label="attendance rate")
+    elif spec["kind"] == "stacked":
+        fig, ax = plt.subplots(figsize=(max(6, len(x) * 0.35), 4))
+        bottom = np.zeros(len(x))
+        for i, name in enumerate(spec["series"]):
+            ax.bar(x, spec["values"][:, i], bottom=bottom, label=name)
+            bottom += spec["values"][:, i]
+        ax.legend()
+        ax.set_ylabel(spec["ylabel"])
+    else:
+        fig, ax = plt.subplots(figsize=(max(6, len(x) * 0.5), 4))
+        ax.bar(x, spec["bars"], color="#d0d7de", label="wars")
+        ax2 = ax.twinx()
+        ax2.plot(x, spec["values"], marker="o", color="#2ecc71", label="attendance")
+        ax2.set_ylim(0, 1.05)
+        ax2.set_ylabel(spec["ylabel"])
+        ax.set_ylabel("wars")
+    ax.set_xticks(x, spec["x_labels"], rotation=45, ha="right")
+    ax.set_title(spec["title"])
+    fig.tight_layout()
+    buf = io.BytesIO()
+    fig.savefig(buf, format="png", dpi=110)
+    plt.close(fig)
+    return buf.getvalue()
+
+def chart_job(db_name, archive_db_name, kind, weeks, member_id, anchor):
+    # งานทั้งก้อนใน worker: โหลด DB + รวมด้วย NumPy + render (process หลักไม่ต้องถือ GIL ทำงานหนักเลย)
+    # worker import main ใหม่ด้วยค่าเริ่มต้น จึงต้องส่ง path ของ DB มาเอง และปิด trace (ไฟล์ trace เป็นของ process หลัก)
+    global DB_NAME, ARCHIVE_DB_NAME, TRACE_ENABLED
+    DB_NAME, ARCHIVE_DB_NAME, TRACE_ENABLED = db_name, archive_db_name, False
+    t0 = time.perf_counter()
+    spec = attendance_chart_spec(kind, weeks, member_id, anchor)
+    png = render_chart_png(spec) if spec is not None else None
+    return png, (time.perf_counter() - t0) * 1000
+
+def _chart_worker_init(nice):
+    if nice and hasattr(os, "nice"): os.nice(nice)
+
+def get_chart_pool():
+    # spawn แทน fork: process หลักมี thread (write queue / trace) อยู่แล้ว
+    global _chart_pool
+    if _chart_pool is None:
+        _chart_pool = concurrent.futures.ProcessPoolExecutor(max_workers=CHART_WORKERS, mp_context=multiprocessing.get_context("spawn"),
+                                                             initializer=_chart_worker_init, initargs=(CHART_WORKER_NICE,))
+    return _chart_pool
+
+def close_chart_pool():
+    global _chart_pool
+    if _chart_pool is not None:
+        _chart_pool.shutdown(wait=False, cancel_futures=True)
+        _chart_pool = None
+
+async def _build_chart(key, kind, weeks, member_id, anchor):
+    with span("chart.render", kind=kind, weeks=weeks):
+        png, worker_ms = await asyncio.get_running_loop().run_in_executor(get_chart_pool(), chart_job, DB_NAME, ARCHIVE_DB_NAME, kind, weeks, member_id, anchor)
+    chart_stats["renders"] += 1
+    chart_stats["render_ms"] += worker_ms
+    if png is None: return None
+    chart_cache[key] = png
+    while len(chart_cache) > CHART_CACHE_SIZE: chart_cache.popitem(last=False)
+    return png
+
+async def get_attendance_chart(kind, weeks, member_id=None):
+    # key = คำถาม + สัปดาห์ปัจจุบัน + เวอร์ชันข้อมูล; คำขอเดียวกันที่มาพร้อมกันรอผลจากงานเดียวกัน
+    anchor = week_anchor()
+    key = (kind, weeks, member_id, anchor, await asyncio.to_thread(history_version))
+    if key in chart_cache:
+        chart_cache.move_to_end(key)
+        chart_stats["hits"] += 1
+        return chart_cache[key]
+    task = chart_inflight.get(key)
+    if task is not None: chart_stats["shared"] += 1
+    else:
+        chart_stats["misses"] += 1
+        task = chart_inflight[key] = asyncio.ensure_future(_build_chart(key, kind, weeks, member_id, anchor))
+        task.add_done_callback(lambda _t: chart_inflight.pop(key, None))
+    return await asyncio.shield(task)
+
+# ==========================================
+# 📊 SEASON REPORT (Vectorized)
+# ==========================================
+SEASON_CSV_FIELDS = ["user_id", "username", "wars", "attended", "attendance_rate", "main_share", "late_share", "standby_share",
+                     "absences", "leave_rate", "on_leave_now", "longest_no_show", "current_no_show"]
+
+@traced("render.season_metrics")
+def season_metrics(since_ts):
+    # ตัวชี้วัดทั้งซีซั่นจากเมทริกซ์ สมาชิก x วอ (สถานะ 0-3 ตาม STATUS_CODES, 4 = ไม่ได้ลงชื่อ) คำนวณแบบ vectorized ทั้งหมด
+    events, regs = load_attendance_arrays(since_ts)
+    conn = sqlite3.connect(DB_NAME)
+    try:
+        roster_ids = np.fromiter((r[0] for r in conn.execute("SELECT user_id FROM guild_members")), dtype=np.int64)
+        on_leave_ids = np.fromiter((r[0] for r in conn.execute("SELECT user_id FROM leave_records")), dtype=np.int64)
+    finally:
+        conn.close()
+    n_wars = len(events["event_id"])
+    ev_pos = _event_positions(events["event_id"], regs["event_id"])
+    ok = ev_pos >= 0
+    uids, uinv = np.unique(np.concatenate([regs["user_id"][ok], roster_ids]), return_inverse=True)
+    n_users = len(uids)
+    status = np.full((n_users, n_wars), 4, dtype=np.int8)
+    status[uinv[:ok.sum()], ev_pos[ok]] = regs["status"][ok]
+    attended = status < 3
+    att_count = attended.sum(axis=1)
+    denom = np.maximum(att_count, 1)
+    no_show = ~attended
+    # ความยาว streak ที่ไม่มา: cumsum ของวอที่ไม่มา ลบค่า cumsum ณ วอล่าสุดที่มา
+    run = np.cumsum(no_show, axis=1)
+    streak = run - np.maximum.accumulate(np.where(attended, run, 0), axis=1)
+    absences = (status == 3).sum(axis=1)
+    members = {
+        "user_id": uids,
+        "wars": np.full(n_users, n_wars),
+        "attended": att_count,
+        "attendance_rate": att_count / max(n_wars, 1),
+        "main_share": (status == 0).sum(axis=1) / denom,
+        "late_share": (status == 1).sum(axis=1) / denom,
+        "standby_share": (status == 2).sum(axis=1) / denom,
+        "absences": absences,
+        "leave_rate": absences / max(n_wars, 1),
+        "on_leave_now": np.isin(uids, on_leave_ids),
+        "longest_no_show": streak.max(axis=1) if n_wars else np.zeros(n_users, dtype=np.int64),
+        "current_no_show": streak[:, -1] if n_wars else np.zeros(n_users, dtype=np.int64),
+    }
+    # ตำแหน่งต่อวอ (เฉพาะคนที่มา): วอ x [DPS, Tank, Heal, Other]
+    m = ok & (regs["status"] < 3)
+    coverage = np.bincount(ev_pos[m] * len(ROLE_CODES) + regs["role"][m], minlength=n_wars * len(ROLE_CODES)).reshape(n_wars, len(ROLE_CODES))
+    return {"events": events, "members": members, "coverage": coverage}
+
+def season_job(db_name, archive_db_name, since_ts):
+    # เหมือน chart_job: ทำใน worker ของ process pool แล้วส่งกลับเฉพาะข้อมูลธรรมดา
+    global DB_NAME, ARCHIVE_DB_NAME, TRACE_ENABLED
+    DB_NAME, ARCHIVE_DB_NAME, TRACE_ENABLED = db_name, archive_db_name, False
+    t0 = time.perf_counter()
+    report = season_metrics(since_ts)
+    report["names"] = load_usernames(report["members"]["user_id"])
+    return report, (time.perf_counter() - t0) * 1000
+
+def write_season_csv(report):
+    members, names = report["members"], report["names"]
+    order = np.argsort(-members["attendance_rate"], kind="stable")
+    buf = io.BytesIO()
+    out = io.TextIOWrapper(buf, encoding="utf-8-sig", newline="")
+    writer = csv.writer(out)
+    writer.writerow(SEASON_CSV_FIELDS)
+    cols = [members[f] if f != "username" else None for f in SEASON_CSV_FIELDS]
+    for i in order:
+        writer.writerow([names.get(int(members["user_id"][i]), "") if col is None else
+                         (round(float(col[i]), 3) if col.dtype.kind == "f" else int(col[i])) for col in cols])
+    out.flush()
+    out.detach()
+    return buf.getvalue()
+
+def season_report_embeds(report, days):
+    members, names, coverage = report["members"], report["names"], report["coverage"]
+    n_wars = len(report["events"]["event_id"])
+    title = f"📊 Season Report ({days} วันล่าสุด)"
+    summary = discord.Embed(title=title, color=0x9b59b6)
+    active = members["attended"] > 0
+    summary.description = (f"⚔️ วอที่ปิดแล้ว: **{n_wars}** | 👥 สมาชิก: **{len(members['user_id'])}** (มาอย่างน้อย 1 ครั้ง {int(active.sum())} คน)\n"
+                           f"📈 อัตราเข้าวอเฉลี่ย: **{members['attendance_rate'].mean() * 100 if len(members['user_id']) else 0:.1f}%**\n"
+                           f"🏳️ แจ้งลารายวอรวม: **{int(members['absences'].sum())}** ครั้ง | ลาอยู่ตอนนี้: **{int(members['on_leave_now'].sum())}** คน")
+    if n_wars:
+        avg = coverage.mean(axis=0)
+        short = [f"{name}: ขาด {int((coverage[:, i] == 0).sum())} วอ" for i, name in enumerate(ROLE_CODES[:3])]
+        summary.add_field(name="🛡️ Role coverage ต่อวอ", value=" | ".join(f"{name} เฉลี่ย {avg[i]:.1f}" for i, name in enumerate(ROLE_CODES[:3])) + "\n" + " | ".join(short), inline=False)
+        streak_top = np.argsort(-members["current_no_show"], kind="stable")[:5]
+        lines = [f"**{names.get(int(members['user_id'][i]), members['user_id'][i])}** ไม่มา {int(members['current_no_show'][i])} วอติด"
+                 for i in streak_top if members["current_no_show"][i] > 0]
+        if lines: summary.add_field(name="🚨 ขาดติดต่อกันตอนนี้", value="\n".join(lines), inline=False)
+    pages = [summary]
+    order = np.argsort(-members["attendance_rate"], kind="stable")
+    for start in range(0, len(order), SEASON_PAGE_MEMBERS):
+        rows = []
+        for rank, i in enumerate(order[start:start + SEASON_PAGE_MEMBERS], start + 1):
+            name = str(names.get(int(members["user_id"][i]), members["user_id"][i]))[:14]
+            rows.append(f"{rank:>3}. {name:<14} {members['attendance_rate'][i] * 100:5.1f}% M{members['main_share'][i] * 100:4.0f}% "
+                        f"L{members['late_share'][i] * 100:3.0f}% S{members['standby_share'][i] * 100:3.0f}% ลา{int(members['absences'][i]):>3} ขาดสุด{int(members['longest_no_show'][i]):>3}")
+        pages.append(discord.Embed(title=title, description="```text\n" + "\n".join(rows) + "\n```", color=0x9b59b6))
+    for i, page in enumerate(pages, 1): page.set_footer(text=f"หน้า {i}/{len(pages)} | ไฟล์ CSV แนบมีข้อมูลครบทุกคน")
+    return pages
+
+# ==========================================
+# 🔎 FULL-TEXT SEARCH (FTS5 Trigram)
+# ==========================================
+# ตาราง FTS5 แบบ external content (ไม่เก็บข้อความซ้ำ อ่านจากตารางจริง) ใช้ tokenizer แบบ trigram
+# จึงค้นกลางคำได้และใช้ได้ทั้งภาษาไทย (ไม่มีเว้นวรรคระหว่างคำ) และอังกฤษ (ไม่สนตัวพิมพ์เล็ก/ใหญ่)
+SEARCH_SOURCES = {
+    # ชื่อตาราง FTS -> (ตารางจริง, คอลัมน์ที่ค้นได้, เงื่อนไขหาแถวเดิมของ NEW ตอน INSERT OR REPLACE)
+    "guild_members_fts": ("guild_members", ("username",), "user_id=NEW.user_id"),
+    "registrations_fts": ("registrations", ("username", "team", "weapons"), "event_id=NEW.event_id AND user_id=NEW.user_id"),
+    "leave_records_fts": ("leave_records", ("username", "reason"), "user_id=NEW.user_id"),
+}
+
+def init_search_index(c):
+    for fts, (table, cols, key) in SEARCH_SOURCES.items():
+        exists = c.execute("SELECT 1 FROM sqlite_master WHERE name=?", (fts,)).fetchone()
+        col_list = ", ".join(cols)
+        old_vals = ", ".join(f"OLD.{col}" for col in cols)
+        new_vals = ", ".join(f"NEW.{col}" for col in cols)
+        c.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5({col_list}, content='{table}', content_rowid='rowid', tokenize='trigram')")
+        # INSERT OR REPLACE ลบแถวเดิมโดยไม่เรียก trigger ฝั่ง DELETE จึงต้องลบ entry เก่าออกจาก index เองก่อน insert
+        c.execute(f'''CREATE TRIGGER IF NOT EXISTS {fts}_bi BEFORE INSERT ON {table} BEGIN
+                         INSERT INTO {fts} ({fts}, rowid, {col_list}) SELECT 'delete', rowid, {col_list} FROM {table} WHERE {key};
+                     END''')
+        c.execute(f'''CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN
+                         INSERT INTO {fts} (rowid, {col_list}) VALUES (NEW.rowid, {new_vals});
+                     END''')
+        c.execute(f'''CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN
+                         INSERT INTO {fts} ({fts}, rowid, {col_list}) VALUES ('delete', OLD.rowid, {old_vals});
+                     END''')
+        c.execute(f'''CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE ON {table} BEGIN
+                         INSERT INTO {fts} ({fts}, rowid, {col_list}) VALUES ('delete', OLD.rowid, {old_vals});
+                         INSERT INTO {fts} (rowid, {col_list}) VALUES (NEW.rowid, {new_vals});
+                     END''')
+        # สร้างครั้งแรกบน DB ที่มีข้อมูลอยู่แล้ว -> index ข้อมูลเดิมทั้งหมด
+        if not exists: c.execute(f"INSERT INTO {fts} ({fts}) VALUES ('rebuild')")
+
+def optimize_search_index(c, names=("registrations_fts",)):
+    # 'delete' ของ FTS5 แค่เขียน tombstone เพิ่ม index จึงโตขึ้นแม้ตารางจะว่าง
+    # หลังลบแถวจำนวนมาก (ย้ายเข้าคลัง / ลบงาน) ให้รวม segment ใหม่ทิ้ง tombstone คืนหน้าให้ไฟล์
+    for fts in names: c.execute(f"INSERT INTO {fts} ({fts}) VALUES ('optimize')")
+
+def fts_query(text):
+    # ทุกคำต้องเจอ (AND) แต่ละคำเป็น phrase เพื่อไม่ให้ตัวอักษรพิเศษกลายเป็น syntax ของ FTS5; trigram ต้องยาวอย่างน้อย 3 ตัวอักษร
+    terms = [t for t in (text or "").split() if len(t) >= 3]
+    return " ".join('"' + t.replace('"', '""') + '"' for t in terms)
+
+def fts_ignored_terms(text):
+    # คำที่ fts_query ข้ามไป (สั้นกว่า 3 ตัวอักษร) ไว้บอกผู้ใช้ว่าไม่ได้ถูกใช้กรอง
+    return [t for t in (text or "").split() if len(t) < 3]
+
+LEAVE_TYPE_LABELS = {"late": "🐢 สาย", "1_day": "⏱️ 1 วัน", "3_days": "🗓️ 3 วัน", "7_days": "📅 7 วัน", "custom": "✏️ กำหนดเอง", "hiatus": "🛌 พักยาว"}
+
+@traced("db.search_all")
+def search_all(text, scope="all", limit=SEARCH_MAX_RESULTS):
+    # คืน [(คะแนน bm25, บรรทัดผลลัพธ์)] เรียงจากตรงที่สุด (bm25 ยิ่งน้อยยิ่งตรง); None = คำค้นสั้นเกินไป
+    # จัดอันดับและตัด LIMIT ใน subquery ก่อน แล้วค่อย join ตารางจริงเฉพาะแถวที่จะแสดง
+    match = fts_query(text)
+    if not match: return None
+    conn = sqlite3.connect(DB_NAME)
+    results = []
+    if scope in ("all", "members"):
+        for username, role, weapons, score in conn.execute('''SELECT m.username, m.role, m.weapons, f.score
+                                                              FROM (SELECT rowid, bm25(guild_members_fts) AS score FROM guild_members_fts WHERE guild_members_fts MATCH ? ORDER BY score LIMIT ?) f
+                                                              JOIN guild_members m ON m.rowid = f.rowid''', (match, limit)):
+            wp = f" · `{weapons}`" if weapons and weapons != "-" else ""
+            results.append((score, f"👤 **{username}** · ทำเนียบ ({role or '-'}){wp}"))
+    if scope in ("all", "wars"):
+        for event_id, title, date_str, username, team, time_text, weapons, score in conn.execute(
+                '''SELECT r.event_id, e.title, e.date_str, r.username, r.team, r.time_text, r.weapons, f.score
+                   FROM (SELECT rowid, bm25(registrations_fts, 4.0, 1.0, 1.0) AS score FROM registrations_fts WHERE registrations_fts MATCH ? ORDER BY score LIMIT ?) f
+                   JOIN registrations r ON r.rowid = f.rowid LEFT JOIN events e ON e.event_id = r.event_id''', (match, limit)):
+            wp = f" · `{weapons}`" if weapons and weapons != "-" else ""
+            results.append((score, f"⚔️ **{username}** · #{event_id} {title or ''} ({date_str or '-'}) · {team} · {attendance_status(team, time_text)}{wp}"))
+    if scope in ("all", "leaves"):
+        for username, leave_type, date_text, reason, score in conn.execute(
+                '''SELECT l.username, l.leave_type, l.date_text, highlight(leave_records_fts, 1, '__', '__'), bm25(leave_records_fts, 2.0, 1.0) AS score
+                   FROM leave_records_fts JOIN leave_records l ON l.rowid = leave_records_fts.rowid
+                   WHERE leave_records_fts MATCH ? ORDER BY score LIMIT ?''', (match, limit)):
+            results.append((score, f"🏳️ **{username}** · {LEAVE_TYPE_LABELS.get(leave_type, leave_type)} [{date_text}] · {reason}"))
+    conn.close()
+    results.sort(key=lambda r: r[0])
+    return results
+
+def search_embeds(text, results, elapsed_ms):
+    pages = []
+    for start in range(0, len(results), SEARCH_PAGE_SIZE):
+        lines = [f"`{rank:>3}.` {line[:300]}" for rank, (_, line) in enumerate(results[start:start + SEARCH_PAGE_SIZE], start + 1)]
+        pages.append(discord.Embed(title=f"🔎 ผลการค้นหา: {text[:100]}", description="\n".join(lines), color=0x3498db))
+    for i, page in enumerate(pages, 1): page.set_footer(text=f"หน้า {i}/{len(pages)} | พบ {len(results)} รายการ | {elapsed_ms:.0f} ms")
+    return pages
+
+# ==========================================
+# 💾 BACKUP SYSTEM
+# ==========================================
+def _sha256_file(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""): h.update(block)
+    return h.hexdigest()
+
+def _integrity_ok(conn):
+    return conn.execute("PRAGMA integrity_check").fetchone()[0] == "ok"
+
+def _reserve_backup_name(dest_dir, stem):
+    # ชื่อไฟล์ละเอียดถึงไมโครวินาที + เลขต่อท้ายถ้ายังชน (นาฬิกาหยาบ / สั่ง backup ซ้อนกัน)
+    # จองด้วยการสร้างไฟล์ .partial แบบ O_EXCL แล้วค่อยเช็คไฟล์ .db.gz: งานที่ทำเสร็จสร้าง .db.gz ก่อนลบ .partial เสมอ
+    stamp = bangkok_now().strftime("%Y%m%d-%H%M%S-%f")
+    n = 0
+    while True:
+        name = f"{stem}-{stamp}" + (f"-{n:03d}" if n else "")
+        partial = os.path.join(dest_dir, f".{name}.partial")
+        final = os.path.join(dest_dir, f"{name}.db.gz")
+        n += 1
+        try: os.close(os.open(partial, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        except FileExistsError: continue
+        if not os.path.exists(final): return partial, final
+        os.remove(partial)
+
+def backup_database(src_path, dest_dir=BACKUP_DIR, keep=BACKUP_KEEP):
+    # คัดลอกทีละ BACKUP_PAGES_PER_STEP หน้า ระหว่างนั้นบอทยังเขียน DB ได้ตามปกติ
+    os.makedirs(dest_dir, exist_ok=True)
+    stem = os.path.splitext(os.path.basename(src_path))[0]
+    partial, final = _reserve_backup_name(dest_dir, stem)
+    src = sqlite3.connect(src_path)
+    dst = sqlite3.connect(partial)
+    try:
+        src.backup(dst, pages=BACKUP_PAGES_PER_STEP, sleep=BACKUP_STEP_SLEEP)
+        if not _integrity_ok(dst): raise RuntimeError(f"integrity_check failed for snapshot of {src_path}")
+    finally:
+        dst.close()
+        src.close()
+    try:
+        with open(partial, "rb") as f_in, gzip.open(final + ".tmp", "wb", compresslevel=6) as f_out:
+            shutil.copyfileobj(f_in, f_out, 1 << 20)
+        os.replace(final + ".tmp", final)
+        with open(final + ".sha256", "w") as f: f.write(_sha256_file(final))
+    finally:
+        os.remove(partial)
+    _rotate_backups(dest_dir, stem, keep)
+    return final
+
+def _rotate_backups(dest_dir, stem, keep):
+    # เรียงตามชื่อที่ตัด ".db.gz" ออก ให้ไฟล์ที่มีเลขต่อท้าย (-001) มาหลังไฟล์ชื่อเดียวกันที่ไม่มี
+    snaps = sorted((f for f in os.listdir(dest_dir) if f.startswith(stem + "-") and f.endswith(".db.gz")), key=lambda f: f[:-len(".db.gz")])
+    for old in snaps[:-keep] if keep > 0 else []:
+        for path in (os.path.join(dest_dir, old), os.path.join(dest_dir, old + ".sha256")):
+            try: os.remove(path)
+            except FileNotFoundError: pass
+
+def run_backups(dest_dir=BACKUP_DIR):
+    return [backup_database(path, dest_dir) for path in (DB_NAME, ARCHIVE_DB_NAME) if os.path.exists(path)]
+
+def verify_backup(path, allow_unverified=False):
+    # ตรวจ checksum แล้วแตกไฟล์ออกมาตรวจ integrity_check คืนค่า path ไฟล์ที่แตกแล้ว (ผู้เรียกต้องลบเอง)
+    # ไม่มีไฟล์ .sha256 = พิสูจน์ไม่ได้ว่าไฟล์ไม่เสีย/ไม่ถูกตัด: ปฏิเสธ เว้นแต่สั่ง allow_unverified (แล้วเตือนเสียงดัง)
+    sidecar = path + ".sha256"
+    if os.path.exists(sidecar):
+        with open(sidecar) as f: expected = f.read().strip()
+        if _sha256_file(path) != expected: raise RuntimeError(f"checksum mismatch: {path}")
+    elif not allow_unverified:
+        raise RuntimeError(f"missing checksum {sidecar}: refusing to use an unverified snapshot (use --allow-unverified to override)")
+    else:
+        print(f"⚠️⚠️ ไม่มี {sidecar}: ข้ามการตรวจ checksum ตรวจได้แค่ integrity_check ของไฟล์ที่แตกออกมา")
+    fd, raw = tempfile.mkstemp(suffix=".db")
+    with os.fdopen(fd, "wb") as f_out, gzip.open(path, "rb") as f_in:
+        shutil.copyfileobj(f_in, f_out, 1 << 20)
+    conn = sqlite3.connect(raw)
+    try: ok = _integrity_ok(conn)
+    finally: conn.close()
+    if not ok:
+        os.remove(raw)
+        raise RuntimeError(f"integrity_check failed: {path}")
+    return raw
+
+def restore_backup(path, target=None, allow_unverified=False):
+    # ต้องหยุดบอทก่อน restore ไฟล์เดิมจะถูกเก็บไว้เป็น .pre-restore
+    if not target:
+        archive_stem = os.path.splitext(os.path.basename(ARCHIVE_DB_NAME))[0]
+        target = ARCHIVE_DB_NAME if os.path.basename(path).startswith(archive_stem + "-") else DB_NAME
+    raw = verify_backup(path, allow_unverified)
+    try:
+        if os.path.exists(target):
+            shutil.copy2(target, f"{target}.pre-restore-{bangkok_now().strftime('%Y%m%d-%H%M%S')}")
+        src = sqlite3.connect(raw)
+        dst = sqlite3.connect(target)
+        try: src.backup(dst)
+        finally:
+            dst.close()
+            src.close()
+    finally:
+        os.remove(raw)
+    return target
+
+# ==========================================
+# 🔬 PROFILING (/profile)
+# ==========================================
+profiling_enabled = False
+_profiles = {}
+_profile_calls = {}
+_profile_active = False
+
+class _ProfiledCoroutine:
+    # เดิน coroutine ทีละสเต็ปและเปิด profiler เฉพาะตอนโค้ดของ handler นี้ทำงาน
+    # (ช่วงที่รอ await อยู่ event loop จะไปรัน handler อื่น ซึ่งไม่ควรถูกนับรวม)
+    def __init__(self, coro, prof):
+        self.coro = coro
+        self.prof = prof
+
+    def __await__(self):
+        global _profile_active
+        value, exc = None, None
+        while True:
+            nested = _profile_active
+            if not nested:
+                _profile_active = True
+                self.prof.enable()
+            try:
+                yielded = self.coro.throw(exc) if exc is not None else self.coro.send(value)
+            except StopIteration as stop:
+                return stop.value
+            finally:
+                if not nested:
+                    self.prof.disable()
+                    _profile_active = False
+            try:
+                value, exc = (yield yielded), None
+            except BaseException as e:
+                value, exc = None, e
+
+async def _run_handler(name, func, args, kwargs):
+    if not profiling_enabled: return await func(*args, **kwargs)
+    prof = _profiles.get(name)
+    if prof is None: prof = _profiles[name] = cProfile.Profile()
+    _profile_calls[name] = _profile_calls.get(name, 0) + 1
+    return await _ProfiledCoroutine(func(*args, **kwargs), prof)
+
+def instrumented(name):
+    # ครอบ command / View callback: เปิด root span ของ trace และ profiling (ถ้าเปิดอยู่)
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            if not TRACE_ENABLED: return await _run_handler(name, func, args, kwargs)
+            inter = next((a for a in args if isinstance(a, discord.Interaction)), None)
+            attrs = {"user": inter.user.id, "interaction": inter.id} if inter else {}
+            with span(name, **attrs): return await _run_handler(name, func, args, kwargs)
+        return wrapper
+    return decorator
+
+def start_profiling():
+    global profiling_enabled
+    _profiles.clear()
+    _profile_calls.clear()
+    profiling_enabled = True
+
+def stop_profiling():
+    global profiling_enabled
+    profiling_enabled = False
+
+def dump_profiles(top_n=PROFILE_TOP_N, out_dir=PROFILE_DIR):
+    # เขียนสรุป top-N ฟังก์ชันที่กินเวลามากสุดของแต่ละ handler + ไฟล์ .pstats ไว้เปิดดูละเอียด
+    os.makedirs(out_dir, exist_ok=True)
+    stamp = bangkok_now().strftime("%Y%m%d-%H%M%S")
+    path = os.path.join(out_dir, f"profile-{stamp}.txt")
+    with open(path, "w", encoding="utf-8") as f:
+        for name, prof in sorted(_profiles.items(), key=lambda kv: -_profile_calls.get(kv[0], 0)):
+            f.write(f"===== {name} ({_profile_calls.get(name, 0)} calls) =====\n")
+            try: stats = pstats.Stats(prof, stream=f)
+            except TypeError:
+                f.write("(no samples)\n\n")
+                continue
+            stats.dump_stats(os.path.join(out_dir, f"profile-{stamp}-{name}.pstats"))
+            stats.sort_stats("tottime").print_stats(top_n)
+    return path
+
+# ==========================================
+# 🔥 WARM STATE (Restart Snapshot)
+# ==========================================
+# rendered:  key ("war:<id>" / "leave_board") -> [channel_id, message_id, hash ของ embed ที่อยู่บนข้อความนั้น]
+# reminders: event_id -> {"at": "วัน|เวลา", "sent": ["30m", "start"]}
+# event_index: [[event_id, ข้อความที่แสดงใน autocomplete], ...] ของ Event ที่เปิดอยู่ (None = ต้องโหลดใหม่)
+warm_state = {"rendered": {}, "reminders": {}, "event_index": None, "command_hash": None}
+warm_stats = {"loaded": False, "restored": 0, "dropped": 0, "edits_skipped": 0, "sync_skipped": False, "saves": 0}
+
+def embed_hash(embed):
+    # ไม่นับ footer (มีเวลาที่ render) เพื่อให้ embed ที่เนื้อหาเดิมได้ hash เดิม แต่นับช่วงเวลาหยาบ ๆ แทน
+    # เนื้อหาเดิมในช่วง EMBED_FOOTER_REFRESH_MINUTES เดียวกัน = ข้าม; ข้ามช่วงแล้วแก้ใหม่หนึ่งครั้งเพื่ออัปเดต footer
+    data = embed.to_dict()
+    data.pop("footer", None)
+    data["_bucket"] = int(time.time() // (EMBED_FOOTER_REFRESH_MINUTES * 60))
+    return hashlib.sha1(json.dumps(data, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+def mark_rendered(key, msg, embed):
+    warm_state["rendered"][key] = [msg.channel.id, msg.id, embed_hash(embed)]
+
+def forget_rendered(key):
+    warm_state["rendered"].pop(key, None)
+
+async def edit_tracked(msg, key, embed):
+    # แก้ข้อความเฉพาะเมื่อ embed ต่างจากที่แสดงอยู่ (msg เป็น Message หรือ PartialMessage ก็ได้)
+    handle = [msg.channel.id, msg.id, embed_hash(embed)]
+    if warm_state["rendered"].get(key) == handle:
+        warm_stats["edits_skipped"] += 1
+        return False
+    await msg.edit(embed=embed)
+    warm_state["rendered"][key] = handle
+    return True
+
+def _active_event_rows():
+    conn = sqlite3.connect(DB_NAME)
+    rows = conn.execute("SELECT event_id, title, date_str, time_str, channel_id, message_id FROM events WHERE active=1").fetchall()
+    conn.close()
+    return rows
+
+def _build_event_index(rows):
+    return [[eid, f"#{eid} | {title} ({dstr})"] for eid, title, dstr, *_ in rows]
+
+def get_event_index():
+    if warm_state["event_index"] is None: warm_state["event_index"] = _build_event_index(_active_event_rows())
+    return warm_state["event_index"]
+
+def invalidate_event_index():
+    warm_state["event_index"] = None
+
+def reminder_due(event_id, date_str, time_str, kind):
+    # True ถ้ายังไม่เคยส่งแจ้งเตือนแบบนี้ให้ Event นี้ (วัน/เวลาถูกแก้ = เริ่มนับใหม่)
+    at = f"{date_str}|{time_str}"
+    entry = warm_state["reminders"].get(str(event_id))
+    if not entry or entry["at"] != at: return True
+    return kind not in entry["sent"]
+
+def mark_reminder_sent(event_id, date_str, time_str, kind):
+    at = f"{date_str}|{time_str}"
+    entry = warm_state["reminders"].get(str(event_id))
+    if not entry or entry["at"] != at:
+        entry = warm_state["reminders"][str(event_id)] = {"at": at, "sent": []}
+    entry["sent"].append(kind)
+
+def command_tree_hash(tree):
+    payload = sorted((cmd.to_dict(tree) for cmd in tree.get_commands()), key=lambda d: (d.get("type", 1), d["name"]))
+    return hashlib.sha1(json.dumps(payload, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+async def sync_commands_if_changed(tree):
+    h = command_tree_hash(tree)
+    if warm_state["command_hash"] == h:
+        warm_stats["sync_skipped"] = True
+        return None
+    synced = await tree.sync()
+    warm_state["command_hash"] = h
+    warm_stats["sync_skipped"] = False
+    return synced
+
+def dump_warm_state():
+    # แปลงเป็น JSON บน event loop (warm_state ถูกแก้จาก handler ตลอด ห้าม serialize ใน thread อื่น)
+    return json.dumps({"version": WARM_STATE_VERSION, "saved_at": bangkok_now().isoformat(), **warm_state}, ensure_ascii=False)
+
+@traced("warm.write")
+def write_warm_state(text, path=None):
+    # เขียนข้อความที่ dump ไว้แล้วลงไฟล์แบบ atomic (เรียกใน thread ได้)
+    path = path or WARM_STATE_FILE
+    folder = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(prefix=".warm-", dir=folder)
+    with os.fdopen(fd, "w", encoding="utf-8") as f: f.write(text)
+    os.replace(tmp, path)
+    warm_stats["saves"] += 1
+    return path
+
+@traced("warm.save")
+def save_warm_state(path=None):
+    return write_warm_state(dump_warm_state(), path)
+
+@traced("warm.load")
+def load_warm_state(path=None):
+    # โหลด snapshot แล้วตัดส่วนที่ไม่ตรงกับ DB ทิ้ง; คืนค่า (จำนวนที่ใช้ได้, จำนวนที่ทิ้ง)
+    path = path or WARM_STATE_FILE
+    try:
+        with open(path, encoding="utf-8") as f: snap = json.load(f)
+    except FileNotFoundError: return 0, 0
+    except (OSError, ValueError) as e:
+        trace_swallowed("load_warm_state", e)
+        return 0, 0
+    if snap.get("version") != WARM_STATE_VERSION: return 0, 0
+    rows = _active_event_rows()
+    events = {eid: (dstr, tstr, ch_id, msg_id) for eid, _, dstr, tstr, ch_id, msg_id in rows}
+    expected = {f"war:{eid}": [ev[2], ev[3]] for eid, ev in events.items()}
+    link = get_bot_config('leave_board')
+    if link: expected["leave_board"] = [link[1], link[2]]
+    kept, dropped = 0, 0
+    rendered = {}
+    for key, handle in (snap.get("rendered") or {}).items():
+        if expected.get(key) == handle[:2]:
+            rendered[key] = handle
+            kept += 1
+        else: dropped += 1
+    reminders = {}
+    for eid, entry in (snap.get("reminders") or {}).items():
+        ev = events.get(int(eid))
+        if ev and entry.get("at") == f"{ev[0]}|{ev[1]}":
+            reminders[eid] = entry
+            kept += 1
+        else: dropped += 1
+    index = _build_event_index(rows)
+    if snap.get("event_index") is not None and snap["event_index"] != index: dropped += 1
+    warm_state.update(rendered=rendered, reminders=reminders, event_index=index, command_hash=snap.get("command_hash"))
+    warm_stats.update(loaded=True, restored=kept, dropped=dropped)
+    return kept, dropped
+
+# ==========================================
+# 🚦 BUTTON THROTTLE (Token Bucket)
+# ==========================================
+class TokenBucket:
+    __slots__ = ("capacity", "interval", "tokens", "stamp")
+
+    def __init__(self, capacity, interval, now):
+        self.capacity = capacity
+        self.interval = interval
+        self.tokens = float(capacity)
+        self.stamp = now
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.stamp) / self.interval)
+        self.stamp = now
+
+    def wait_time(self, now):
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) * self.interval
+
+    def take(self):
+        self.tokens -= 1
+
+button_buckets = {}
+throttle_stats = {}
+weapons_embed_cache = collections.OrderedDict()
+_bucket_prune_at = 0.0
+
+def prune_button_buckets(now):
+    # ทิ้ง bucket ที่เต็มแล้ว (ไม่มีใครกดมานาน) กันโตไม่สิ้นสุด
+    for key in [k for k, b in button_buckets.items() if b.wait_time(now) == 0 and b.tokens >= b.capacity]: del button_buckets[key]
+
+def throttle_click(action, user_id, message_id):
+    # 0 = กดได้ (หัก token ทั้งสองชั้น), มากกว่า 0 = ต้องรออีกกี่วินาที
+    global _bucket_prune_at
+    limits = BUTTON_THROTTLE.get(action)
+    stats = throttle_stats.setdefault(action, {"allowed": 0, "throttled": 0})
+    if not limits:
+        stats["allowed"] += 1
+        return 0.0
+    now = time.monotonic()
+    if len(button_buckets) > BUTTON_BUCKET_LIMIT and now >= _bucket_prune_at:
+        _bucket_prune_at = now + BUTTON_BUCKET_PRUNE_SECONDS
+        prune_button_buckets(now)
+    buckets = []
+    for scope, key in (("user", (action, message_id, user_id)), ("message", (action, message_id))):
+        if scope not in limits: continue
+        bucket = button_buckets.get(key)
+        if bucket is None: bucket = button_buckets[key] = TokenBucket(*limits[scope], now)
+        buckets.append(bucket)
+    wait = max(b.wait_time(now) for b in buckets)
+    if wait:
+        stats["throttled"] += 1
+        return wait
+    for b in buckets: b.take()
+    stats["allowed"] += 1
+    return 0.0
+
+async def send_throttled(interaction, wait, content="", **kwargs):
+    # ตอบแบบถูก ๆ: ไม่อ่าน DB ไม่ render ใหม่ ส่งของที่ cache ไว้ (ถ้ามี) พร้อมบอกเวลาคูลดาวน์
+    note = f"⏳ ปุ่มนี้กำลังคูลดาวน์ ลองใหม่ในอีก {max(1, round(wait))} วินาที"
+    await interaction.response.send_message(f"{note}\n{content}" if content else note, ephemeral=True, **kwargs)
+
+# ==========================================
+# 🧹 BULK ADMIN (Batched Transactions + Fan-out)
+# ==========================================
+async def fan_out(jobs, limit=BULK_MESSAGE_CONCURRENCY, per_channel=BULK_CHANNEL_CONCURRENCY):
+    # jobs = [(channel_id, ชื่อจุดสำหรับ trace, coroutine function)] ยิงพร้อมกันไม่เกิน limit และไม่เกิน per_channel ต่อห้อง
+    # (รอคิวห้องก่อนแล้วค่อยจองช่องรวม ห้องที่คิวยาวจะไม่กินช่องของห้องอื่น) 429 ที่เหลือ discord.py รอให้เองตาม bucket
+    result = {"ok": 0, "missing": 0, "failed": 0}
+    total = asyncio.Semaphore(limit)
+    channels = collections.defaultdict(lambda: asyncio.Semaphore(per_channel))
+    async def run(channel_id, where, job):
+        async with channels[channel_id], total:
+            try:
+                await job()
+                result["ok"] += 1
+            except discord.NotFound: result["missing"] += 1
+            except Exception as e:
+                result["failed"] += 1
+                trace_swallowed(where, e)
+    await asyncio.gather(*(run(*job) for job in jobs))
+    return result
 
-def get_roster(event_id):
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute("SELECT user_id, username, team, role, time_text, weapons FROM registrations WHERE event_id=? ORDER BY joined_at ASC", (event_id,))
-    data = c.fetchall()
-    conn.close()
-    return data
+def pack_embeds(embeds, max_chars=6000, max_embeds=10):
+    # รวม embed เป็นข้อความละไม่เกิน 10 อัน / 6000 ตัวอักษร (ข้อจำกัดของ Discord ต่อหนึ่งข้อความ)
+    batches, size = [], 0
+    for embed in embeds:
+        n = len(embed)
+        if not batches or len(batches[-1]) >= max_embeds or size + n > max_chars:
+            batches.append([])
+            size = 0
+        batches[-1].append(embed)
+        size += n
+    return batches
 
-def db_get_leaderboard():
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute('''SELECT username, COUNT(*) as count FROM registrations GROUP BY user_id ORDER BY count DESC LIMIT 10''')
-    data = c.fetchall()
-    conn.close()
-    return data
+def history_summary_embed(embed, event_id):
+    embed.title = f"📜 สรุปยอดวอ (Event #{event_id}) - จบงาน"
+    embed.color = 0x2b2d31
+    return embed
 
-def set_bot_config(name, guild_id, channel_id, message_id):
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute('''INSERT OR REPLACE INTO bot_config (config_name, guild_id, channel_id, message_id) VALUES (?, ?, ?, ?)''', (name, guild_id, channel_id, message_id))
-    conn.commit()
-    conn.close()
+def closed_dashboard_embed(ev, data):
+    total_players = len([p for p in data if p[2] != "Absence"])
+    date_obj = parse_event_datetime(ev[2], ev[3])
+    date_display = date_obj.strftime("%Y-%m-%d") if date_obj else ev[2]
+    embed = discord.Embed(color=0x2b2d31)
+    embed.description = (
+        f"## 🔴 จบวอแล้ว: {ev[1]}\n\n"
+        f"✅ **บันทึกข้อมูลเรียบร้อย**\n"
+        f"📅 **วันที่:** {date_display}\n"
+        f"👤 **จำนวนคน:** {total_players} คน\n\n"
+        f"**System Closed.**"
+    )
+    return embed
 
-def get_bot_config(name):
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute("SELECT guild_id, channel_id, message_id FROM bot_config WHERE config_name=?", (name,))
-    row = c.fetchone()
-    conn.close()
-    return row
+def parse_bangkok_date(text):
+    # "2025-03-01" -> date (ValueError ถ้ารูปแบบผิด)
+    return datetime.strptime(text.strip(), "%Y-%m-%d").date()
 
-def member_upsert(user_id, username, role, weapons):
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute('''INSERT OR REPLACE INTO guild_members (user_id, username, role, weapons, joined_at) VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)''', (user_id, username, role, weapons))
-    conn.commit()
-    conn.close()
+def bangkok_date_to_utc(d):
+    # เที่ยงคืนเวลาไทยของวันที่ d -> สตริง UTC แบบเดียวกับ CURRENT_TIMESTAMP (ใช้เทียบกับ closed_at)
+    start = pytz.timezone('Asia/Bangkok').localize(datetime.combine(d, datetime.min.time()))
+    return start.astimezone(pytz.utc).strftime("%Y-%m-%d %H:%M:%S")
 
-def member_remove(user_id):
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute("DELETE FROM guild_members WHERE user_id=?", (user_id,))
-    conn.commit()
-    conn.close()
+def _id_ranges(event_ids):
+    # [1, 2, 3, 7] -> [(1, 3), (7, 7)] ใช้กับ find_events ตอนยืนยัน (อ่านสถานะล่าสุดอีกรอบ)
+    ranges = []
+    for eid in sorted(event_ids):
+        if ranges and ranges[-1][1] == eid - 1: ranges[-1] = (ranges[-1][0], eid)
+        else: ranges.append((eid, eid))
+    return ranges
 
-def get_all_members():
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute("SELECT username, role, weapons FROM guild_members ORDER BY joined_at ASC")
-    data = c.fetchall()
-    conn.close()
-    return data
+async def run_bulk_close(client, event_ids):
+    # ปิดงานที่ยังเปิดอยู่ใน event_ids: DB ทรานแซกชันเดียว -> render ประวัติจาก snapshot เดียว -> แก้ dashboard + ส่งประวัติพร้อมกัน
+    t0 = time.perf_counter()
+    events = await asyncio.to_thread(find_events, _id_ranges(event_ids), None, True)
+    ids = [ev[0] for ev in events]
+    await asyncio.to_thread(close_events_db, ids)
+    events, rosters, leaves, _ = await asyncio.to_thread(load_dashboard_snapshot, ids)
+    db_ms = (time.perf_counter() - t0) * 1000
+    jobs, history = [], []
+    for ev in events:
+        data = rosters[ev[0]]
+        history.append(history_summary_embed(build_dashboard_embed(ev, data, leaves), ev[0]))
+        ch = client.get_channel(ev[6])
+        if ch: jobs.append((ev[6], "close_wars.dashboard_edit", functools.partial(ch.get_partial_message(ev[7]).edit, embed=closed_dashboard_embed(ev, data), view=None)))
+        forget_rendered(f"war:{ev[0]}")
+    hist_ch = client.get_channel(HISTORY_CHANNEL_ID) if HISTORY_CHANNEL_ID else None
+    batches = pack_embeds(history) if hist_ch else []
+    posted = [0]
 
-def clear_all_members():
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute("DELETE FROM guild_members")
-    conn.commit()
-    conn.close()
+    async def post_history():
+        # ส่งเรียงตามลำดับ Event ในห้องประวัติ (ทีละข้อความ ข้อความละหลาย embed)
+        for batch in batches:
+            await hist_ch.send(embeds=batch)
+            posted[0] += 1
 
-def leave_upsert(user_id, username, leave_type, date_text, expiry_date_str, reason):
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute('''INSERT OR REPLACE INTO leave_records (user_id, username, leave_type, date_text, expiry_date, reason, posted_at) VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)''', (user_id, username, leave_type, date_text, expiry_date_str, reason))
-    conn.commit()
-    conn.close()
+    messages, history_result = await asyncio.gather(fan_out(jobs), fan_out([(HISTORY_CHANNEL_ID, "close_wars.history_post", post_history)] if batches else []))
+    return {"event_ids": ids, "db_ms": db_ms, "messages": messages, "history_posts": posted[0],
+            "history_failed": bool(history_result["failed"] or history_result["missing"]), "elapsed_ms": (time.perf_counter() - t0) * 1000}
 
-def leave_remove(user_id):
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute("DELETE FROM leave_records WHERE user_id=?", (user_id,))
-    conn.commit()
-    conn.close()
+async def run_bulk_delete(client, event_ids):
+    # ลบงานใน event_ids: DB ทรานแซกชันเดียว -> ลบข้อความ dashboard พร้อมกัน
+    t0 = time.perf_counter()
+    events = await asyncio.to_thread(find_events, _id_ranges(event_ids))
+    ids = [ev[0] for ev in events]
+    await asyncio.to_thread(delete_events_db, ids)
+    db_ms = (time.perf_counter() - t0) * 1000
+    jobs = []
+    for ev in events:
+        ch = client.get_channel(ev[6])
+        if ch: jobs.append((ev[6], "delete_events.message_delete", ch.get_partial_message(ev[7]).delete))
+        forget_rendered(f"war:{ev[0]}")
+    messages = await fan_out(jobs)
+    return {"event_ids": ids, "db_ms": db_ms, "messages": messages, "elapsed_ms": (time.perf_counter() - t0) * 1000}
 
-def get_all_leaves():
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute('''SELECT l.user_id, l.username, l.leave_type, l.date_text, l.expiry_date, l.reason, m.role FROM leave_records l LEFT JOIN guild_members m ON l.user_id = m.user_id ORDER BY l.posted_at ASC''')
-    data = c.fetchall()
-    conn.close()
-    return data
+BULK_ACTIONS = {"close": ("🔴", "ปิดงาน", 0xe67e22), "delete": ("🗑️", "ลบ", 0xe74c3c)}
+
+def bulk_preview_embed(action, events):
+    icon, label, color = BULK_ACTIONS[action]
+    lines = [f"{'🟢' if ev[8] else '⚫'} `#{ev[0]}` {ev[1]} ({ev[2]} {ev[3]})" for ev in events[:BULK_PREVIEW_LINES]]
+    if len(events) > BULK_PREVIEW_LINES: lines.append(f"... และอีก {len(events) - BULK_PREVIEW_LINES} งาน")
+    embed = discord.Embed(title=f"{icon} {label} {len(events)} งาน?", description="\n".join(lines), color=color)
+    embed.set_footer(text="ตรวจรายการแล้วกดยืนยัน (ข้อมูลจะถูกอ่านใหม่อีกครั้งตอนยืนยัน)")
+    return embed
+
+def bulk_summary_embed(action, summary):
+    icon, label, color = BULK_ACTIONS[action]
+    ids, m = summary["event_ids"], summary["messages"]
+    embed = discord.Embed(title=f"{icon} {label}เรียบร้อย {len(ids)} งาน", color=color)
+    embed.add_field(name="🗄️ ฐานข้อมูล", value=f"1 ทรานแซกชัน | {summary['db_ms']:.0f} ms", inline=True)
+    embed.add_field(name="✉️ ข้อความ Dashboard", value=f"สำเร็จ {m['ok']} | ไม่พบ {m['missing']} | ล้มเหลว {m['failed']}", inline=True)
+    if "history_posts" in summary:
+        embed.add_field(name="📜 ประวัติ", value=f"ส่ง {summary['history_posts']} ข้อความ" + (" ⚠️ ส่งไม่ครบ" if summary["history_failed"] else ""), inline=True)
+    id_text = ", ".join(f"#{lo}" if lo == hi else f"#{lo}-{hi}" for lo, hi in _id_ranges(ids))
+    embed.add_field(name="🆔 Event", value=id_text[:1024] or "-", inline=False)
+    embed.set_footer(text=f"ใช้เวลาทั้งหมด {summary['elapsed_ms'] / 1000:.1f} วินาที")
+    return embed
 
 # ==========================================
 # 🧠 HELPER FUNCTIONS
@@ -199,24 +2557,25 @@ async def refresh_leave_board(bot_client):
     guild_id, ch_id, msg_id = link
     try:
         ch = bot_client.get_channel(ch_id)
-        if ch:
-            msg = await ch.fetch_message(msg_id)
-            await msg.edit(embed=create_leave_board_embed())
-    except: pass
+        if ch: await edit_tracked(ch.get_partial_message(msg_id), "leave_board", create_leave_board_embed())
+    except Exception as e: trace_swallowed("refresh_leave_board", e)
 
-async def refresh_all_active_wars(bot_client):
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute("SELECT event_id, channel_id, message_id FROM events WHERE active=1")
-    active_events = c.fetchall()
-    conn.close()
-    for ev_id, ch_id, msg_id in active_events:
+async def refresh_all_active_wars(bot_client, event_ids=None):
+    # event_ids = None -> ทุกตารางที่เปิดอยู่
+    for ev, embed in render_dashboards(event_ids):
+        ch_id, msg_id = ev[6], ev[7]
         try:
             ch = bot_client.get_channel(ch_id)
-            if ch:
-                msg = await ch.fetch_message(msg_id)
-                await msg.edit(embed=create_dashboard_embed(ev_id))
-        except: pass
+            if ch: await edit_tracked(ch.get_partial_message(msg_id), f"war:{ev[0]}", embed)
+        except Exception as e: trace_swallowed("refresh_all_active_wars", e)
+
+async def refresh_war_dashboard(bot_client, event_id):
+    ev = get_event(event_id)
+    if not ev or not ev[6]: return
+    try:
+        ch = bot_client.get_channel(ev[6])
+        if ch: await edit_tracked(ch.get_partial_message(ev[7]), f"war:{event_id}", create_dashboard_embed(event_id))
+    except Exception as e: trace_swallowed("refresh_war_dashboard", e)
 
 async def send_log(bot, action_type, description, user):
     if not LOG_CHANNEL_ID: return
@@ -235,7 +2594,7 @@ async def send_log(bot, action_type, description, user):
         embed.set_footer(text=f"User ID: {user.id} | {bangkok_now().strftime('%d/%m/%Y %H:%M')}")
         if user.display_avatar: embed.set_thumbnail(url=user.display_avatar.url)
         await ch.send(embed=embed)
-    except: pass
+    except Exception as e: trace_swallowed("send_log", e)
 
 def parse_event_datetime(date_str, time_str):
     now = bangkok_now()
@@ -276,14 +2635,8 @@ def format_full_date(date_str):
     return date_str
 
 async def event_autocomplete(interaction: discord.Interaction, current: str) -> list[app_commands.Choice[int]]:
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute("SELECT event_id, title, date_str FROM events WHERE active=1") 
-    events = c.fetchall()
-    conn.close()
     choices = []
-    for eid, title, dstr in events:
-        display_name = f"#{eid} | {title} ({dstr})"
+    for eid, display_name in get_event_index():
         if current.lower() in display_name.lower():
             choices.append(app_commands.Choice(name=display_name, value=eid))
     return choices[:25]
@@ -294,6 +2647,42 @@ class DashboardLinkView(discord.ui.View):
         url = f"https://discord.com/channels/{guild_id}/{channel_id}/{message_id}"
         self.add_item(discord.ui.Button(label="📍 ไปที่ห้องลงชื่อ", style=discord.ButtonStyle.link, url=url))
 
+class PaginatorView(discord.ui.View):
+    # เลื่อนหน้า embed แบบ ◀️ ▶️ (ใช้กับรายงาน/ผลค้นหาที่ยาวเกิน 1 embed) owner_id = เฉพาะคนที่เรียกคำสั่งกดได้
+    def __init__(self, pages, owner_id=None, timeout=600):
+        super().__init__(timeout=timeout)
+        self.pages = pages
+        self.owner_id = owner_id
+        self.index = 0
+        self._sync_buttons()
+
+    def _sync_buttons(self):
+        self.prev_page.disabled = self.index == 0
+        self.next_page.disabled = self.index >= len(self.pages) - 1
+        self.counter.label = f"{self.index + 1}/{len(self.pages)}"
+
+    async def interaction_check(self, interaction: discord.Interaction):
+        if self.owner_id is None or interaction.user.id == self.owner_id: return True
+        await interaction.response.send_message("🔒 ปุ่มนี้ใช้ได้เฉพาะคนที่เรียกคำสั่ง", ephemeral=True)
+        return False
+
+    async def _show(self, interaction, index):
+        self.index = max(0, min(index, len(self.pages) - 1))
+        self._sync_buttons()
+        await interaction.response.edit_message(embed=self.pages[self.index], view=self)
+
+    @discord.ui.button(label="◀️", style=discord.ButtonStyle.secondary)
+    async def prev_page(self, interaction: discord.Interaction, button: Button):
+        await self._show(interaction, self.index - 1)
+
+    @discord.ui.button(label="1/1", style=discord.ButtonStyle.secondary, disabled=True)
+    async def counter(self, interaction: discord.Interaction, button: Button):
+        pass
+
+    @discord.ui.button(label="▶️", style=discord.ButtonStyle.secondary)
+    async def next_page(self, interaction: discord.Interaction, button: Button):
+        await self._show(interaction, self.index + 1)
+
 # ==========================================
 # 📊 GENERATORS (Dashboard & Leave Board)
 # ==========================================
@@ -315,11 +2704,8 @@ def make_visual_bar(dps, tank, heal):
         bar += "⚫" * (limit - current_len)
     return f"`{bar}`"
 
-def create_dashboard_embed(event_id):
-    event = get_event(event_id)
-    if not event: return discord.Embed(title="❌ Event Not Found")
-    
-    ev_id, title, date_str, time_str, teams_str, color_val, _, _, active = event[:9]
+def parse_teams(teams_str):
+    # "Team ATK|20,Team Flex|0" -> (["Team ATK", "Team Flex"], {"Team ATK": 20, "Team Flex": 0})
     parsed_teams = []
     parsed_limits = {}
     for t_str in teams_str.split(","):
@@ -330,8 +2716,19 @@ def create_dashboard_embed(event_id):
         else:
             parsed_teams.append(t_str)
             parsed_limits[t_str] = 0
+    return parsed_teams, parsed_limits
+
+@traced("render.create_dashboard_embed")
+def create_dashboard_embed(event_id):
+    event = get_event(event_id)
+    if not event: return discord.Embed(title="❌ Event Not Found")
+    return build_dashboard_embed(event, get_roster(event_id), get_all_leaves())
 
-    data = get_roster(event_id)
+def build_dashboard_embed(event, data, active_leaves):
+    # สร้าง embed จากข้อมูลที่โหลดมาแล้ว (ไม่แตะ DB) ใช้ร่วมกันทั้งแบบทีละตารางและแบบ batch
+    ev_id, title, date_str, time_str, teams_str, color_val, _, _, active = event[:9]
+    event_id = ev_id
+    parsed_teams, parsed_limits = parse_teams(teams_str)
     event_users = {p[0] for p in data}
 
     stats = {t: {"DPS":0, "Tank":0, "Heal":0, "Total":0} for t in parsed_teams}
@@ -375,7 +2772,6 @@ def create_dashboard_embed(event_id):
         elif is_standby:
             roster[team]["Standby"].append(f"💤zZ **{username}** [Standby]")
 
-    active_leaves = get_all_leaves()
     for l_uid, l_uname, l_type, l_dtext, l_exp, l_reason, l_role in active_leaves:
         if l_uid not in event_users: 
             role_txt = f" ({l_role})" if l_role else ""
@@ -415,55 +2811,188 @@ def create_dashboard_embed(event_id):
     embed.set_footer(text=f"EVENT ID: #{event_id} | STATUS: {status_text} | Last Updated: {bangkok_now().strftime('%H:%M:%S')}")
     return embed
 
-# 🔥 1. แก้ไขดีไซน์ตารางแจ้งลาให้โปร่งและสวยขึ้น (ลดความเบียด)
-def create_leave_board_embed():
-    leaves = get_all_leaves()
-    short_term = []
-    late_list = []
-    hiatus = []
-    for uid, uname, ltype, dtext, exp, reason, role in leaves:
+# ==========================================
+# 📋 MEMBER / LEAVE BOARD (Sorted Index + Page Cache)
+# ==========================================
+class BoardIndex:
+    # แถวของบอร์ดอยู่ในหน่วยความจำ แยกตามกลุ่มและเรียงด้วย bisect; แก้ทีละคนโดยอ่านเฉพาะแถวนั้นจาก DB
+    # หน้า = field ที่ไม่เกิน 1024 ตัวอักษร รวมกันไม่เกิน BOARD_PAGE_CHARS; embed ของแต่ละหน้า cache ไว้ หน้าที่เนื้อหาไม่เปลี่ยนไม่ต้อง render ใหม่
+    FIELD_CHARS = 1024
+
+    def __init__(self):
+        self.rows = None  # user_id -> แถว
+        self.groups = {}  # กลุ่ม -> [(sort_key, user_id)] เรียงอยู่เสมอ
+        self.lines = {}  # user_id -> ข้อความของคนนั้น (render ครั้งเดียวต่อการแก้)
+        self.dirty = set()
+        self.version = 0
+        self.current = 0  # หน้าที่ข้อความบอร์ดแสดงอยู่
+        self._layout = (-1, [])
+        self._page_cache = {}  # หน้า -> (fields, embed, เวลาที่ render)
+        self.stats = {"loads": 0, "row_refreshes": 0, "page_renders": 0, "page_hits": 0}
+
+    def changed(self, user_id=None):
+        # None = โหลดใหม่ทั้งบอร์ด
+        if user_id is None: self.rows = None
+        elif self.rows is not None: self.dirty.add(user_id)
+
+    def _put(self, user_id, row):
+        old = self.rows.pop(user_id, None)
+        if old is not None:
+            items = self.groups[self.group_of(old)]
+            del items[bisect.bisect_left(items, (self.sort_key(old), user_id))]
+            self.lines.pop(user_id, None)
+        group = self.group_of(row) if row is not None else None
+        if group is None: return
+        self.rows[user_id] = row
+        bisect.insort(self.groups.setdefault(group, []), (self.sort_key(row), user_id))
+        self.lines[user_id] = self.line(row)
+
+    def sync(self):
+        if self.rows is None:
+            conn = sqlite3.connect(DB_NAME)
+            fresh = self.fetch(conn)
+            conn.close()
+            self.rows, self.groups, self.lines, self.dirty = {}, {}, {}, set()
+            for uid, row in fresh.items(): self._put(uid, row)
+            self.stats["loads"] += 1
+            self.version += 1
+        elif self.dirty:
+            dirty, self.dirty = list(self.dirty), set()
+            conn = sqlite3.connect(DB_NAME)
+            fresh = self.fetch(conn, dirty)
+            conn.close()
+            for uid in dirty: self._put(uid, fresh.get(uid))
+            self.stats["row_refreshes"] += len(dirty)
+            self.version += 1
+
+    def _fields(self):
+        fields = []
+        for group, title, sep, empty, tail, numbered in self.sections():
+            items = self.groups.get(group, [])
+            if not items:
+                if empty: fields.append((title.format(count=0), empty + tail))
+                continue
+            name = title.format(count=len(items))
+            cur = ""
+            for n, (_, uid) in enumerate(items, 1):
+                line = (f"`> {n}.` " if numbered else "") + self.lines[uid]
+                line = line[:self.FIELD_CHARS - len(tail) - 1]
+                if cur and len(cur) + len(sep) + len(line) + len(tail) > self.FIELD_CHARS:
+                    fields.append((name, cur + tail))
+                    # ยอดรวมอยู่แค่ field แรก: ยอดเปลี่ยนแล้วหน้าถัด ๆ ไปไม่ต้อง render ใหม่
+                    name, cur = title.replace(" ({count} คน)", "") + " (ต่อ)", ""
+                cur = cur + sep + line if cur else line
+            fields.append((name, cur + tail))
+        return fields
+
+    def pages(self):
+        self.sync()
+        if self._layout[0] != self.version:
+            pages, page, size = [], [], 0
+            for name, value in self._fields():
+                if page and (size + len(name) + len(value) > BOARD_PAGE_CHARS or len(page) == 25):
+                    pages.append(page)
+                    page, size = [], 0
+                page.append((name, value))
+                size += len(name) + len(value)
+            pages.append(page)
+            self._layout = (self.version, pages)
+            for stale in [p for p in self._page_cache if p >= len(pages)]: del self._page_cache[stale]
+        return self._layout[1]
+
+    def page_embed(self, page=None):
+        pages = self.pages()
+        page = self.current if page is None else page
+        page = self.current = max(0, min(page, len(pages) - 1))
+        fields = tuple(pages[page])
+        cached = self._page_cache.get(page)
+        if cached and cached[0] == fields:
+            self.stats["page_hits"] += 1
+            _, embed, rendered = cached
+        else:
+            embed = self.header()
+            for name, value in fields: embed.add_field(name=name, value=value, inline=False)
+            rendered = bangkok_now()
+            self._page_cache[page] = (fields, embed, rendered)
+            self.stats["page_renders"] += 1
+        embed = embed.copy()
+        embed.set_footer(text=self.footer(rendered) + (f" | หน้า {page + 1}/{len(pages)}" if len(pages) > 1 else ""))
+        return embed
+
+class MemberBoardIndex(BoardIndex):
+    ROLE_EMOJIS = {"DPS": "⚔️", "Tank": "🛡️", "Heal": "🌿"}
+
+    def fetch(self, conn, ids=None):
+        sql = "SELECT user_id, username, role, weapons, joined_at FROM guild_members"
+        if ids: sql += f" WHERE user_id IN ({','.join('?' * len(ids))})"
+        return {row[0]: row[1:] for row in conn.execute(sql, ids or ())}
+
+    def group_of(self, row): return row[1] if row[1] in self.ROLE_EMOJIS else None
+    def sort_key(self, row): return row[3] or ""
+
+    def line(self, row):
+        username, role, weapons, _ = row
+        wp_text = f"`{weapons}`" if weapons and weapons != "-" else "`ยังไม่ระบุอาวุธ`"
+        return f"{self.ROLE_EMOJIS.get(role, '👤')} **{username}** - {wp_text}"
+
+    def sections(self):
+        # (กลุ่ม, ชื่อ field, ตัวคั่น, ข้อความตอนว่าง, ท้าย field, ใส่ลำดับ)
+        empty = "*... ยังไม่มีจอมยุทธ์ในสังกัดนี้ ...*"
+        return [("DPS", "⚔️ สังกัดหน่วยโจมตี (DPS) ({count} คน)", "\n", empty, "", True),
+                ("Tank", "🛡️ สังกัดหน่วยป้องกัน (Tank) ({count} คน)", "\n", empty, "", True),
+                ("Heal", "🌿 สังกัดหน่วยสนับสนุน (Heal) ({count} คน)", "\n", empty, "", True)]
+
+    def header(self): return discord.Embed(title="👺 ทำเนียบจอมยุทธ์กิลด์ 天狗", description="ลงทะเบียนสายตำแหน่งและอาวุธหลักของคุณ", color=0x2ecc71)
+    def footer(self, rendered): return f"อัปเดตล่าสุด: {rendered.strftime('%d/%m/%Y %H:%M')}"
+
+class LeaveBoardIndex(BoardIndex):
+    def fetch(self, conn, ids=None):
+        sql = "SELECT l.user_id, l.username, l.leave_type, l.date_text, l.reason, m.role, l.posted_at FROM leave_records l LEFT JOIN guild_members m ON l.user_id = m.user_id"
+        if ids: sql += f" WHERE l.user_id IN ({','.join('?' * len(ids))})"
+        return {row[0]: row[1:] for row in conn.execute(sql, ids or ())}
+
+    def group_of(self, row): return "hiatus" if row[1] == "hiatus" else "late" if row[1] == "late" else "short"
+    def sort_key(self, row): return row[5] or ""
+
+    def line(self, row):
+        # จัดฟอร์แมตให้มีการเว้นบรรทัดและใส่ Blockquote สวยงาม
+        uname, ltype, dtext, reason, role, _ = row
         role_txt = f" ({role})" if role else ""
-        
-        # จัดฟอร์แมตใหม่ให้มีการเว้นบรรทัดและใส่ Blockquote สวยงาม
-        if ltype == "hiatus": 
-            hiatus.append(f"> 💤 **{uname}**{role_txt}\n> └ 📝 เหตุผล: {reason} `[{dtext}]`")
-        elif ltype == "late": 
-            late_list.append(f"> 🐢 **{uname}**{role_txt}\n> └ ⏰ {dtext} *(เหตุผล: {reason})*")
-        else: 
-            short_term.append(f"> ❌ **{uname}**{role_txt}\n> └ 📝 เหตุผล: {reason} `[{dtext}]`")
-            
-    embed = discord.Embed(title="📋 บอร์ดแจ้งลาหยุด / พักรบกิลด์ 天狗", description="แอดมินและหัวหน้าหน่วยสามารถเช็ครายชื่อผู้ที่ไม่อยู่ได้ที่นี่\n*(ระบบจะเคลียร์รายชื่อเมื่อหมดเวลาอัตโนมัติ และลิงก์ชื่อเข้าตารางวอให้ทันที)*\n━━━━━━━━━━━━━━━━━━━━━━", color=0x34495e)
-    
-    # เพิ่ม \n\n เพื่อให้มีช่องไฟระหว่างรายชื่อแต่ละคน และ \n\u200b เพื่อเว้นวรรคหมวดหมู่
-    val_short = "\n\n".join(short_term) if short_term else "> *... ไม่มีผู้ลาระยะสั้น ...*"
-    embed.add_field(name="📅 ลาระยะสั้น (Short-term)", value=val_short + "\n\u200b", inline=False)
-    
-    if late_list:
-        embed.add_field(name="⏳ แจ้งมาสายล่วงหน้า (Late)", value="\n\n".join(late_list) + "\n\u200b", inline=False)
-        
-    val_hiatus = "\n\n".join(hiatus) if hiatus else "> *... ไม่มีผู้ลาพักยาว ...*"
-    embed.add_field(name="🛌 ลาพักยาว (Hiatus)", value=val_hiatus + "\n\u200b", inline=False)
-    
-    embed.set_footer(text=f"อัปเดตอัตโนมัติล่าสุด: {bangkok_now().strftime('%d/%m/%Y %H:%M:%S')}")
-    return embed
+        if ltype == "hiatus": return f"> 💤 **{uname}**{role_txt}\n> └ 📝 เหตุผล: {reason} `[{dtext}]`"
+        if ltype == "late": return f"> 🐢 **{uname}**{role_txt}\n> └ ⏰ {dtext} *(เหตุผล: {reason})*"
+        return f"> ❌ **{uname}**{role_txt}\n> └ 📝 เหตุผล: {reason} `[{dtext}]`"
 
-def create_member_board_embed():
-    data = get_all_members()
-    roster = {"DPS": [], "Tank": [], "Heal": []}
-    emojis = {"DPS": "⚔️", "Tank": "🛡️", "Heal": "🌿"}
-    for username, role, weapons in data:
-        if role in roster:
-            emoji = emojis.get(role, "👤")
-            wp_text = f"`{weapons}`" if weapons and weapons != "-" else "`ยังไม่ระบุอาวุธ`"
-            num = len(roster[role]) + 1
-            roster[role].append(f"`> {num}.` {emoji} **{username}** - {wp_text}")
-    embed = discord.Embed(title="👺 ทำเนียบจอมยุทธ์กิลด์ 天狗", description="ลงทะเบียนสายตำแหน่งและอาวุธหลักของคุณ", color=0x2ecc71)
-    roles_info = [("DPS", "⚔️ สังกัดหน่วยโจมตี (DPS)", roster["DPS"]), ("Tank", "🛡️ สังกัดหน่วยป้องกัน (Tank)", roster["Tank"]), ("Heal", "🌿 สังกัดหน่วยสนับสนุน (Heal)", roster["Heal"])]
-    for role_key, role_title, members_list in roles_info:
-        val = "\n".join(members_list) if members_list else "*... ยังไม่มีจอมยุทธ์ในสังกัดนี้ ...*"
-        embed.add_field(name=f"{role_title} ({len(members_list)} คน)", value=val, inline=False)
-    embed.set_footer(text=f"อัปเดตล่าสุด: {bangkok_now().strftime('%d/%m/%Y %H:%M')}")
-    return embed
+    def sections(self):
+        # \n\n = ช่องไฟระหว่างรายชื่อแต่ละคน, \n\u200b = เว้นวรรคระหว่างหมวดหมู่
+        return [("short", "📅 ลาระยะสั้น (Short-term)", "\n\n", "> *... ไม่มีผู้ลาระยะสั้น ...*", "\n\u200b", False),
+                ("late", "⏳ แจ้งมาสายล่วงหน้า (Late)", "\n\n", None, "\n\u200b", False),
+                ("hiatus", "🛌 ลาพักยาว (Hiatus)", "\n\n", "> *... ไม่มีผู้ลาพักยาว ...*", "\n\u200b", False)]
+
+    def header(self):
+        return discord.Embed(title="📋 บอร์ดแจ้งลาหยุด / พักรบกิลด์ 天狗", description="แอดมินและหัวหน้าหน่วยสามารถเช็ครายชื่อผู้ที่ไม่อยู่ได้ที่นี่\n*(ระบบจะเคลียร์รายชื่อเมื่อหมดเวลาอัตโนมัติ และลิงก์ชื่อเข้าตารางวอให้ทันที)*\n━━━━━━━━━━━━━━━━━━━━━━", color=0x34495e)
+    def footer(self, rendered): return f"อัปเดตอัตโนมัติล่าสุด: {rendered.strftime('%d/%m/%Y %H:%M:%S')}"
+
+member_board = MemberBoardIndex()
+leave_board = LeaveBoardIndex()
+
+def on_member_changed(user_id=None):
+    # เรียกหลัง commit ทุกครั้งที่ guild_members เปลี่ยน (บอร์ดแจ้งลาแสดงตำแหน่งจาก guild_members ด้วย)
+    weapon_index.member_changed(user_id)
+    member_board.changed(user_id)
+    if user_id is None: leave_board.changed()
+    elif leave_board.rows is not None and user_id in leave_board.rows: leave_board.changed(user_id)
+
+def on_leave_changed(user_id=None):
+    leave_board.changed(user_id)
+    dashboard_deps.leave_changed(user_id)
+
+@traced("render.create_leave_board_embed")
+def create_leave_board_embed(page=None):
+    return leave_board.page_embed(page)
+
+@traced("render.create_member_board_embed")
+def create_member_board_embed(page=None):
+    return member_board.page_embed(page)
 
 # ==========================================
 # 🛠️ SETUP SYSTEM (Guild War - ปรับปรุงระบบโควต้าทีม)
@@ -618,6 +3147,7 @@ class SetupView(View):
         await interaction.response.edit_message(embed=create_setup_embed(interaction.user.id), view=self)
         
     @discord.ui.button(label="✅ ยืนยันและประกาศ", style=discord.ButtonStyle.green, row=3)
+    @instrumented("SetupView.confirm")
     async def confirm(self, interaction: discord.Interaction, button: Button):
         await interaction.response.defer() 
         s = get_session(interaction.user.id)
@@ -626,6 +3156,7 @@ class SetupView(View):
         view = PersistentWarView(ev_id)
         msg = await interaction.channel.send(embed=embed, view=view)
         update_event_msg(ev_id, msg.channel.id, msg.id)
+        mark_rendered(f"war:{ev_id}", msg, embed)
         await send_log(interaction.client, "Create", f"สร้าง Event #{ev_id} ({s['title']})", interaction.user)
         del setup_sessions[interaction.user.id]
         await interaction.edit_original_response(content=f"✅ **ประกาศเรียบร้อย!**\n🆔 **Event ID: {ev_id}**", embed=None, view=None)
@@ -633,7 +3164,7 @@ class SetupView(View):
     async def cancel(self, interaction: discord.Interaction, button: Button):
         await interaction.response.defer()
         try: await interaction.delete_original_response()
-        except: pass
+        except Exception as e: trace_swallowed("SetupView.cancel", e)
 
 # ==========================================
 # 📝 ALL-IN-ONE REGISTRATION UI
@@ -686,6 +3217,7 @@ class RegistrationView(discord.ui.View):
     async def dummy_callback(self, interaction: discord.Interaction):
         await interaction.response.defer()
 
+    @instrumented("RegistrationView.submit")
     async def submit(self, interaction: discord.Interaction):
         if not self.sel_team.values or not self.sel_role.values or not self.sel_status.values or not self.sel_weapon.values:
             return await interaction.response.send_message("⚠️ **กรุณาเลือกข้อมูลให้ครบทั้ง 4 ช่องก่อนกดบันทึกครับ!**", ephemeral=True)
@@ -704,24 +3236,14 @@ class RegistrationView(discord.ui.View):
                 n, l = t_str.split("|")
                 if n == team: limit = int(l)
         
-        final_status = status
+        # เช็คโควต้าในทรานแซกชันเดียวกับการเขียน (ดู _reg_join_tx)
+        final_status = await reg_join_async(self.event_id, interaction.user.id, interaction.user.display_name, team, role, status, weapons, limit)
         alert_msg = "✅ **บันทึกข้อมูลเรียบร้อยแล้ว! (ข้อมูลอัปเดตลงตารางแล้ว)**"
+        if final_status != status:
+            alert_msg = f"⚠️ **ทีม {team} โควต้าตัวจริงเต็มแล้ว ({limit} คน)!**\nระบบได้ย้ายคุณไปอยู่หมวด **สำรอง (Standby)** ให้อัตโนมัติ"
         
-        if limit > 0 and "Late" not in final_status and "Standby" not in final_status:
-            conn = sqlite3.connect(DB_NAME)
-            c = conn.cursor()
-            c.execute("SELECT user_id, time_text FROM registrations WHERE event_id=? AND team=?", (self.event_id, team))
-            existing = c.fetchall()
-            conn.close()
-            main_count = sum(1 for uid, tt in existing if uid != interaction.user.id and "Late" not in tt and "Standby" not in tt)
-            if main_count >= limit:
-                final_status = "Standby"
-                alert_msg = f"⚠️ **ทีม {team} โควต้าตัวจริงเต็มแล้ว ({limit} คน)!**\nระบบได้ย้ายคุณไปอยู่หมวด **สำรอง (Standby)** ให้อัตโนมัติ"
-
-        reg_upsert(self.event_id, interaction.user.id, interaction.user.display_name, team, role, final_status, weapons)
-        
-        try: await self.dashboard_msg.edit(embed=create_dashboard_embed(self.event_id))
-        except: pass
+        try: await edit_tracked(self.dashboard_msg, f"war:{self.event_id}", create_dashboard_embed(self.event_id))
+        except Exception as e: trace_swallowed("RegistrationView.submit.dashboard_edit", e)
         
         await send_log(interaction.client, "Join/Edit", f"ลงชื่อ/อัปเดตทีม **{team}**\nตำแหน่ง: {role}\nสถานะ: {final_status}\nอาวุธ: {weapons}", interaction.user)
         await interaction.response.edit_message(content=alert_msg, view=None)
@@ -736,10 +3258,11 @@ class ConfirmLeaveView(View):
         self.dashboard_msg = dashboard_msg
 
     @discord.ui.button(label="✅ ยืนยันลบชื่อ", style=discord.ButtonStyle.danger)
+    @instrumented("ConfirmLeaveView.confirm")
     async def confirm(self, interaction: discord.Interaction, button: Button):
-        reg_remove(self.event_id, interaction.user.id)
-        try: await self.dashboard_msg.edit(embed=create_dashboard_embed(self.event_id))
-        except: pass
+        await reg_remove_async(self.event_id, interaction.user.id)
+        try: await edit_tracked(self.dashboard_msg, f"war:{self.event_id}", create_dashboard_embed(self.event_id))
+        except Exception as e: trace_swallowed("ConfirmLeaveView.confirm.dashboard_edit", e)
         await send_log(interaction.client, "Leave", f"ลบชื่อออกจาก Event #{self.event_id}", interaction.user)
         await interaction.response.edit_message(content="🗑️ **ลบชื่อของคุณออกจากตารางเรียบร้อยแล้ว!**", view=None)
 
@@ -747,6 +3270,71 @@ class ConfirmLeaveView(View):
     async def cancel(self, interaction: discord.Interaction, button: Button):
         await interaction.response.edit_message(content="❌ **ยกเลิกการลบชื่อ**", view=None)
 
+def auto_balance_embed(plan, title):
+    embed = discord.Embed(title=f"⚖️ Auto Balance: {title}", color=0x9b59b6)
+    lines = [f"• **{name}**: {old} → {new or '💤 Standby'}" for _, name, old, new in plan["moves"]]
+    desc = "\n".join(lines[:40]) + (f"\n... และอีก {len(lines) - 40} คน" if len(lines) > 40 else "")
+    embed.description = desc or "✅ ทีมสมดุลอยู่แล้ว ไม่ต้องย้ายใคร"
+    for team, st in plan["stats"].items():
+        cap = f"/{st['limit']}" if st["limit"] > 0 else ""
+        dps, tank, heal = st["roles"]
+        embed.add_field(name=team, value=f"👥 {st['size']}{cap}\n⚔️ {dps} | 🛡️ {tank} | 🌿 {heal}\nคนน้อยสุดต่อรอบ: {st['min_round']}", inline=True)
+    embed.set_footer(text=f"ย้าย {len(plan['moves'])} คน | cost {plan['cost_before']:.1f} → {plan['cost_after']:.1f} | {plan['iterations']} รอบ {plan['solve_ms']:.0f} ms")
+    return embed
+
+class BalancePreviewView(View):
+    def __init__(self, plan, owner_id):
+        super().__init__(timeout=300)
+        self.plan = plan
+        self.owner_id = owner_id
+
+    async def interaction_check(self, interaction: discord.Interaction):
+        if interaction.user.id == self.owner_id: return True
+        await interaction.response.send_message("🔒 ปุ่มนี้ใช้ได้เฉพาะคนที่เรียกคำสั่ง", ephemeral=True)
+        return False
+
+    @discord.ui.button(label="✅ ยืนยันจัดทีม", style=discord.ButtonStyle.success)
+    @instrumented("BalancePreviewView.confirm")
+    async def confirm(self, interaction: discord.Interaction, button: Button):
+        event_id = self.plan["event_id"]
+        if not await asyncio.to_thread(apply_auto_balance, self.plan, interaction.user.id):
+            return await interaction.response.edit_message(content="⚠️ **รายชื่อมีการเปลี่ยนแปลงหลังดูตัวอย่าง** กรุณาใช้ /auto_balance ใหม่อีกครั้ง", embed=None, view=None)
+        await interaction.response.edit_message(content=f"⚖️ **จัดทีมเรียบร้อย!** ย้าย {len(self.plan['moves'])} คน (ย้อนได้ด้วย /roster_undo)", view=None)
+        await refresh_war_dashboard(interaction.client, event_id)
+        await send_log(interaction.client, "Edit", f"Auto balance Event #{event_id}: ย้าย {len(self.plan['moves'])} คน", interaction.user)
+
+    @discord.ui.button(label="❌ ยกเลิก", style=discord.ButtonStyle.secondary)
+    async def cancel(self, interaction: discord.Interaction, button: Button):
+        await interaction.response.edit_message(content="❌ **ยกเลิกการจัดทีม**", embed=None, view=None)
+
+class BulkActionView(View):
+    def __init__(self, action, event_ids, owner_id):
+        super().__init__(timeout=300)
+        self.action = action
+        self.event_ids = event_ids
+        self.owner_id = owner_id
+
+    async def interaction_check(self, interaction: discord.Interaction):
+        if interaction.user.id == self.owner_id: return True
+        await interaction.response.send_message("🔒 ปุ่มนี้ใช้ได้เฉพาะคนที่เรียกคำสั่ง", ephemeral=True)
+        return False
+
+    @discord.ui.button(label="✅ ยืนยัน", style=discord.ButtonStyle.danger)
+    @instrumented("BulkActionView.confirm")
+    async def confirm(self, interaction: discord.Interaction, button: Button):
+        icon, label, _ = BULK_ACTIONS[self.action]
+        await interaction.response.edit_message(content=f"⏳ กำลัง{label} {len(self.event_ids)} งาน...", embed=None, view=None)
+        run = run_bulk_close if self.action == "close" else run_bulk_delete
+        summary = await run(interaction.client, self.event_ids)
+        await interaction.edit_original_response(content=None, embed=bulk_summary_embed(self.action, summary))
+        if summary["event_ids"]:
+            ids = ", ".join(f"#{eid}" for eid in summary["event_ids"])
+            await send_log(interaction.client, "Close" if self.action == "close" else "Delete", f"{label} {len(summary['event_ids'])} งาน: {ids}"[:4000], interaction.user)
+
+    @discord.ui.button(label="❌ ยกเลิก", style=discord.ButtonStyle.secondary)
+    async def cancel(self, interaction: discord.Interaction, button: Button):
+        await interaction.response.edit_message(content="❌ **ยกเลิกแล้ว**", embed=None, view=None)
+
 # ==========================================
 # 🎮 MAIN WAR VIEW
 # ==========================================
@@ -779,6 +3367,7 @@ class PersistentWarView(View):
         btn_copy.callback = self.copy
         self.add_item(btn_copy)
 
+    @instrumented("PersistentWarView.register")
     async def register(self, interaction: discord.Interaction):
         ev = get_event(self.event_id)
         if not ev or ev[8] == 0: return await interaction.response.send_message("🔒 ปิดแล้ว", ephemeral=True)
@@ -787,65 +3376,84 @@ class PersistentWarView(View):
         view = RegistrationView(self.event_id, interaction.message, parsed_teams)
         await interaction.response.send_message("👇 **กรุณาเลือกข้อมูลให้ครบทั้ง 4 ช่อง เพื่อลงชื่อหรือแก้ไข:**", view=view, ephemeral=True)
 
+    @instrumented("PersistentWarView.leave")
     async def leave(self, interaction: discord.Interaction):
         view = ConfirmLeaveView(self.event_id, interaction.message)
         await interaction.response.send_message("⚠️ **คุณแน่ใจหรือไม่ว่าต้องการลบชื่อออกจากการรบนี้?**", view=view, ephemeral=True)
 
+    @instrumented("PersistentWarView.refresh")
     async def refresh(self, interaction: discord.Interaction):
-        await interaction.response.edit_message(embed=create_dashboard_embed(self.event_id))
+        wait = throttle_click("refresh", interaction.user.id, interaction.message.id)
+        if wait: return await send_throttled(interaction, wait)
+        embed = create_dashboard_embed(self.event_id)
+        await interaction.response.edit_message(embed=embed)
+        mark_rendered(f"war:{self.event_id}", interaction.message, embed)
 
+    @instrumented("PersistentWarView.check_weapons")
     async def check_weapons(self, interaction: discord.Interaction):
-        data = get_roster(self.event_id)
+        cached = weapons_embed_cache.get(self.event_id)
+        if cached: weapons_embed_cache.move_to_end(self.event_id)
+        wait = throttle_click("check_weapons", interaction.user.id, interaction.message.id)
+        if wait: return await send_throttled(interaction, wait, **({"embed": cached[1]} if cached else {}))
         ev = get_event(self.event_id)
         if not ev: return
-        parsed_teams = [t.split("|")[0] if "|" in t else t for t in ev[4].split(",")]
-        
+        index = weapon_index.event_view(self.event_id)
+        version = (index["version"], ev[4])
+        if cached and cached[0] == version: return await interaction.response.send_message(embed=cached[1], ephemeral=True)
+        parsed_teams, _ = parse_teams(ev[4])
+        by_team = {}
+        for username, team, role, names, _ in index["regs"].values(): by_team.setdefault(team, []).append((username, role, names))
+
         embed = discord.Embed(title=f"🔍 ข้อมูลอาวุธ Event #{self.event_id}", color=0x2ecc71)
         found_any = False
         for t in parsed_teams:
-            team_players = [p for p in data if p[2] == t]
-            if not team_players: continue
+            if t == "Absence" or not by_team.get(t): continue
             val = ""
-            for p in team_players:
-                username, _, role, _, weapons = p[1], p[2], p[3], p[4], p[5]
-                if t == "Absence": continue
-                emoji = "⚔️" if "DPS" in role else "🛡️" if "Tank" in role else "🌿"
-                wp_text = weapons if weapons and weapons != "-" else "ยังไม่ระบุ"
-                val += f"{emoji} **{username}** : `{wp_text}`\n"
-            if val:
-                found_any = True
-                embed.add_field(name=f"━━━━━━ TEAM {t.upper()} ━━━━━━", value=val, inline=False)
-        
+            for username, role, names in by_team[t]:
+                wp_text = " + ".join(names) if names else "ยังไม่ระบุ"
+                val += f"{role_emoji(role)} **{username}** : `{wp_text}`\n"
+            summary = weapon_composition(index["teams"].get(t, collections.Counter()))
+            if summary: val = f"🗡️ {summary}\n\n" + val
+            found_any = True
+            embed.add_field(name=f"━━━━━━ TEAM {t.upper()} ━━━━━━", value=val[:1024], inline=False)
+
         if not found_any: embed.description = "ยังไม่มีข้อมูลอาวุธ"
+        weapons_embed_cache[self.event_id] = (version, embed)
+        weapons_embed_cache.move_to_end(self.event_id)
+        while len(weapons_embed_cache) > WEAPONS_EMBED_CACHE_SIZE: weapons_embed_cache.popitem(last=False)
         await interaction.response.send_message(embed=embed, ephemeral=True)
 
+    @instrumented("PersistentWarView.absence")
     async def absence(self, interaction: discord.Interaction):
         await interaction.response.send_modal(AbsenceModal(self.event_id, interaction.message))
 
+    @instrumented("PersistentWarView.copy")
     async def copy(self, interaction: discord.Interaction):
-        data = get_roster(self.event_id)
-        ev = get_event(self.event_id)
-        if not ev: return
-        parsed_teams = [t.split("|")[0] if "|" in t else t for t in ev[4].split(",")]
-        
-        txt = f"```text\n📋 สรุปรายชื่อ Event #{self.event_id}\n=========================\n"
-        for t in parsed_teams:
-            team_players = [p for p in data if p[2] == t]
-            if not team_players: continue
-            txt += f"🛡️ {t.upper()}\n"
-            main = [p for p in team_players if "Late" not in p[4] and "Standby" not in p[4]]
-            late = [p for p in team_players if "Late" in p[4]]
-            standby = [p for p in team_players if "Standby" in p[4]]
-            for i, p in enumerate(main, 1): txt += f"{i}. {p[1]} ({p[3]}) - {p[4]} [{p[5]}]\n"
-            if late:
-                txt += "\n*🐢 สาย (Late):*\n"
-                for p in late: txt += f"- {p[1]} ({p[3]}) [{p[5]}]\n"
-            if standby:
-                txt += "\n*💤 สำรอง (Standby):*\n"
-                for p in standby: txt += f"- {p[1]} ({p[3]}) [{p[5]}]\n"
-            txt += "-------------------------\n"
-        txt += "```"
-        await interaction.response.send_message(txt, ephemeral=True)
+        wait = throttle_click("copy", interaction.user.id, interaction.message.id)
+        if wait:
+            cached = roster_copy_cache.get((self.event_id, "plain"))
+            if not cached: return await send_throttled(interaction, wait)
+            ext = ROSTER_COPY_FORMATS["plain"][1]
+            return await send_throttled(interaction, wait, "(ข้อมูลล่าสุดที่ cache ไว้)",
+                                        file=discord.File(io.BytesIO(cached[1]), filename=f"roster_event_{self.event_id}_plain.{ext}"))
+        content, files = roster_copy_message(self.event_id)
+        await interaction.response.send_message(content, files=files, view=RosterCopyFormatView(self.event_id), ephemeral=True)
+
+class RosterCopyFormatView(View):
+    # เลือกรูปแบบ Copy ใหม่ได้จากข้อความ ephemeral เดิม
+    def __init__(self, event_id, fmt="plain"):
+        super().__init__(timeout=300)
+        self.event_id = event_id
+        options = [discord.SelectOption(label=label, value=key, default=key == fmt) for key, (label, _) in ROSTER_COPY_FORMATS.items()]
+        self.select = Select(placeholder="เลือกรูปแบบ...", options=options)
+        self.select.callback = self.choose
+        self.add_item(self.select)
+
+    @instrumented("RosterCopyFormatView.choose")
+    async def choose(self, interaction: discord.Interaction):
+        fmt = self.select.values[0]
+        content, files = roster_copy_message(self.event_id, fmt)
+        await interaction.response.edit_message(content=content, attachments=files, view=RosterCopyFormatView(self.event_id, fmt))
 
 class AbsenceModal(Modal, title='แบบฟอร์มแจ้งลา (เฉพาะวอรอบนี้)'):
     def __init__(self, event_id, dashboard_msg):
@@ -853,10 +3461,11 @@ class AbsenceModal(Modal, title='แบบฟอร์มแจ้งลา (เ
         self.event_id = event_id
         self.dashboard_msg = dashboard_msg
     reason = TextInput(label='เหตุผล', required=True)
+    @instrumented("AbsenceModal.on_submit")
     async def on_submit(self, interaction: discord.Interaction):
-        reg_upsert(self.event_id, interaction.user.id, interaction.user.display_name, "Absence", "-", self.reason.value, "-")
-        try: await self.dashboard_msg.edit(embed=create_dashboard_embed(self.event_id))
-        except: pass
+        await reg_upsert_async(self.event_id, interaction.user.id, interaction.user.display_name, "Absence", "-", self.reason.value, "-")
+        try: await edit_tracked(self.dashboard_msg, f"war:{self.event_id}", create_dashboard_embed(self.event_id))
+        except Exception as e: trace_swallowed("AbsenceModal.on_submit.dashboard_edit", e)
         await send_log(interaction.client, "Absence", f"แจ้งลา Event #{self.event_id}\nเหตุผล: {self.reason.value}", interaction.user)
         await interaction.response.send_message("🏳️ บันทึกใบลาสำหรับวอรอบนี้เรียบร้อย", ephemeral=True)
 
@@ -879,6 +3488,7 @@ class LeaveReasonModal(Modal, title='แบบฟอร์มแจ้งลา
                 self.date_input = TextInput(label='วันที่สิ้นสุดการลา (DD/MM)', placeholder='เช่น 15/04 (ถ้าไม่ระบุจะถือว่าพักยาว)', required=False)
                 self.add_item(self.date_input)
 
+    @instrumented("LeaveReasonModal.on_submit")
     async def on_submit(self, interaction: discord.Interaction):
         now = bangkok_now()
         expiry_str = None
@@ -920,9 +3530,9 @@ class LeaveReasonModal(Modal, title='แบบฟอร์มแจ้งลา
         elif self.leave_type == 'hiatus':
             date_text = "พักยาวไม่มีกำหนด"
 
-        leave_upsert(interaction.user.id, interaction.user.display_name, self.leave_type, date_text, expiry_str, self.reason.value)
+        await leave_upsert_async(interaction.user.id, interaction.user.display_name, self.leave_type, date_text, expiry_str, self.reason.value)
         await refresh_leave_board(interaction.client)
-        await refresh_all_active_wars(interaction.client) 
+        await refresh_leave_dependents(interaction.client)
         await interaction.response.send_message(f"✅ **บันทึกข้อมูลลงบอร์ดถาวรสำเร็จ!** (สถานะ: {date_text})\n*(ระบบจะเชื่อมโยงชื่อไปยังตารางวอให้อัตโนมัติ)*", ephemeral=True)
 
 class LeaveTypeSelect(Select):
@@ -940,21 +3550,44 @@ class LeaveTypeSelect(Select):
     async def callback(self, interaction: discord.Interaction):
         await interaction.response.send_modal(LeaveReasonModal(self.values[0]))
 
+async def flip_board_page(interaction, board, step, tracked_key=None):
+    # บอร์ดเป็นข้อความสาธารณะข้อความเดียว: เลื่อนหน้าแล้วทุกคนเห็นหน้าเดียวกัน
+    wait = throttle_click("page", interaction.user.id, interaction.message.id)
+    if wait: return await send_throttled(interaction, wait)
+    embed = board.page_embed(board.current + step)
+    await interaction.response.edit_message(embed=embed)
+    if tracked_key: mark_rendered(tracked_key, interaction.message, embed)
+
 class LeaveBoardView(View):
     def __init__(self): super().__init__(timeout=None)
     @discord.ui.button(label="📝 เขียนใบลา / แจ้งสาย", style=discord.ButtonStyle.primary, row=1, custom_id="lv_add")
+    @instrumented("LeaveBoardView.add_leave")
     async def add_leave(self, interaction: discord.Interaction, button: Button):
         view = View(timeout=60).add_item(LeaveTypeSelect())
         await interaction.response.send_message("👇 **กรุณาเลือกประเภทการลา หรือแจ้งมาสาย:**", view=view, ephemeral=True)
     @discord.ui.button(label="❌ กลับมาแล้ว (ยกเลิกสถานะ)", style=discord.ButtonStyle.danger, row=1, custom_id="lv_rem")
+    @instrumented("LeaveBoardView.rem_leave")
     async def rem_leave(self, interaction: discord.Interaction, button: Button):
-        leave_remove(interaction.user.id)
+        await leave_remove_async(interaction.user.id)
         await refresh_leave_board(interaction.client)
-        await refresh_all_active_wars(interaction.client) 
+        await refresh_leave_dependents(interaction.client)
         await interaction.response.send_message("🎉 **ยินดีต้อนรับกลับมา!** ลบชื่อออกจากบอร์ดแจ้งลาแล้ว", ephemeral=True)
     @discord.ui.button(label="🔄 รีเฟรชบอร์ด", style=discord.ButtonStyle.secondary, row=1, custom_id="lv_ref")
+    @instrumented("LeaveBoardView.ref_leave")
     async def ref_leave(self, interaction: discord.Interaction, button: Button):
-        await interaction.response.edit_message(embed=create_leave_board_embed())
+        wait = throttle_click("refresh", interaction.user.id, interaction.message.id)
+        if wait: return await send_throttled(interaction, wait)
+        embed = create_leave_board_embed()
+        await interaction.response.edit_message(embed=embed)
+        mark_rendered("leave_board", interaction.message, embed)
+    @discord.ui.button(label="◀️", style=discord.ButtonStyle.secondary, row=2, custom_id="lv_prev")
+    @instrumented("LeaveBoardView.prev_page")
+    async def prev_page(self, interaction: discord.Interaction, button: Button):
+        await flip_board_page(interaction, leave_board, -1, "leave_board")
+    @discord.ui.button(label="▶️", style=discord.ButtonStyle.secondary, row=2, custom_id="lv_next")
+    @instrumented("LeaveBoardView.next_page")
+    async def next_page(self, interaction: discord.Interaction, button: Button):
+        await flip_board_page(interaction, leave_board, 1, "leave_board")
 
 # ==========================================
 # 🤖 BOT COMMANDS / MEMBER BOARD
@@ -962,32 +3595,62 @@ class LeaveBoardView(View):
 class MemberBoardView(View):
     def __init__(self): super().__init__(timeout=None)
     @discord.ui.button(label="📝 ลงทะเบียน / แก้ไขตำแหน่ง", style=discord.ButtonStyle.success, row=1, custom_id="member_reg")
+    @instrumented("MemberBoardView.register")
     async def register(self, interaction: discord.Interaction, button: Button):
         view = View(timeout=60).add_item(MemberRoleSelect(interaction.message))
         await interaction.response.send_message("👉 **กรุณาเลือกสายตำแหน่งหลักของคุณ:**", view=view, ephemeral=True)
     @discord.ui.button(label="🔄 รีเฟรช", style=discord.ButtonStyle.secondary, row=1, custom_id="member_ref")
+    @instrumented("MemberBoardView.refresh")
     async def refresh(self, interaction: discord.Interaction, button: Button):
+        wait = throttle_click("refresh", interaction.user.id, interaction.message.id)
+        if wait: return await send_throttled(interaction, wait)
         await interaction.response.edit_message(embed=create_member_board_embed())
     @discord.ui.button(label="❌ ลบชื่อออก", style=discord.ButtonStyle.danger, row=1, custom_id="member_leave")
+    @instrumented("MemberBoardView.leave")
     async def leave(self, interaction: discord.Interaction, button: Button):
-        member_remove(interaction.user.id)
+        await member_remove_async(interaction.user.id)
         await interaction.response.edit_message(embed=create_member_board_embed())
         await interaction.followup.send("🗑️ ลบชื่อของคุณออกจากทำเนียบแล้ว", ephemeral=True)
+    @discord.ui.button(label="◀️", style=discord.ButtonStyle.secondary, row=2, custom_id="member_prev")
+    @instrumented("MemberBoardView.prev_page")
+    async def prev_page(self, interaction: discord.Interaction, button: Button):
+        await flip_board_page(interaction, member_board, -1)
+    @discord.ui.button(label="▶️", style=discord.ButtonStyle.secondary, row=2, custom_id="member_next")
+    @instrumented("MemberBoardView.next_page")
+    async def next_page(self, interaction: discord.Interaction, button: Button):
+        await flip_board_page(interaction, member_board, 1)
 
 # ==========================================
 # 💻 BOT COMMANDS & EVENTS
 # ==========================================
 
-intents = discord.Intents.default()
-intents.message_content = True
-intents.members = True
-bot = commands.Bot(command_prefix="!", intents=intents)
+def gateway_options(mode=MEMBER_CACHE_MODE):
+    # intent / cache ของ gateway ตาม MEMBER_CACHE_MODE (bench.py member_cache ใช้ตัวเดียวกันสร้างบอทจำลองของแต่ละโหมด)
+    # members intent ต้องเปิดทั้งสองโหมด: โหมด lazy ยังขอรายชื่อทั้งกิลด์ตอนใช้ (guild.chunk) ซึ่ง Discord อนุญาตเฉพาะบอทที่มี intent นี้
+    # ที่ต่างกันคือ chunk ตอน login หรือไม่ และเก็บ Member ไว้ใน cache หรือไม่
+    intents = discord.Intents.default()
+    intents.message_content = not SLASH_ONLY
+    intents.members = True
+    flags = discord.MemberCacheFlags.from_intents(intents) if mode == "full" else discord.MemberCacheFlags.none()
+    return {"intents": intents, "member_cache_flags": flags, "chunk_guilds_at_startup": mode == "full", "max_messages": MESSAGE_CACHE_SIZE}
+
+bot = commands.Bot(command_prefix="!", **gateway_options())
+
+async def setup_hook():
+    if TRACE_ENABLED: install_rest_tracing(bot)
+bot.setup_hook = setup_hook
 
 @bot.event
 async def on_ready():
     init_db()
-    await bot.tree.sync()
+    if not warm_stats["loaded"]:
+        kept, dropped = load_warm_state()
+        print(f"🔥 Warm state: ใช้ได้ {kept} รายการ, ทิ้ง {dropped} รายการที่ไม่ตรงกับ DB")
+    await sync_commands_if_changed(bot.tree)
     if not auto_reminder.is_running(): auto_reminder.start()
+    if not archive_job.is_running(): archive_job.start()
+    if not backup_job.is_running(): backup_job.start()
+    if not warm_state_job.is_running(): warm_state_job.start()
     bot.add_view(MemberBoardView())
     bot.add_view(LeaveBoardView())
     conn = sqlite3.connect(DB_NAME)
@@ -997,47 +3660,65 @@ async def on_ready():
         bot.add_view(PersistentWarView(ev_id))
     print(f'✅ Bot Online: {bot.user}')
 
-@bot.command()
+@commands.command()
 async def sync(ctx):
     if ctx.author.guild_permissions.administrator:
         synced = await bot.tree.sync()
+        warm_state["command_hash"] = command_tree_hash(bot.tree)
         await ctx.send(f"✅ Synced {len(synced)} commands เรียบร้อย!")
 
+if not SLASH_ONLY: bot.add_command(sync)
+
+async def get_guild_members(guild, role=None):
+    # โหมด lazy: ขอรายชื่อจาก gateway ตอนใช้ (cache=False -> ไม่ค้างในหน่วยความจำหลังคำสั่งจบ)
+    if guild.chunked: members = guild.members
+    else:
+        with span("gateway.chunk", guild=guild.id):
+            members = await guild.chunk(cache=MEMBER_CACHE_MODE == "full")
+    if role is not None: members = [m for m in members if m.get_role(role.id)]
+    return members
+
 @bot.tree.command(name="setup_war", description="ตั้งค่าตารางวอ (แบบปุ่มกด)")
+@instrumented("setup_war")
 async def setup_war(interaction: discord.Interaction):
     if not interaction.user.guild_permissions.administrator: return
     get_session(interaction.user.id)
     await interaction.response.send_message(embed=create_setup_embed(interaction.user.id), view=SetupView(), ephemeral=True)
 
 @bot.tree.command(name="setup_leave_board", description="สร้างบอร์ดแจ้งลาถาวร (Leave Board)")
+@instrumented("setup_leave_board")
 async def setup_leave_board(interaction: discord.Interaction):
     if not interaction.user.guild_permissions.administrator: return
-    embed = create_leave_board_embed()
+    embed = create_leave_board_embed(0)
     view = LeaveBoardView()
     await interaction.response.send_message("กำลังสร้างบอร์ดแจ้งลา...", ephemeral=True)
     msg = await interaction.channel.send(embed=embed, view=view)
     set_bot_config('leave_board', interaction.guild.id, msg.channel.id, msg.id)
+    mark_rendered("leave_board", msg, embed)
 
 @bot.tree.command(name="setup_member_board", description="สร้างตารางบอร์ดทำเนียบสมาชิกกิลด์")
+@instrumented("setup_member_board")
 async def setup_member_board(interaction: discord.Interaction):
     if not interaction.user.guild_permissions.administrator: return
-    msg = await interaction.channel.send(embed=create_member_board_embed(), view=MemberBoardView())
+    msg = await interaction.channel.send(embed=create_member_board_embed(0), view=MemberBoardView())
     set_bot_config('member_board', interaction.guild.id, msg.channel.id, msg.id)
     await interaction.response.send_message("✅ สร้างตารางสำเร็จ", ephemeral=True)
 
 @bot.tree.command(name="call_unregistered", description="ตามสมาชิกที่ยังไม่ได้ลงทะเบียนเข้าทำเนียบกิลด์")
+@instrumented("call_unregistered")
 async def call_unregistered(interaction: discord.Interaction, target_role: discord.Role = None):
     if not interaction.user.guild_permissions.administrator: return
+    await interaction.response.defer(ephemeral=True)
     conn = sqlite3.connect(DB_NAME)
     reg_ids = {row[0] for row in conn.execute("SELECT user_id FROM guild_members")}
     conn.close()
     missing = []
-    targets = target_role.members if target_role else interaction.guild.members
+    targets = await get_guild_members(interaction.guild, target_role)
     for m in targets:
         if not m.bot and m.id not in reg_ids:
             missing.append(m.mention)
     if not missing:
-        return await interaction.response.send_message("✅ ยอดเยี่ยม! สมาชิกทุกคนลงทะเบียนในทำเนียบครบแล้ว", ephemeral=True)
+        return await interaction.followup.send("✅ ยอดเยี่ยม! สมาชิกทุกคนลงทะเบียนในทำเนียบครบแล้ว", ephemeral=True)
     header = f"📢 **กิล天狗 เปิดรับสมัคร จอมยุทธทั้งหลาย** 👺\n⚠️ พบสมาชิกที่ยังไม่ได้ลงทะเบียนเข้าทำเนียบกิลด์ **({len(missing)} คน)**:\n╼╼╼╼╼╼╼╼╼╼╼╼╼╼╼╼╼╼╼╼╼╼╼╼\n"
     content = " ".join(missing)
     footer = f"\n╼╼╼╼╼╼╼╼╼╼╼╼╼╼╼╼╼╼╼╼╼╼╼╼\n👇 **คลิกปุ่มด้านล่างเพื่อวาร์ปไปที่ตารางลงทะเบียนได้เลยครับ**"
@@ -1054,10 +3735,11 @@ async def call_unregistered(interaction: discord.Interaction, target_role: disco
             await target_ch.send(footer, view=view, allowed_mentions=discord.AllowedMentions.none())
         else:
             await target_ch.send(header + content + footer, view=view)
-        await interaction.response.send_message("✅ ส่งประกาศตามคนลงทะเบียนทำเนียบกิลด์แล้ว", ephemeral=True)
-    except Exception as e: pass
+        await interaction.followup.send("✅ ส่งประกาศตามคนลงทะเบียนทำเนียบกิลด์แล้ว", ephemeral=True)
+    except Exception as e: trace_swallowed("call_unregistered", e)
 
 @bot.tree.command(name="reset_member_board", description="ล้างข้อมูลทำเนียบกิลด์ทั้งหมด (รีเซ็ตรายชื่อใหม่)")
+@instrumented("reset_member_board")
 async def reset_member_board(interaction: discord.Interaction):
     if not interaction.user.guild_permissions.administrator: return
     clear_all_members()
@@ -1066,24 +3748,26 @@ async def reset_member_board(interaction: discord.Interaction):
 
 @bot.tree.command(name="check_missing", description="ตามคนขาด (ระบุ Event สำหรับตารางวอ)")
 @app_commands.autocomplete(event_id=event_autocomplete)
+@instrumented("check_missing")
 async def check_missing(interaction: discord.Interaction, event_id: int, target_role: discord.Role = None):
     ev = get_event(event_id)
     if not ev: return await interaction.response.send_message("❌ ไม่พบ Event ID นี้", ephemeral=True)
     _, title, date_str, time_str, _, _, ch_id, msg_id, active = ev[:9]
+    await interaction.response.defer(ephemeral=True)
 
     conn = sqlite3.connect(DB_NAME)
     reg_ids = {row[0] for row in conn.execute("SELECT user_id FROM registrations WHERE event_id=?", (event_id,))}
     conn.close()
 
     missing = []
-    targets = target_role.members if target_role else interaction.guild.members
+    targets = await get_guild_members(interaction.guild, target_role)
     for m in targets:
         if not m.bot and m.id not in reg_ids: missing.append(m.mention)
 
     target_ch = bot.get_channel(ALERT_CHANNEL_ID_FIXED) or interaction.channel
     
     if not missing:
-        await interaction.response.send_message("✅ ครบแล้ว!", ephemeral=True)
+        await interaction.followup.send("✅ ครบแล้ว!", ephemeral=True)
     else:
         view = DashboardLinkView(interaction.guild.id, ch_id, msg_id)
         full_date_text = format_full_date(date_str)
@@ -1102,11 +3786,12 @@ async def check_missing(interaction: discord.Interaction, event_id: int, target_
                 await target_ch.send(footer, view=view, allowed_mentions=discord.AllowedMentions.none())
             else:
                 await target_ch.send(header+content+footer, view=view, allowed_mentions=discord.AllowedMentions.none())
-            await interaction.response.send_message(f"✅ ส่งประกาศตามคนขาด Event #{event_id} แล้ว", ephemeral=True)
-        except Exception as e: pass
+            await interaction.followup.send(f"✅ ส่งประกาศตามคนขาด Event #{event_id} แล้ว", ephemeral=True)
+        except Exception as e: trace_swallowed("check_missing", e)
 
 @bot.tree.command(name="close_war", description="จบงานและปิดตาราง (ระบุ Event)")
 @app_commands.autocomplete(event_id=event_autocomplete)
+@instrumented("close_war")
 async def close_war(interaction: discord.Interaction, event_id: int):
     if not interaction.user.guild_permissions.administrator: return
     ev = get_event(event_id)
@@ -1114,42 +3799,27 @@ async def close_war(interaction: discord.Interaction, event_id: int):
 
     close_event_db(event_id)
     
-    detailed_history_embed = create_dashboard_embed(event_id)
-    detailed_history_embed.title = f"📜 สรุปยอดวอ (Event #{event_id}) - จบงาน"
-    detailed_history_embed.color = 0x2b2d31
-
-    data = get_roster(event_id)
-    total_players = len([p for p in data if p[2] != "Absence"])
-    date_obj = parse_event_datetime(ev[2], ev[3])
-    date_display = date_obj.strftime("%Y-%m-%d") if date_obj else ev[2]
-    
-    minimal_closed_embed = discord.Embed(color=0x2b2d31)
-    minimal_closed_embed.description = (
-        f"## 🔴 จบวอแล้ว: {ev[1]}\n\n"
-        f"✅ **บันทึกข้อมูลเรียบร้อย**\n"
-        f"📅 **วันที่:** {date_display}\n"
-        f"👤 **จำนวนคน:** {total_players} คน\n\n"
-        f"**System Closed.**"
-    )
+    detailed_history_embed = history_summary_embed(create_dashboard_embed(event_id), event_id)
+    minimal_closed_embed = closed_dashboard_embed(ev, get_roster(event_id))
 
     try:
         ch = bot.get_channel(ev[6])
-        if ch:
-            msg = await ch.fetch_message(ev[7])
-            await msg.edit(embed=minimal_closed_embed, view=None)
-    except: pass
+        if ch: await ch.get_partial_message(ev[7]).edit(embed=minimal_closed_embed, view=None)
+    except Exception as e: trace_swallowed("close_war.dashboard_edit", e)
+    forget_rendered(f"war:{event_id}")
     
     if HISTORY_CHANNEL_ID:
         try:
             hist_ch = bot.get_channel(HISTORY_CHANNEL_ID)
             if hist_ch: await hist_ch.send(embed=detailed_history_embed)
-        except: pass
+        except Exception as e: trace_swallowed("close_war.history_post", e)
 
     await send_log(interaction.client, "Close", f"ปิดงาน Event #{event_id} และส่งประวัติแล้ว", interaction.user)
     await interaction.response.send_message(f"🔴 ปิดงาน Event #{event_id} เรียบร้อย!", ephemeral=True)
 
 @bot.tree.command(name="delete_event", description="ลบตารางและข้อมูลทั้งหมด (ระบุ Event)")
 @app_commands.autocomplete(event_id=event_autocomplete)
+@instrumented("delete_event")
 async def delete_event(interaction: discord.Interaction, event_id: int):
     if not interaction.user.guild_permissions.administrator: return
     ev = get_event(event_id)
@@ -1157,14 +3827,43 @@ async def delete_event(interaction: discord.Interaction, event_id: int):
     delete_event_db(event_id)
     try:
         ch = bot.get_channel(ev[6])
-        if ch:
-            msg = await ch.fetch_message(ev[7])
-            await msg.delete()
-    except: pass
+        if ch: await ch.get_partial_message(ev[7]).delete()
+    except Exception as e: trace_swallowed("delete_event.message_delete", e)
+    forget_rendered(f"war:{event_id}")
     await send_log(interaction.client, "Delete", f"ลบ Event #{event_id} ถาวร", interaction.user)
     await interaction.response.send_message(f"🗑️ **ลบข้อมูล Event #{event_id} เรียบร้อยแล้ว!**", ephemeral=True)
 
+@bot.tree.command(name="close_wars", description="ปิดหลายงานพร้อมกัน (ระบุช่วง ID / ชื่อ / วันที่วอ)")
+@app_commands.describe(events="ช่วง Event ID เช่น 1-20,25", title="ชื่องาน (ใช้ * แทนอะไรก็ได้ เช่น Guild War*)", held_before="เฉพาะวอที่จัดก่อนวันที่ (YYYY-MM-DD)")
+@instrumented("close_wars")
+async def close_wars(interaction: discord.Interaction, events: str = None, title: str = None, held_before: str = None):
+    if not interaction.user.guild_permissions.administrator: return
+    if not (events or title or held_before): return await interaction.response.send_message("❌ กรุณาระบุอย่างน้อยหนึ่งเงื่อนไข (events / title / held_before)", ephemeral=True)
+    try:
+        id_ranges = parse_id_ranges(events)
+        before = parse_bangkok_date(held_before) if held_before else None
+    except ValueError: return await interaction.response.send_message("❌ รูปแบบไม่ถูกต้อง (ตัวอย่าง: events 1-20,25 / held_before 2025-03-01)", ephemeral=True)
+    rows = find_events(id_ranges, title, active=True)
+    if before: rows = [ev for ev in rows if (dt := parse_event_datetime(ev[2], ev[3])) and dt.date() < before]
+    if not rows: return await interaction.response.send_message("📭 ไม่พบงานที่เปิดอยู่ตามเงื่อนไข", ephemeral=True)
+    await interaction.response.send_message(embed=bulk_preview_embed("close", rows), view=BulkActionView("close", [ev[0] for ev in rows], interaction.user.id), ephemeral=True)
+
+@bot.tree.command(name="delete_events", description="ลบหลายงานพร้อมกัน (ระบุช่วง ID / ชื่อ / ปิดก่อนวันที่)")
+@app_commands.describe(events="ช่วง Event ID เช่น 1-20,25", title="ชื่องาน (ใช้ * แทนอะไรก็ได้ เช่น Guild War*)", closed_before="เฉพาะงานที่ปิดก่อนวันที่ (YYYY-MM-DD)", include_active="รวมงานที่ยังเปิดอยู่ด้วย")
+@instrumented("delete_events")
+async def delete_events(interaction: discord.Interaction, events: str = None, title: str = None, closed_before: str = None, include_active: bool = False):
+    if not interaction.user.guild_permissions.administrator: return
+    if not (events or title or closed_before): return await interaction.response.send_message("❌ กรุณาระบุอย่างน้อยหนึ่งเงื่อนไข (events / title / closed_before)", ephemeral=True)
+    try:
+        id_ranges = parse_id_ranges(events)
+        before = bangkok_date_to_utc(parse_bangkok_date(closed_before)) if closed_before else None
+    except ValueError: return await interaction.response.send_message("❌ รูปแบบไม่ถูกต้อง (ตัวอย่าง: events 1-20,25 / closed_before 2025-03-01)", ephemeral=True)
+    rows = find_events(id_ranges, title, active=None if include_active and not before else False, closed_before=before)
+    if not rows: return await interaction.response.send_message("📭 ไม่พบงานตามเงื่อนไข", ephemeral=True)
+    await interaction.response.send_message(embed=bulk_preview_embed("delete", rows), view=BulkActionView("delete", [ev[0] for ev in rows], interaction.user.id), ephemeral=True)
+
 @bot.tree.command(name="leaderboard", description="ดูอันดับการเข้าวอ")
+@instrumented("leaderboard")
 async def leaderboard(interaction: discord.Interaction):
     data = db_get_leaderboard()
     if not data: return await interaction.response.send_message("❌ ยังไม่มีข้อมูล", ephemeral=True)
@@ -1176,14 +3875,285 @@ async def leaderboard(interaction: discord.Interaction):
     embed.description = desc
     await interaction.response.send_message(embed=embed)
 
+@bot.tree.command(name="season_report", description="รายงานสถิติทั้งซีซั่น (อัตราเข้าวอ, Main/Late/Standby, ขาดติดกัน, ตำแหน่งต่อวอ, การลา)")
+@app_commands.describe(days="ความยาวซีซั่น (วันย้อนหลัง)")
+@instrumented("season_report")
+async def season_report(interaction: discord.Interaction, days: app_commands.Range[int, 7, 730] = 90):
+    if not interaction.user.guild_permissions.administrator: return
+    await interaction.response.defer(ephemeral=True)
+    since = int(time.time()) - days * 86400
+    try:
+        with span("season.compute", days=days):
+            report, _ = await asyncio.get_running_loop().run_in_executor(get_chart_pool(), season_job, DB_NAME, ARCHIVE_DB_NAME, since)
+    except Exception as e:
+        trace_swallowed("season_report", e)
+        return await interaction.followup.send(f"❌ สร้างรายงานไม่สำเร็จ: {e}", ephemeral=True)
+    if not len(report["events"]["event_id"]): return await interaction.followup.send(f"📭 ไม่มีวอที่ปิดแล้วใน {days} วันที่ผ่านมา", ephemeral=True)
+    pages = season_report_embeds(report, days)
+    file = discord.File(io.BytesIO(write_season_csv(report)), filename=f"season_report_{bangkok_now().strftime('%Y%m%d')}.csv")
+    await interaction.followup.send(embed=pages[0], view=PaginatorView(pages, interaction.user.id), file=file, ephemeral=True)
+
+@bot.tree.command(name="export_history", description="ส่งออกประวัติวอเป็นไฟล์ CSV/JSONL (บีบอัด .gz)")
+@app_commands.describe(fmt="รูปแบบไฟล์", events="ช่วง Event ID เช่น 1-20,25 (เว้นว่าง = ทั้งหมด + ใบลาปัจจุบันของทั้งกิลด์)", include_active="รวมงานที่ยังเปิดอยู่ด้วย")
+@instrumented("export_history")
+async def export_history(interaction: discord.Interaction, fmt: Literal["csv", "jsonl"] = "csv", events: str = None, include_active: bool = False):
+    if not interaction.user.guild_permissions.administrator: return
+    try: id_ranges = parse_id_ranges(events)
+    except ValueError: return await interaction.response.send_message("❌ รูปแบบช่วง Event ID ไม่ถูกต้อง (ตัวอย่าง: 1-20,25)", ephemeral=True)
+    await interaction.response.defer(ephemeral=True)
+    tmp = tempfile.TemporaryFile()
+    try:
+        # ใบลาเป็นของทั้งกิลด์ ไม่ผูกกับ Event จึงใส่เฉพาะตอนส่งออกทั้งหมด (ไม่ได้ระบุช่วง)
+        count = await asyncio.to_thread(write_history_export, tmp, fmt, id_ranges, include_active, not id_ranges)
+        size = tmp.tell()
+        limit = interaction.guild.filesize_limit if interaction.guild else 10 * 1024 * 1024
+        if size > limit:
+            return await interaction.followup.send(f"❌ ไฟล์ใหญ่เกินกว่าที่ Discord รับได้ ({size // 1024} KB) กรุณาระบุช่วง Event ให้แคบลง", ephemeral=True)
+        tmp.seek(0)
+        filename = f"war_history_{bangkok_now().strftime('%Y%m%d_%H%M')}.{fmt}.gz"
+        note = "\n-# ระบุช่วง Event แล้ว จึงไม่รวมใบลา (ใบลาเป็นของทั้งกิลด์)" if id_ranges else ""
+        await interaction.followup.send(f"📦 ส่งออกประวัติ {count} แถว ({size // 1024} KB){note}", file=discord.File(tmp, filename=filename), ephemeral=True)
+    finally:
+        tmp.close()
+
+@bot.tree.command(name="attendance_chart", description="กราฟการเข้าวอย้อนหลัง (รายสัปดาห์ / สัดส่วนตำแหน่งต่อวอ)")
+@app_commands.describe(kind="weekly = อัตราการเข้าวอรายสัปดาห์, roles = สัดส่วน DPS/Tank/Heal ต่อวอ", weeks="ย้อนหลังกี่สัปดาห์", member="ดูเฉพาะสมาชิกคนนี้ (เฉพาะ weekly)")
+@instrumented("attendance_chart")
+async def attendance_chart(interaction: discord.Interaction, kind: Literal["weekly", "roles"] = "weekly", weeks: app_commands.Range[int, 1, 52] = 12, member: discord.Member = None):
+    if not interaction.user.guild_permissions.administrator: return
+    await interaction.response.defer(ephemeral=True)
+    try: png = await get_attendance_chart(kind, weeks, member.id if member and kind == "weekly" else None)
+    except Exception as e:
+        trace_swallowed("attendance_chart", e)
+        return await interaction.followup.send(f"❌ สร้างกราฟไม่สำเร็จ: {e}", ephemeral=True)
+    if png is None: return await interaction.followup.send(f"📭 ไม่มีวอที่ปิดแล้วในช่วง {weeks} สัปดาห์ที่ผ่านมา", ephemeral=True)
+    filename = f"attendance_{kind}.png"
+    embed = discord.Embed(title=f"📈 Attendance ({kind}, {weeks} สัปดาห์)", color=0x2ecc71)
+    embed.set_image(url=f"attachment://{filename}")
+    await interaction.followup.send(embed=embed, file=discord.File(io.BytesIO(png), filename=filename), ephemeral=True)
+
+@bot.tree.command(name="backup_now", description="สำรองฐานข้อมูลทันที (ไม่ต้องหยุดบอท)")
+@instrumented("backup_now")
+async def backup_now(interaction: discord.Interaction):
+    if not interaction.user.guild_permissions.administrator: return
+    await interaction.response.defer(ephemeral=True)
+    try:
+        async with backup_lock: paths = await asyncio.to_thread(run_backups)
+    except Exception as e:
+        return await interaction.followup.send(f"❌ สำรองข้อมูลไม่สำเร็จ: {e}", ephemeral=True)
+    lines = "\n".join(f"`{os.path.basename(p)}` ({os.path.getsize(p) // 1024} KB)" for p in paths)
+    await interaction.followup.send(f"💾 **สำรองข้อมูลเรียบร้อย!**\n{lines}", ephemeral=True)
+
+@bot.tree.command(name="profile", description="เปิด/ปิด/บันทึกผลการวัดประสิทธิภาพของแต่ละคำสั่งและปุ่ม")
+async def profile(interaction: discord.Interaction, action: Literal["start", "stop", "dump"], top_n: int = PROFILE_TOP_N):
+    if not interaction.user.guild_permissions.administrator: return
+    if action == "start":
+        start_profiling()
+        return await interaction.response.send_message("🔬 เริ่มเก็บข้อมูล profiling แล้ว (ใช้ `/profile dump` เพื่อบันทึกผล)", ephemeral=True)
+    if action == "stop":
+        stop_profiling()
+        return await interaction.response.send_message(f"⏹️ หยุด profiling แล้ว ({sum(_profile_calls.values())} calls ที่เก็บไว้)", ephemeral=True)
+    if not _profiles: return await interaction.response.send_message("❌ ยังไม่มีข้อมูล profiling", ephemeral=True)
+    await interaction.response.defer(ephemeral=True)
+    path = await asyncio.to_thread(dump_profiles, max(1, top_n))
+    summary = "\n".join(f"• `{name}` : {n} calls" for name, n in sorted(_profile_calls.items(), key=lambda kv: -kv[1])[:15])
+    await interaction.followup.send(f"📄 บันทึกผลที่ `{path}`\n{summary}", file=discord.File(path), ephemeral=True)
+
+@bot.tree.command(name="perf_stats", description="ดูสถิติประสิทธิภาพภายในของบอท")
+async def perf_stats(interaction: discord.Interaction):
+    if not interaction.user.guild_permissions.administrator: return
+    embed = discord.Embed(title="📈 Performance Stats", color=0x95a5a6)
+    w = write_queue.stats
+    per_commit = w["writes"] / w["commits"] if w["commits"] else 0
+    embed.add_field(name="✍️ Write queue (group commit)", value=f"writes: {w['writes']} | commits: {w['commits']} ({per_commit:.1f} writes/commit)\ncoalesced: {w['coalesced']} | failed: {w['failed']} | max batch: {w['max_batch']}", inline=False)
+    r = render_stats
+    embed.add_field(name="🖼️ Batch dashboard render", value=f"batches: {r['batches']} | dashboards: {r['dashboards']} | queries: {r['queries']}\nlast batch: {r['last_batch_dashboards']} dashboards in {r['last_batch_queries']} queries", inline=False)
+    c = roster_copy_stats
+    ws = warm_stats
+    embed.add_field(name="🔥 Warm state", value=f"restored: {ws['restored']} | dropped: {ws['dropped']} | tree sync skipped: {ws['sync_skipped']}\nedits skipped (unchanged embed): {ws['edits_skipped']} | saves: {ws['saves']}", inline=False)
+    t = "\n".join(f"{action}: allowed {v['allowed']} | throttled {v['throttled']}" for action, v in sorted(throttle_stats.items())) or "-"
+    embed.add_field(name="🚦 Button throttle", value=f"{t}\nactive buckets: {len(button_buckets)}", inline=False)
+    ch = chart_stats
+    avg = ch["render_ms"] / ch["renders"] if ch["renders"] else 0
+    embed.add_field(name="📈 Attendance charts", value=f"cache hits: {ch['hits']} | misses: {ch['misses']} | shared in-flight: {ch['shared']}\nrenders: {ch['renders']} (avg {avg:.0f} ms in worker) | cached: {len(chart_cache)}", inline=False)
+    wi = weapon_index.stats
+    embed.add_field(name="🗡️ Weapon index", value=f"events indexed: {len(weapon_index.events)} | loads: {wi['event_loads']} | log changes applied: {wi['changes_applied']}\nguild loads: {wi['member_loads']} | member refreshes: {wi['member_refreshes']} | queries: {wi['queries']}", inline=False)
+    mb, lb = member_board.stats, leave_board.stats
+    embed.add_field(name="📋 Boards", value=f"member: loads {mb['loads']} | row refreshes {mb['row_refreshes']} | page renders {mb['page_renders']} | page hits {mb['page_hits']}\nleave: loads {lb['loads']} | row refreshes {lb['row_refreshes']} | page renders {lb['page_renders']} | page hits {lb['page_hits']}", inline=False)
+    dd = dashboard_deps.stats
+    saved = dd["edits_saved"] / dd["leave_changes"] if dd["leave_changes"] else 0
+    embed.add_field(name="🎯 Leave -> dashboards", value=f"leave changes: {dd['leave_changes']} | refresh rounds: {dd['refreshes']}\ndashboards refreshed: {dd['dashboards_refreshed']} | edits saved: {dd['edits_saved']} ({saved:.1f} per leave change)", inline=False)
+    li = lineup_index.stats
+    embed.add_field(name="🧩 Round lineup", value=f"events indexed: {len(lineup_index.events)} | loads: {li['event_loads']} | log changes applied: {li['changes_applied']} | queries: {li['queries']}", inline=False)
+    embed.add_field(name="📋 Roster copy", value=f"cache hits: {c['hits']} | misses: {c['misses']} | cached: {len(roster_copy_cache)}\ninline: {c['inline']} | attachments: {c['attachments']}", inline=False)
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
+def _describe_change(ch):
+    state = ch["after"] or ch["before"] or {}
+    icon = {"join": "🟢", "update": "✏️", "remove": "🗑️", "undo": "↩️", "balance": "⚖️"}.get(ch["action"], "•")
+    detail = f"{state.get('team')} / {state.get('role')} / {state.get('time_text')}" if ch["after"] else "(ไม่อยู่ในตาราง)"
+    ref = f" (ย้อน #{ch['ref_seq']})" if ch["ref_seq"] else ""
+    return f"`#{ch['event_seq']:>3}` {icon} **{state.get('username', ch['user_id'])}** {ch['action']}{ref} → {detail}"
+
+@bot.tree.command(name="roster_changes", description="ดูประวัติการเปลี่ยนแปลงรายชื่อของ Event (ตั้งแต่ลำดับที่ระบุ)")
+@app_commands.autocomplete(event_id=event_autocomplete)
+@instrumented("roster_changes")
+async def roster_changes(interaction: discord.Interaction, event_id: int, since_seq: int = 0):
+    if not interaction.user.guild_permissions.administrator: return
+    changes = get_roster_changes(event_id, since_seq)
+    if not changes: return await interaction.response.send_message("📭 ไม่มีการเปลี่ยนแปลงหลังลำดับนี้", ephemeral=True)
+    lines, size = [], 0
+    for ch in reversed(changes):
+        line = _describe_change(ch)
+        if size + len(line) > 3800: break
+        lines.append(line)
+        size += len(line) + 1
+    embed = discord.Embed(title=f"📜 Roster changes Event #{event_id}", description="\n".join(reversed(lines)), color=0x3498db)
+    embed.set_footer(text=f"แสดง {len(lines)} จาก {len(changes)} รายการ | ลำดับล่าสุด #{changes[-1]['event_seq']}")
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
+@bot.tree.command(name="roster_undo", description="ย้อนการเปลี่ยนแปลงรายชื่อล่าสุดของ Event")
+@app_commands.autocomplete(event_id=event_autocomplete)
+@instrumented("roster_undo")
+async def roster_undo(interaction: discord.Interaction, event_id: int, count: app_commands.Range[int, 1, 50] = 1):
+    if not interaction.user.guild_permissions.administrator: return
+    undone = await asyncio.to_thread(undo_roster_changes, event_id, count, interaction.user.id)
+    if not undone: return await interaction.response.send_message("📭 ไม่มีรายการให้ย้อน", ephemeral=True)
+    await interaction.response.send_message("↩️ **ย้อนการเปลี่ยนแปลงแล้ว:**\n" + "\n".join(_describe_change(ch) for ch in undone)[:1900], ephemeral=True)
+    await refresh_war_dashboard(interaction.client, event_id)
+    await send_log(interaction.client, "Edit", f"ย้อนการเปลี่ยนแปลงรายชื่อ Event #{event_id} จำนวน {len(undone)} รายการ", interaction.user)
+
+@bot.tree.command(name="auto_balance", description="จัดทีมให้สมดุล (ขนาด/ตำแหน่ง/รอบ) แสดงตัวอย่างก่อนยืนยัน")
+@app_commands.autocomplete(event_id=event_autocomplete)
+@instrumented("auto_balance")
+async def auto_balance(interaction: discord.Interaction, event_id: int):
+    if not interaction.user.guild_permissions.administrator: return
+    ev = get_event(event_id)
+    if not ev: return await interaction.response.send_message("❌ ไม่พบ Event", ephemeral=True)
+    plan = await asyncio.to_thread(plan_auto_balance, event_id)
+    view = BalancePreviewView(plan, interaction.user.id) if plan["moves"] else None
+    await interaction.response.send_message(embed=auto_balance_embed(plan, ev[1]), view=view, ephemeral=True)
+
+async def weapon_autocomplete(interaction: discord.Interaction, current: str) -> list[app_commands.Choice[str]]:
+    if weapon_index.members is None: weapon_index.guild_view()
+    return [app_commands.Choice(name=name, value=name) for name in weapon_index.suggest(current)]
+
+@bot.tree.command(name="weapon_search", description="ค้นหาว่าใครในกิลด์ (หรือใน Event) ใช้อาวุธนี้")
+@app_commands.autocomplete(weapon=weapon_autocomplete, event_id=event_autocomplete)
+@instrumented("weapon_search")
+async def weapon_search(interaction: discord.Interaction, weapon: str, event_id: int = None):
+    if event_id is not None:
+        ev = get_event(event_id)
+        if not ev: return await interaction.response.send_message("❌ ไม่พบ Event", ephemeral=True)
+        index = weapon_index.event_view(event_id)
+        names = weapon_index.resolve(weapon)
+        embed = discord.Embed(title=f"🗡️ {weapon} ใน {ev[1]}", color=0x2ecc71)
+        by_team = {}
+        for name in names:
+            for uid in index["users"].get(name, ()):
+                username, team, role, _, _ = index["regs"][uid]
+                by_team.setdefault(team, {})[uid] = f"{role_emoji(role)} **{username}** `{name}`"
+        teams, _ = parse_teams(ev[4])
+        budget = 4500  # รวมทุก field ไม่ให้เกิน 6000 ตัวอักษรต่อ embed (เผื่อชื่อ field / title / footer)
+        for t in teams + sorted(set(by_team) - set(teams)):
+            if not by_team.get(t) or budget <= 0: continue
+            rows = list(by_team[t].values())
+            lines, size, cap = [], 0, min(1000, budget)
+            for line in rows:
+                if size + len(line) + 1 > cap - 30: break
+                lines.append(line)
+                size += len(line) + 1
+            if len(lines) < len(rows): lines.append(f"... และอีก {len(rows) - len(lines)} คน")
+            value = "\n".join(lines)
+            embed.add_field(name=f"{t} ({len(rows)})", value=value, inline=False)
+            budget -= len(value) + len(t) + 10
+        total = sum(len(v) for v in by_team.values())
+    else:
+        members = weapon_index.guild_view()
+        names = weapon_index.resolve(weapon)
+        embed = discord.Embed(title=f"🗡️ {weapon} ในกิลด์", color=0x2ecc71)
+        found = {}
+        for name in names:
+            for uid in weapon_index.guild.get(name, ()):
+                username, role, _ = members[uid]
+                found[uid] = f"{role_emoji(role)} **{username}** `{name}`"
+        total = len(found)
+        lines, size = [], 0
+        for line in found.values():
+            if size + len(line) > 3800: break
+            lines.append(line)
+            size += len(line) + 1
+        embed.description = "\n".join(lines)
+    if not total: embed.description = "📭 ไม่พบผู้เล่นที่ใช้อาวุธนี้"
+    embed.set_footer(text=(f"พบ {total} คน" + (f" | ตรงกับ: {', '.join(names)}" if names and names != [weapon] else ""))[:300])
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
+@bot.tree.command(name="search", description="ค้นหาชื่อ ทีม อาวุธ หรือเหตุผลการลา (ทำเนียบ / ตารางวอ / บอร์ดแจ้งลา)")
+@instrumented("search")
+async def search(interaction: discord.Interaction, query: str, scope: Literal["all", "members", "wars", "leaves"] = "all"):
+    if not interaction.user.guild_permissions.administrator: return
+    t0 = time.perf_counter()
+    results = search_all(query, scope)
+    elapsed_ms = (time.perf_counter() - t0) * 1000
+    if results is None: return await interaction.response.send_message("⚠️ คำค้นต้องยาวอย่างน้อย 3 ตัวอักษร", ephemeral=True)
+    ignored = fts_ignored_terms(query)
+    note = f"ℹ️ ข้ามคำที่สั้นกว่า 3 ตัวอักษร (ไม่ได้ใช้กรอง): {', '.join(f'`{t}`' for t in ignored)[:300]}" if ignored else None
+    if not results: return await interaction.response.send_message("\n".join(filter(None, [f"📭 ไม่พบผลลัพธ์สำหรับ **{query[:100]}**", note])), ephemeral=True)
+    pages = search_embeds(query, results, elapsed_ms)
+    view = PaginatorView(pages, interaction.user.id) if len(pages) > 1 else None
+    await interaction.response.send_message(content=note, embed=pages[0], ephemeral=True, **({"view": view} if view else {}))
+
+async def lineup_team_autocomplete(interaction: discord.Interaction, current: str) -> list[app_commands.Choice[str]]:
+    ev = get_event(getattr(interaction.namespace, "event_id", None) or 0)
+    if not ev: return []
+    teams, _ = parse_teams(ev[4])
+    return [app_commands.Choice(name=t, value=t) for t in teams if current.lower() in t.lower()][:25]
+
+@bot.tree.command(name="round_lineup", description="ดูรายชื่อตัวจริงแต่ละรอบ แยกทีม/ตำแหน่ง พร้อมเตือนตำแหน่งที่ขาด")
+@app_commands.autocomplete(event_id=event_autocomplete, team=lineup_team_autocomplete)
+@instrumented("round_lineup")
+async def round_lineup(interaction: discord.Interaction, event_id: int, round_no: app_commands.Range[int, 1, 8] = None, team: str = None):
+    ev = get_event(event_id)
+    if not ev: return await interaction.response.send_message("❌ ไม่พบ Event", ephemeral=True)
+    embed = round_lineup_embed(ev, lineup_index.event_view(event_id), round_no, team)
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
 @bot.tree.command(name="shutdown", description="ปิดบอท")
 async def shutdown(interaction: discord.Interaction):
     if not interaction.user.guild_permissions.administrator: return
     await interaction.response.send_message("👋 Bye", ephemeral=True)
+    await asyncio.to_thread(write_queue.close)
+    close_chart_pool()
+    try: save_warm_state()
+    except Exception as e: trace_swallowed("shutdown.save_warm_state", e)
     await bot.close()
 
 # --- TASKS ---
+backup_lock = asyncio.Lock()
+
+@tasks.loop(hours=BACKUP_INTERVAL_HOURS)
+async def backup_job():
+    try:
+        async with backup_lock: await asyncio.to_thread(run_backups)
+    except Exception as e:
+        trace_swallowed("backup_job", e)
+        print(f"⚠️ Backup failed: {e}")
+
+@tasks.loop(hours=6)
+async def archive_job():
+    total = 0
+    try:
+        while True:
+            moved = await asyncio.to_thread(archive_closed_events)
+            total += moved
+            if moved < ARCHIVE_BATCH_EVENTS: break
+    except Exception as e:
+        trace_swallowed("archive_job", e)
+        print(f"⚠️ Archive failed: {e}")
+    if total: print(f"🧊 Archived {total} closed events")
+
 @tasks.loop(minutes=1)
+@instrumented("auto_reminder")
 async def auto_reminder():
     now = bangkok_now()
     conn = sqlite3.connect(DB_NAME)
@@ -1193,29 +4163,65 @@ async def auto_reminder():
             event_dt = parse_event_datetime(ev[2], ev[3])
             if not event_dt: continue
             diff = (event_dt - now).total_seconds()
-            if 1740 < diff <= 1800:
+            if 1740 < diff <= 1800 and reminder_due(ev[0], ev[2], ev[3], "30m"):
                 ch = bot.get_channel(ALERT_CHANNEL_ID_FIXED)
-                if ch: await ch.send(f"📢 **แจ้งเตือน Event #{ev[0]}:** อีก 30 นาทีจะเริ่ม **{ev[1]}**! @everyone")
-            elif 0 <= diff < 60:
+                if ch:
+                    await ch.send(f"📢 **แจ้งเตือน Event #{ev[0]}:** อีก 30 นาทีจะเริ่ม **{ev[1]}**! @everyone")
+                    mark_reminder_sent(ev[0], ev[2], ev[3], "30m")
+            elif 0 <= diff < 60 and reminder_due(ev[0], ev[2], ev[3], "start"):
                 ch = bot.get_channel(ALERT_CHANNEL_ID_FIXED)
-                if ch: await ch.send(f"⚔️ **ถึงเวลากิจกรรมแล้ว!** Event #{ev[0]}: **{ev[1]}** เริ่มแล้ว ลุยเลย! @everyone")
-        except: pass
+                if ch:
+                    await ch.send(f"⚔️ **ถึงเวลากิจกรรมแล้ว!** Event #{ev[0]}: **{ev[1]}** เริ่มแล้ว ลุยเลย! @everyone")
+                    mark_reminder_sent(ev[0], ev[2], ev[3], "start")
+        except Exception as e: trace_swallowed("auto_reminder.event", e)
 
     c = conn.cursor()
     c.execute("SELECT user_id, expiry_date FROM leave_records WHERE expiry_date IS NOT NULL")
     leave_rows = c.fetchall()
-    cleared = False
+    cleared = []
     for uid, exp_str in leave_rows:
         try:
             exp_dt = datetime.strptime(exp_str, "%Y-%m-%d %H:%M:%S").replace(tzinfo=pytz.timezone('Asia/Bangkok'))
             if now > exp_dt:
                 c.execute("DELETE FROM leave_records WHERE user_id=?", (uid,))
-                cleared = True
-        except: pass
+                cleared.append(uid)
+        except Exception as e: trace_swallowed("auto_reminder.leave_expiry", e)
     if cleared:
         conn.commit()
+        for uid in cleared: on_leave_changed(uid)
         asyncio.create_task(refresh_leave_board(bot))
-        asyncio.create_task(refresh_all_active_wars(bot))
+        asyncio.create_task(refresh_leave_dependents(bot))
     conn.close()
 
-bot.run('Y')
\ No newline at end of file
+@tasks.loop(minutes=WARM_STATE_INTERVAL_MINUTES)
+async def warm_state_job():
+    try: await asyncio.to_thread(write_warm_state, dump_warm_state())
+    except Exception as e: trace_swallowed("warm_state_job", e)
+
+# --- CLI ---
+def cli(argv):
+    import argparse
+    parser = argparse.ArgumentParser(prog="main.py", description="Guild War bot (ไม่ใส่คำสั่ง = รันบอท)")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_backup = sub.add_parser("backup", help="สำรองฐานข้อมูลทันที")
+    p_backup.add_argument("--dir", default=BACKUP_DIR)
+    p_restore = sub.add_parser("restore", help="กู้คืนจากไฟล์ .db.gz (หยุดบอทก่อน)")
+    p_restore.add_argument("path")
+    p_restore.add_argument("--target", default=None, help=f"ไฟล์ปลายทาง (ค่าเริ่มต้นเลือกจากชื่อไฟล์: {DB_NAME} หรือ {ARCHIVE_DB_NAME})")
+    p_restore.add_argument("--allow-unverified", action="store_true", help="ยอม restore ไฟล์ที่ไม่มี .sha256 (ไม่แนะนำ)")
+    p_traces = sub.add_parser("traces", help="สรุป trace ที่ช้าที่สุดและ error ที่ถูกกลืนบ่อยที่สุด")
+    p_traces.add_argument("--file", default=TRACE_FILE)
+    p_traces.add_argument("--top", type=int, default=10)
+    args = parser.parse_args(argv)
+    if args.cmd == "traces":
+        print(summarize_traces(args.file, args.top))
+    elif args.cmd == "backup":
+        for path in run_backups(args.dir): print(f"💾 {path}")
+    elif args.cmd == "restore":
+        print(f"✅ Restored {args.path} -> {restore_backup(args.path, args.target, args.allow_unverified)}")
+    return 0
+
+if __name__ == "__main__":
+    import sys
+    if len(sys.argv) > 1: sys.exit(cli(sys.argv[1:]))
+    bot.run('Y')
\ No newline at end of file